@@ -1,32 +1,22 @@
-from backend.sky_handling import query, sky_process, sky_init, get_img
-from PyQt5.QtCore import pyqtSignal, QObject, QThread
+from PyQt5.QtCore import pyqtSignal, QObject
 from datetime import datetime
-from astroquery.exceptions import InvalidQueryError
-from requests.exceptions import ConnectTimeout
-from backend.variables import fovs, ob_path
-from reproject import reproject_interp
-from reproject.mosaicking import reproject_and_coadd, find_optimal_celestial_wcs
-from backend.ob import read_ob, read_eph, process_eph, process_desc
-import astropy.units as u
+from backend.variables import fovs, ob_path, checkpoint_path
+from backend.instrument import Tracer, Cancelled, format_breakdown
+from backend.footprint import footprints, rotation_sweep, best_windows, best_date
+from backend.variables import stage_weights, trace_path, rot_sweep, survey
+from backend.variables import single_survey, survey_resolution, zoom_upgrade, timeline_samples
+from backend.variables import surveys_of
+import numpy as np
+import logging
 import os
 
-class BackThread(QThread):
-    '''
-    Thread to stop GUI from freezing.
-    '''
-
-    def __init__(self, signal_update, prog):
-        super().__init__()
-        self.signal_update = signal_update
-        self.prog = prog
 
-    def update(self):
-        self.signal_update.emit(self.prog)
+# astropy, astroquery, reproject and the modules that use them are imported by
+# the methods that need them, so that the window shows without waiting for
+# them. They are usually already loaded by then, see backend.warmup.
 
-    def run(self):
-        self.update()
-        
 
+log = logging.getLogger(__name__)
 
 
 class Backend(QObject):
@@ -49,16 +39,43 @@ class Backend(QObject):
 
     signal_progress: pyqtSignal object. Sends an update message and percent to the progressbar.
 
+    signal_timing: pyqtSignal object. Sends the timing breakdown of the last run.
+
+    signal_skyfov: pyqtSignal object. Sends the FOV footprint of the selected date.
+
+    signal_sweep: pyqtSignal object. Sends the contamination of every date and FOV rotation.
+
+    signal_inst: pyqtSignal object. Sends the instrument of an opened session.
+
+    signal_targets: pyqtSignal object. Sends the IDs of the targets of a night plan.
+
+    signal_bands: pyqtSignal object. Sends the bands of the mosaic.
+
+    signal_image: pyqtSignal object. Sends the mosaic of the selected band.
+
+    signal_detail: pyqtSignal object. Sends a sharper cutout of the view of the mosaic.
+
+    signal_best: pyqtSignal object. Sends the best date and clean windows of the shown target.
+
     finished: pyqtSignal object. Alerts the main thread that all of the processes has been finished.
 
+    checkpoint: backend.checkpoint.Checkpoint or None. Everything fetched by the
+    last query, kept until it completes.
+
     -------------
     Methods
     -------------
 
     validation:
+    cancel:
     retrieve_eph:
     sky_generator:
     send_mosaic:
+    finish:
+    plan_night:
+    select_target:
+    save_session:
+    open_session:
 
     '''
 
@@ -66,23 +83,43 @@ class Backend(QObject):
     signal_splot = pyqtSignal(dict)
     signal_error = pyqtSignal(str)
     signal_progress = pyqtSignal(tuple)
-    signal_flags = pyqtSignal(str, str)
+    signal_flags = pyqtSignal(object, float)
     signal_finished = pyqtSignal()
     signal_best = pyqtSignal(str)
     signal_datebox = pyqtSignal(list)
     signal_dates = pyqtSignal(list)
-    signal_skyfov =pyqtSignal(int, int, int)
+    signal_skyfov = pyqtSignal(dict)
+    signal_sweep = pyqtSignal(dict)
+    signal_timeline = pyqtSignal(dict)
+    signal_timing = pyqtSignal(str)
+    signal_inst = pyqtSignal(str)
+    signal_targets = pyqtSignal(list)
+    signal_bands = pyqtSignal(list)
+    signal_image = pyqtSignal(object)
+    signal_detail = pyqtSignal(dict)
 
     def __init__(self, inst=None, rot=None, cat=None, validated=None, skys=None,
                  fov=None):
         super().__init__()
         self.validated = True
         self.inst = None
-        self.rot = None
+        self.rot = 0
         self.fov = None
         self.cat = None
-        self.thread = None
+        self.tracer = Tracer()
         self.skys = None
+        self.store = None
+        self.eph = None
+        self.mosaic = None
+        self.flags = None
+        self.footprints = {}
+        self.date = None
+        self.plans = {}
+        self.mosaics = {}
+        self.checkpoint = None
+        self.vizier = None
+        self.surveys = surveys_of(survey)
+        self.band = 0
 
     def validation(self, inputs: dict) -> None:
 
@@ -98,28 +135,68 @@ class Backend(QObject):
         inputs: dict.
         '''
 
-        self.thread = BackThread(self.signal_progress, (0, "Validating inputs..."))
-        self.thread.start()
+        self.tracer = Tracer(self.signal_progress.emit, stage_weights)
+        self.checkpoint = None
+        self.signal_progress.emit((0, "Validating inputs..."))
+        log.info("Validating inputs...")
 
-        #self.signal_progress.emit((0, "Validating inputs..."))
-        print("Validating inputs...")
+        try:
+            if inputs['info'] == 'targ':
 
-        if inputs['info'] == 'targ':
-            
-            self.validate_target(**inputs)
+                self.validate_target(**inputs)
 
-        elif inputs['info'] == 'coords':
+            elif inputs['info'] == 'coords':
 
-            self.validate_coords(**inputs)
+                self.validate_coords(**inputs)
 
-        elif inputs['info'] == 'ob':
+            elif inputs['info'] == 'ob':
 
-            self.validate_ob(**inputs)
+                self.validate_ob(**inputs)
+
+        except Cancelled:
+            log.info("Query cancelled.")
+            self.signal_progress.emit((0, f"Query cancelled. {self.kept()}".strip()))
+
+    def cancel(self):
+        '''
+        Cancels the running query: the requests in flight are abandoned and
+        the query stops at the next epoch. What was fetched so far is kept in
+        the checkpoint, for the next query with the same inputs.
+
+        Called straight from the GUI thread, as the backend's own thread is
+        busy with the query.
+        '''
+
+        self.tracer.cancel()
+
+    def client(self):
+        '''
+        Returns the Vizier client of the backend's queries (see
+        backend.vizier), created on first use and kept for the whole session,
+        with its connections.
+        '''
+
+        from backend.vizier import CatalogClient
+
+        if self.vizier is None:
+            self.vizier = CatalogClient()
+
+        return self.vizier
+
+    def kept(self) -> str:
+        '''
+        Returns a note on what the checkpoint of the last query keeps.
+        '''
+
+        if self.checkpoint is None or not len(self.checkpoint):
+            return ""
+
+        return f"What was fetched is kept ({len(self.checkpoint)} fields and images): query again to resume."
 
 
     def validate_target(self, info, id, start, end, time_start, 
                         time_end, step, step_u, n_result,
-                        inst, cat):
+                        inst, cat, survey=survey):
         
         '''
         Validate search by target name or ID.
@@ -128,12 +205,12 @@ class Backend(QObject):
         Parameters
         ------------
 
+        survey: str. Survey of variables.hips_surveys, or band set of
+        variables.band_sets, of the images.
         '''
         self.validated = True
 
-        print("Validating target...")
-        self.thread.prog = (5, "Validating target...")
-        #self.signal_progress.emit((5, "Validating target..."))
+        log.info("Validating target...")
         
         starttime = f'{time_start[0]}:{time_start[1]}:{time_start[2]}'
         endtime = f'{time_end[0]}:{time_end[1]}:{time_end[2]}'
@@ -145,9 +222,7 @@ class Backend(QObject):
         # Validating UTC date-time format.
             
         if self.validate_datetime(datetime_start, datetime_end):
-            print("Validated datetime...")
-            self.thread.prog = (10, "Validated datetime...")
-            #self.signal_progress.emit((10, "Validated datetime..."))
+            log.info("Validated datetime...")
         else:
             self.validated = False
 
@@ -168,7 +243,7 @@ class Backend(QObject):
 
 
         if self.validated:
-            print("Validated target...")
+            log.info("Validated target...")
             # Creating a dictionrary with all of the necessary keyword
             # args to pass onto the query method.
 
@@ -183,19 +258,28 @@ class Backend(QObject):
 
             self.inst = inst
             self.cat = cat
+            self.surveys = surveys_of(survey)
+            self.band = 0
+
+            self.tracer.plan(['query', 'sky_init', 'sky_process', 'flagging', 'footprints',
+                              'send_mosaic'])
+
+            # Several comma-separated IDs are planned together, see self.plan_night.
+            ids = [target.strip() for target in id.split(',') if target.strip()]
 
-            #self.signal_progress.emit((15, "Validated inputs..."))
-            self.thread.prog = (15, "Validated inputs...")
-            self.retrieve_eph(params_start)
+            if len(ids) > 1:
+                self.plan_night([dict(params_start, id=target) for target in ids])
+            else:
+                self.retrieve_eph(params_start)
             
 
         else:
-            print(f'Validation state: {self.validated}')
+            log.info(f'Validation state: {self.validated}')
         
 
     def validate_datetime(self, datetime_start, datetime_end):
 
-        print("Validating datetimes...")
+        log.info("Validating datetimes...")
 
         try:
             datetime.strptime(datetime_start, '%Y-%m-%d %H:%M:%S')
@@ -205,12 +289,12 @@ class Backend(QObject):
         except ValueError as e:
             # handle invalid date
             self.signal_error.emit("Invalid Date.")
-            print(f'Invalid Date: {e}')
+            log.info(f'Invalid Date: {e}')
         else:
             return True
 
     def validate_coords(self, info, ra, dec, 
-                        inst, cat):
+                        inst, cat, survey=survey):
         
         '''
         Validate coordinate search.
@@ -223,11 +307,10 @@ class Backend(QObject):
         inst: str
         rot: str
         cat: str
+        survey: str. Survey of the image. Only the first band of a band set is shown.
         '''
         
-        print("Validating coordinates...")
-        self.thread.prog = (20, "Validating coordinates...")
-        #self.signal_progress.emit((20, "Validating coordinates..."))
+        log.info("Validating coordinates...")
 
 
         # Validating RA:
@@ -256,10 +339,7 @@ class Backend(QObject):
             dec = f'{dec[0]}:{dec[1]}:{dec[2]}'
         
         if self.validated:
-            print("Validated coordinates...")
-            self.thread.prog = (25, "Validated coordinates...")
-            #self.signal_progress.emit((25, "Validated coordinates..."))
-            print(ra, dec)
+            log.info(f"Validated coordinates: {ra} {dec}")
             self.inst = inst
             self.cat = cat
 
@@ -267,9 +347,10 @@ class Backend(QObject):
                 if self.inst == key:
                     self.fov = fovs[self.inst]
 
-            self.single_img(self.fov, ra, dec)
+            self.tracer.plan(['single_img'])
+            self.single_img(self.fov, ra, dec, surveys_of(survey)[0])
         else:
-            print(f"Inputs invalid.")
+            log.info(f"Inputs invalid.")
 
 
     def validate_ob(self, id, start_date, end_date,
@@ -294,9 +375,7 @@ class Backend(QObject):
         cat: str
         '''
         
-        print("Validating OB...")
-        self.thread.prog = (10, "Validated OB...")
-        #self.signal_progress.emit((10, "Validated OB..."))
+        log.info("Validating OB...")
         
         path = os.path.join(ob_path, id)
 
@@ -307,15 +386,15 @@ class Backend(QObject):
             self.validated = False
             self.signal_error.emit("Path not found.")
         else:
+            from backend.ob import read_ob, read_eph, process_eph, process_desc
+
             ob_raw = read_ob(path)
             eph_raw = read_eph
 
             ob_processed = process_desc(ob_raw)
             eph_processed = process_eph(eph_raw)
 
-            print("Validated OB.")
-            self.thread.prog = (15, "Validated OB...")
-            #self.signal_progress.emit((15, "Validated OB..."))
+            log.info("Validated OB.")
 
     def load_ob(path):
         print("WIP")
@@ -332,45 +411,59 @@ class Backend(QObject):
 
         inputs: dict
         '''
-        
-        print("Retrieving ephemeris...")
+
+        from astroquery.exceptions import InvalidQueryError
+        from requests.exceptions import RequestException
+        from backend.checkpoint import Checkpoint
+        from backend.sky_handling import query
+
+        self.checkpoint = Checkpoint(checkpoint_path, dict(inputs, inst=self.inst,
+                                                                   surveys=self.surveys))
+        saved = self.checkpoint.eph
 
         try:
-            eph = query(**inputs)
+            with self.tracer.stage('query', msg="Retrieving ephemeris..."):
+                if inputs['id'] in saved:
+                    eph = saved[inputs['id']]
+                else:
+                    eph = saved[inputs['id']] = query(**inputs, tracer=self.tracer)
         except InvalidQueryError as e:
-            print(f"Query error. Target not found.")
-            self.signal_error.emit(e)
+            log.info(f"Query error. Target not found.")
+            self.signal_error.emit(str(e))
+        except RequestException as e:
+            self.signal_error.emit(f"Connection error. {e}")
         else:
-            print(f"Retrieved ephemeris.\nResults: {len(eph)} dates. Final date available is: \
+            log.info(f"Retrieved ephemeris.\nResults: {len(eph)} dates. Final date available is: \
 {eph['Date'][len(eph) - 1]}")
             
-            self.thread.prog = (20, "Retrieved ephemeris...")
-            #self.signal_progress.emit((20, "Retrieved ephemeris..."))
-            self.sky_generator(eph)
+            self.sky_generator(eph, self.checkpoint)
 
 
-    def single_img(self, ra, dec, fov):
+    def single_img(self, fov, ra, dec, survey=single_survey):
         '''
         Query a single image.
 
         ---------------
         Parameters
         ---------------
+        fov: int
         ra: str
         dec: str
-        fov: int
+        survey: str. Survey of variables.hips_surveys.
         '''
 
-        img_info = get_img(ra, dec, fov)
-        self.signal_splot.emit(img_info)
+        from backend.sky_handling import get_img
+
+        with self.tracer.stage('single_img', msg="Querying image..."):
+            img_info = get_img(fov, ra, dec, self.tracer, survey)
+            img_info['fov'] = fov
+            self.signal_splot.emit(img_info)
 
-        print("Sending plot to front end...")
-        self.thread.prog = (60, "Sending plot to front end...")
-        #self.signal_progress.emit((60, "Sending plot to front end..."))
+        self.finish("Successfully plotted image.")
     
 
 
-    def sky_generator(self, eph):
+    def sky_generator(self, eph, checkpoint=None):
         '''
         Uses the sky_init method from the sky_handling module
         to initilize Sky instances for every patch of sky according to the
@@ -383,81 +476,206 @@ class Backend(QObject):
 
         eph: astropy.Table instance.
         fov: int. Depends on instrument selected.
+        checkpoint: backend.checkpoint.Checkpoint or None. Keeps the catalog
+        fields and images as they are fetched, so that after an error the same
+        query only fetches the missing ones. Removed once the query completes.
         '''
 
+        from requests.exceptions import RequestException
+        from backend.sky_handling import sky_init, sky_process
+
+        fields = checkpoint.fields if checkpoint is not None else None
+        cutouts = checkpoint.cutouts if checkpoint is not None else None
+
         # Assigns FOV variable according to the chosen instrument.
 
         for key in fovs.keys():
             if self.inst == key:
                 self.fov = fovs[self.inst]
 
-        self.thread.prog = (25, "Generating skys...")
-        #self.signal_progress.emit((25, "Generating skys..."))
-        print("Generating skys...")
-
-        try:
-            skys = sky_init(eph, self.fov)
-        except ConnectTimeout as e:
-            self.signal_error(f"Connection timeout error. {e}")
-        else:
-            print("Skys generated.")
-            self.thread.prog = (30, "Generated skys...")
-            #self.signal_progress.emit((30, "Generated skys..."))
-            print("Processing skys...")
-
         try:
-            sky_process(skys, self.fov)
+            with self.tracer.stage('sky_init', total=len(eph), msg="Generating skys..."):
+                skys = sky_init(eph, self.fov, self.tracer, fields=fields, client=self.client())
+
+            with self.tracer.stage('sky_process', total=len(skys), msg="Processing skys..."):
+                store = sky_process(skys, self.fov, self.tracer, cutouts=cutouts,
+                                    surveys=self.surveys)
+        except RequestException as e:
+            self.signal_error.emit(f"Connection error. {e} {self.kept()}")
         except IndexError as e:
             self.signal_error.emit(f"Server Error: Vizier query result empty. Try again later. {e}")
         else:
-            print("Skys processed.")
-            self.thread.prog = (35, "Processed skys...")
-            #self.signal_progress.emit((35, "Processed skys..."))
-            self.send_mosaic(skys)
-            self.flagging(skys)
-            self.signal_dates.emit([sky.date.value for sky in skys])
+            if checkpoint is not None:
+                checkpoint.clear()
+
+            self.store = store
+            self.flagging(skys) # Before the mosaic, so that flagged sources are plotted.
+
+            self.eph = eph
             self.skys = skys
+            self.plans = {}
+            with self.tracer.stage('footprints', msg="Computing FOV footprints..."):
+                self.footprints = footprints(skys, self.fov, self.rot)
+
+            self.send_mosaic(skys)
+            self.signal_dates.emit(list(self.footprints.keys()))
+            self.send_best(skys[0].store.count(skys[0].store.flagged))
+            self.finish("Successfully plotted mosaic.")
 
 
     def flagging(self, skys: list):
-        
-        print("Flagging bright objects...")
-        self.thread.prog = (40, "Flagging bright objects...")
-        #self.signal_progress.emit((40, "Flagging bright objects..."))
 
-        b_flag = list(map(lambda x: x.flag_bright(), skys))
+        import astropy.units as u
+        from backend.sky_handling import flag_track
         
-        print("Flagging objects within 0.5 arcmin...")
-        self.thread.prog = (45, "Flagging objects within 0.5 arcmin...")
-        #self.signal_progress.emit((45, "Flagging objects within 0.5 arcmin..."))
-        dist_flag = list(map(lambda x: x.flag_dist(0.5 * u.arcmin), skys))
+        thresh = 0.5 * u.arcmin
+
+        # Every epoch at once, on the columns of the store.
+        with self.tracer.stage('flagging', msg="Flagging bright objects and objects within 0.5 arcmin..."):
+            brightest, flagged = flag_track(skys, thresh)
+
+        self.notify_flags(skys, brightest, thresh)
+
+    def notify_flags(self, skys: list, brightest, thresh):
+        '''
+        Makes the table of the brightness and distance flags of a track (see
+        backend.flags), from the output of backend.sky_handling.flag_track, and
+        sends it to the frontend with the flagging radius (arcsec).
+        '''
+
+        import astropy.units as u
+        from backend.flags import flag_table
+
+        self.flags = flag_table(skys, brightest)
+        self.signal_flags.emit(self.flags, thresh.to_value(u.arcsec))
+
+    def export_flags(self, path: str):
+        '''
+        Writes the flags of the shown target to a CSV file, or to a Parquet
+        file if path ends in .parquet (see backend.flags.export).
+        '''
+
+        from backend.flags import export
 
-        # We prepare an empty string to fill it with the brightness flags.
-        b_notice = f""
+        if not self.skys:
+            self.signal_error.emit("Query a target before exporting its flags.")
+            return
 
-        for item in b_flag:
-            b_notice += f'There is a {item["mag"]:.3f} mag source within \
-{item["dist"].to_string(unit=u.arcmin)} of the target on {item["date"]}\n'
+        try:
+            export(self.flags, path)
+        except ImportError as e:
+            self.signal_error.emit(f"Parquet files need the pyarrow package. {e}")
+        except OSError as e:
+            self.signal_error.emit(f"Could not export the flags. {e}")
+        else:
+            self.signal_progress.emit((100, f"Exported {len(self.flags)} flags to {path}."))
 
-        # Empty string to fill with distance info.
-        dist_notice = f""
+    def send_best(self, flagged, target=None):
+        '''
+        Sends the date with the least flux inside the FOV, and the longest
+        windows of consecutive dates without flagged sources, of the shown target.
 
-        # Filling empty string with information about distances.
-        for item in dist_flag:
-            dist_notice += f'There are {item["flagged"]} sources within \
-{item["thresh"]} of the target on {item["date"]}\n'
+        flagged: numpy array. Flagged sources of every sky.
+        target: str or None. ID of the target, for night plans.
+        '''
 
-        self.signal_flags.emit(b_notice, dist_notice)
+        dates = list(self.footprints.keys())
+
+        text = f'{target}: ' if target else ''
+        text += f'{best_date(self.footprints)}'
+
+        for start, end, n in best_windows(dates, flagged == 0)[:3]:
+            text += f'\nNo flagged sources from {start} to {end} ({n} dates)'
+
+        self.signal_best.emit(text)
+
+    def plan_night(self, targets: list):
+        '''
+        Plans several targets at once with backend.scheduler.plan_night, which
+        shares the ephemeris, catalog and image requests between them, and
+        shows the first one. The rest are shown with self.select_target.
 
-    def get_best(self):
-        pass
+        ------------
+        Parameters
+        ------------
+
+        targets: list of dicts, the inputs of self.retrieve_eph for every target.
+        '''
+
+        from requests.exceptions import RequestException
+        from backend.checkpoint import Checkpoint
+        from backend.scheduler import plan_night
+
+        for key in fovs.keys():
+            if self.inst == key:
+                self.fov = fovs[self.inst]
+
+        self.checkpoint = Checkpoint(checkpoint_path, {'targets': targets, 'inst': self.inst,
+                                                          'surveys': self.surveys})
+
+        try:
+            plans, errors = plan_night(targets, self.fov, self.rot, tracer=self.tracer,
+                                       checkpoint=self.checkpoint, surveys=self.surveys,
+                                       client=self.client())
+        except RequestException as e:
+            self.signal_error.emit(f"Connection error. {e} {self.kept()}")
+            return
+        except IndexError as e:
+            self.signal_error.emit(f"Server Error: Vizier query result empty. Try again later. {e}")
+            return
+
+        # Kept for a retry of the targets that failed.
+        if not errors:
+            self.checkpoint.clear()
+
+        for target, e in errors.items():
+            log.info(f"Could not plan {target}: {e}")
+            self.signal_error.emit(f"Could not plan {target}: {e}")
+
+        if not plans:
+            return
+
+        self.plans = plans
+        self.mosaics = {}
+
+        self.signal_targets.emit(list(plans.keys()))
+        self.select_target(next(iter(plans)))
+        self.finish(f"Successfully planned {len(plans)} targets.")
+
+    def select_target(self, target: str):
+        '''
+        Shows a target of the last night plan: its mosaic (built once, on the
+        first time it is shown), flags, dates and best windows.
+        '''
+
+        plan = self.plans.get(target)
+
+        if plan is None:
+            return
+
+        self.eph, self.skys, self.store = plan.eph, plan.skys, plan.store
+        self.footprints = footprints(plan.skys, self.fov, self.rot)
+        self.date = None
+
+        self.notify_flags(plan.skys, plan.brightest, plan.skys[0].thresh)
+
+        if target in self.mosaics:
+            self.mosaic = self.mosaics[target]
+            self.signal_plot.emit([plan.skys, self.mosaic[0], self.mosaic[1][self.band]])
+        else:
+            self.send_mosaic(plan.skys)
+            self.mosaics[target] = self.mosaic
+
+        self.signal_dates.emit(list(self.footprints.keys()))
+        self.send_best(plan.flagged, target)
 
     def send_mosaic(self, skys: list):
 
         '''
         Takes all of the generated Sky objects and sends them to the frontend,
         along with the optimal WCS and the final array created for plotting
-        the image.
+        the image. The mosaic of every band is built at once (see
+        backend.cutouts.coadd_bands), and the one of the selected band is sent.
 
         ----------
         Parameters
@@ -466,41 +684,271 @@ class Backend(QObject):
         skys: list. Contains Sky objects.
         '''
 
-        sky_hdus = [sky.hdu for sky in skys] # Storing the PrimaryHDU objects of each sky FITS
-        wcs_out, shape_out = find_optimal_celestial_wcs(sky_hdus, frame='icrs') 
-        # Creating an optimal WCS and shape for the final image
-        
-        array, footprint = reproject_and_coadd(sky_hdus,
-                                        wcs_out, shape_out=shape_out,
-                                        reproject_function=reproject_interp)
-        
-        mose = [skys, wcs_out, array]
+        from reproject.mosaicking import find_optimal_celestial_wcs
+        from backend.cutouts import coadd_bands, values, display
+
+        with self.tracer.stage('send_mosaic', msg="Building mosaic..."):
+            # Sky objects, once per image shared by a cluster of skys.
+            images = list({id(sky.hdu): sky for sky in skys}.values())
+            wcs_out, shape_out = find_optimal_celestial_wcs([sky.hdu for sky in images], frame='icrs') 
+            # Creating an optimal WCS and shape for the final image
+            
+            cube, footprint = coadd_bands([(np.stack([values(hdu) for hdu in sky.bands]), sky.wcs)
+                                           for sky in images], wcs_out, shape_out)
+            cube, scaling = display(cube)
+            
+            self.mosaic = (wcs_out, cube, scaling)
+            self.band = min(self.band, len(cube) - 1)
+            mose = [skys, wcs_out, cube[self.band]]
+
+            log.info("Sending skys to front end...")
+            self.signal_bands.emit(self.surveys[:len(cube)])
+            self.signal_plot.emit(mose)
+
+    def select_band(self, name: str):
+        '''
+        Shows the mosaic of another band of the band set, already built by
+        self.send_mosaic: nothing is fetched or reprojected again.
+        '''
+
+        if self.mosaic is None or name not in self.surveys:
+            return
+
+        self.band = self.surveys.index(name)
+        self.signal_image.emit(self.mosaic[1][self.band])
+
+    def zoom(self, view: dict):
+        '''
+        Fetches a sharper cutout of the part of the mosaic in view, when the
+        screen shows it with more pixels than the mosaic has and the survey of
+        the shown band is sharper than the mosaic (see backend.cutouts.detail),
+        and sends it to the frontend to be drawn over the mosaic.
+
+        ------------
+        Parameters
+        ------------
+
+        view: dict. 'x0', 'x1', 'y0', 'y1': limits of the view, in mosaic
+        pixels. 'pixels': screen pixels across it. 'shape': shape of the
+        mosaic shown, sent back with the cutout.
+        '''
+
+        from requests.exceptions import RequestException
+        from astropy.wcs.utils import proj_plane_pixel_scales
+        from backend.cutouts import detail
+
+        if self.mosaic is None:
+            return
+
+        wcs_out, cube, scaling = self.mosaic
+        ny, nx = cube.shape[-2:]
 
-        print("Sending skys to front end...")
-        self.thread.prog = (50, "Sending skys to front end...")
-        #self.signal_progress.emit((50, "Sending skys to front end..."))
-        self.signal_plot.emit(mose)
+        x0, x1 = max(int(np.floor(view['x0'] + 0.5)), 0), min(int(np.ceil(view['x1'] + 0.5)), nx)
+        y0, y1 = max(int(np.floor(view['y0'] + 0.5)), 0), min(int(np.ceil(view['y1'] + 0.5)), ny)
 
-    def send_skyfov(self, date):
+        if x1 <= x0 or y1 <= y0:
+            return
 
-        sky = list(filter(lambda x: (x.date.value == date), self.skys))
+        band = self.surveys[self.band]
+        factor = view['pixels'] / (x1 - x0)
 
-        self.signal_skyfov.emit(sky[0].coords.ra.value, 
-                                sky[0].coords.dec.value, self.fov)
+        native = survey_resolution.get(band)
+        if native:
+            factor = min(factor, proj_plane_pixel_scales(wcs_out)[0] * 3600 / native)
 
+        if factor < zoom_upgrade:
+            return
 
+        try:
+            data = detail(band, wcs_out, (x0, x1, y0, y1), factor, Tracer())
+        except (RequestException, Cancelled) as e:
+            log.info(f"Could not fetch a sharper cutout: {e}")
+            return
+
+        # On the scale of the mosaic shown, see backend.cutouts.display.
+        scale, zero = scaling[self.band]
+        data = (data - zero) / scale
+
+        rows, cols = data.shape
+        extent = (x0 - 0.5, x0 - 0.5 + cols / factor, y0 - 0.5, y0 - 0.5 + rows / factor)
+
+        self.signal_detail.emit({'data': data, 'extent': extent, 'shape': view['shape']})
+
+    def finish(self, msg: str):
+        '''
+        Completes the progress bar, sends the timing breakdown of the run to the
+        frontend and the logs, and writes the trace file, with the state of
+        the hosts of the remote services (see backend.fetch.health).
+        '''
+
+        breakdown = format_breakdown(self.tracer.breakdown())
+        log.info(f"Timing breakdown:\n{breakdown}")
+
+        import backend.fetch as fetch
+
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.tracer.dump(os.path.join(trace_path, f'trace-{stamp}.json'), hosts=fetch.health())
+
+        self.signal_timing.emit(breakdown)
+        self.signal_progress.emit((100, msg))
+
+    def send_skyfov(self, date: str):
+        '''
+        Sends the precomputed FOV footprint of the given date, with the
+        sources that fall inside it, to the frontend.
+        '''
+
+        footprint = self.footprints.get(date)
+
+        if footprint is None:
+            return
+
+        self.date = date
+        self.signal_skyfov.emit(footprint._asdict())
+
+    def set_rotation(self, deg: int):
+        '''
+        Recomputes the footprints of every epoch for a new FOV rotation, and
+        sends the one of the selected date again.
+        '''
+
+        self.rot = deg
 
+        if self.skys:
+            self.footprints = footprints(self.skys, self.fov, self.rot)
 
+        if self.date is not None:
+            self.send_skyfov(self.date)
 
+    def send_sweep(self):
+        '''
+        Evaluates the contamination of every epoch for every FOV rotation of
+        the rot_sweep grid and sends it to the frontend.
+        '''
+
+        if not self.skys:
+            self.signal_error.emit("Query a target before sweeping the FOV rotation.")
+            return
 
+        start, stop, step = rot_sweep
 
+        with self.tracer.stage('rotation_sweep', msg="Sweeping FOV rotations..."):
+            sweep = rotation_sweep(self.skys, self.fov, np.arange(start, stop, step))
 
+        self.signal_sweep.emit(sweep)
 
+    def send_timeline(self, cadence: str):
+        '''
+        Samples the path of the shown target every cadence seconds and sends
+        the intervals in which every star is within the flagging radius (see
+        backend.timeline), with the dates of the epochs, to the frontend.
+        '''
 
+        import astropy.units as u
+        from backend.timeline import contamination_timeline, track_path
 
+        if not self.skys or self.eph is None:
+            self.signal_error.emit("Query a target before computing its timeline.")
+            return
 
+        try:
+            cadence = float(cadence)
+        except ValueError:
+            cadence = 0.
 
+        path = track_path(self.eph)
+        samples = (path[0][-1] - path[0][0]) * 86400 / cadence if cadence > 0 else np.inf
 
+        if samples > timeline_samples:
+            self.signal_error.emit(f"The cadence must be a number of seconds, with at most "
+                                   f"{timeline_samples} samples along the track.")
+            return
+
+        with self.tracer.stage('timeline', msg="Computing the contamination timeline..."):
+            timeline = contamination_timeline(self.store, path, self.skys[0].thresh.to_value(u.deg),
+                                              cadence)
+
+        timeline['dates'] = list(self.footprints.keys())
+        self.signal_timeline.emit(timeline)
+
+    def save_session(self, path: str):
+        '''
+        Writes the current session (ephemeris, sources, cutouts, mosaic and
+        flags) to a session file, see backend.session.
+        '''
 
+        import astropy.units as u
+        import backend.session as session
 
+        if not self.skys or self.mosaic is None:
+            self.signal_error.emit("Query a target before saving the session.")
+            return
 
+        meta = {
+            'inst': self.inst,
+            'fov': self.fov,
+            'rot': self.rot,
+            'thresh': self.skys[0].thresh.to_value(u.arcmin),
+            'bands': self.surveys[:len(self.mosaic[1])],
+            'scaling': self.mosaic[2]
+        }
+
+        try:
+            with self.tracer.stage('save_session', msg="Saving session..."):
+                session.save_session(path, self.skys, *self.mosaic[:2], eph=self.eph, meta=meta)
+        except OSError as e:
+            self.signal_error.emit(f"Could not save the session. {e}")
+        else:
+            self.signal_progress.emit((100, f"Saved session to {path}."))
+
+    def open_session(self, path: str):
+        '''
+        Opens a session file and plots it as if the target had just been
+        queried, without any network access: the arrays are memory-mapped,
+        and only the footprints are computed again.
+        '''
+
+        import astropy.units as u
+        import backend.session as session
+
+        self.tracer = Tracer(self.signal_progress.emit, stage_weights)
+        self.tracer.plan(['open_session', 'footprints'])
+
+        try:
+            with self.tracer.stage('open_session', msg="Opening session..."):
+                loaded = session.load_session(path)
+        except (OSError, ValueError, KeyError) as e:
+            self.signal_error.emit(f"Could not open the session. {e}")
+            return
+
+        meta = loaded['meta']
+        skys = loaded['skys']
+
+        self.inst, self.fov, self.rot = meta['inst'], meta['fov'], meta['rot']
+        self.eph, self.store, self.skys = loaded['eph'], loaded['store'], skys
+        # Sessions of a single band may hold a 2D mosaic.
+        cube = loaded['array']
+        cube = cube[np.newaxis] if cube.ndim == 2 else cube
+
+        self.mosaic = (loaded['wcs'], cube, meta.get('scaling', [(1., 0.)] * len(cube)))
+        self.surveys = meta.get('bands', surveys_of(survey))[:len(cube)]
+        self.band = 0
+        self.date = None
+        self.plans = {}
+
+        for sky in skys:
+            sky.flag_region(meta['thresh'] * u.arcmin)
+
+        # The flags are made again from the store, which keeps them.
+        brightest = self.store.argmin(self.store.band('g'))
+
+        with self.tracer.stage('footprints', msg="Computing FOV footprints..."):
+            self.footprints = footprints(skys, self.fov, self.rot)
+
+        self.signal_inst.emit(self.inst)
+        self.notify_flags(skys, brightest, meta['thresh'] * u.arcmin)
+        self.signal_bands.emit(self.surveys)
+        self.signal_plot.emit([skys, self.mosaic[0], cube[self.band]])
+        self.signal_dates.emit(list(self.footprints.keys()))
+        self.send_best(self.store.count(self.store.flagged))
+        self.finish("Successfully opened session.")
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+from collections.abc import MutableMapping
+from astropy.io import fits
+from backend.cutouts import raw_hdu
+from backend.variables import compress_cutouts
+
+
+'''
+Checkpoints of the queries: every ephemeris, catalog field and image cutout
+is written to disk as soon as it is fetched, so that a query that times out or
+is cancelled halfway can be run again fetching only what is missing.
+
+A checkpoint belongs to one set of query parameters, and is removed once the
+query completes.
+'''
+
+
+log = logging.getLogger(__name__)
+
+
+class Saved(MutableMapping):
+
+    '''
+    Dict whose values are also written to a folder, one file per key, and
+    read back from it by a new instance on the same folder. Keys are stored as
+    strings, so 3 and '3' are the same key.
+
+    -------------
+    Attributes
+    -------------
+
+    folder: str. Folder of the files.
+    kind: str. 'pickle' for any picklable object (e.g. astroquery TableList),
+    'fits' for lists of astropy.io.fits.PrimaryHDU objects (e.g. the bands of
+    a cutout), one extension each, tile-compressed if compress is True.
+    compress: bool. By default, variables.compress_cutouts.
+    '''
+
+    suffixes = {'pickle': '.pkl', 'fits': '.fits'}
+
+    def __init__(self, folder: str, kind='pickle', compress=compress_cutouts):
+        self.folder = folder
+        self.kind = kind
+        self.compress = compress
+        self._values = {}
+
+    def _path(self, key) -> str:
+        return os.path.join(self.folder, f'{key}{self.suffixes[self.kind]}')
+
+    def _load(self, path):
+        if self.kind == 'fits':
+            # Unscaled, as they were stored (see backend.cutouts.compact).
+            with fits.open(path, do_not_scale_image_data=True) as hdul:
+                # Read into memory, detached from the file (see backend.fetch).
+                return [raw_hdu(hdu.data.copy(), hdu.header.copy()) for hdu in hdul[1:]]
+
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _dump(self, value, path):
+        if self.kind == 'fits':
+            kind = fits.CompImageHDU if self.compress else fits.ImageHDU
+            hdus = [raw_hdu(hdu.data, hdu.header, kind) for hdu in value]
+            fits.HDUList([fits.PrimaryHDU(), *hdus]).writeto(path, overwrite=True)
+        else:
+            with open(path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __getitem__(self, key):
+        key = str(key)
+
+        if key not in self._values:
+            path = self._path(key)
+            if not os.path.exists(path):
+                raise KeyError(key)
+            self._values[key] = self._load(path)
+
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        key = str(key)
+        os.makedirs(self.folder, exist_ok=True)
+
+        # Written under another name first, so that a file is either whole or
+        # missing even if the application stops while writing it.
+        path = self._path(key)
+        self._dump(value, path + '.part')
+        os.replace(path + '.part', path)
+
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        key = str(key)
+        self._values.pop(key, None)
+
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        key = str(key)
+        return key in self._values or os.path.exists(self._path(key))
+
+    def __iter__(self):
+        suffix = self.suffixes[self.kind]
+        names = os.listdir(self.folder) if os.path.isdir(self.folder) else []
+        return iter([name[:-len(suffix)] for name in sorted(names) if name.endswith(suffix)])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class Checkpoint:
+
+    '''
+    Everything fetched by a query with the given parameters. Two queries with
+    the same parameters share the checkpoint.
+
+    -------------
+    Attributes
+    -------------
+
+    path: str. Folder of the checkpoint.
+    eph: Saved. Ephemerides, by target ID.
+    fields: Saved. Results of backend.sky_handling.query_field, by label of
+    the field (see backend.clusters).
+    cutouts: Saved. Bands of the image of every field, by label.
+
+    -------------
+    Methods
+    -------------
+
+    clear: Removes the checkpoint, once the query is complete.
+    '''
+
+    def __init__(self, folder: str, params: dict):
+        key = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+        self.path = os.path.join(folder, key[:16])
+        self.eph = Saved(os.path.join(self.path, 'eph'))
+        self.fields = Saved(os.path.join(self.path, 'fields'))
+        self.cutouts = Saved(os.path.join(self.path, 'cutouts'), 'fits')
+
+    def __len__(self):
+        return len(self.fields) + len(self.cutouts)
+
+    def clear(self):
+        '''
+        Removes the files of the checkpoint.
+        '''
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        log.debug(f'Removed checkpoint {self.path}')
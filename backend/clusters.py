@@ -0,0 +1,111 @@
+import numpy as np
+from backend.projection import gnomonic
+from backend.dedup import unit_vectors
+
+
+'''
+Grouping of the epochs of a track whose centers are close enough to share
+one catalog query and one image cutout.
+'''
+
+
+def cluster_track(ra, dec, tol: float):
+    '''
+    Greedy clustering of the epoch centers along the track. An epoch joins the
+    current cluster while it is within tol of the first epoch of the cluster
+    (its anchor), otherwise it starts a new cluster. A field of side fov + 2 tol
+    around the anchor covers the FOV of every member.
+
+    Returns the cluster label of every epoch and the index of the anchor of
+    every cluster.
+
+    --------------
+    Parameters
+    --------------
+
+    ra, dec: numpy arrays. Epoch centers in track order (deg).
+    tol: float. Largest offset of a member from its anchor (deg).
+    '''
+
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+
+    labels = np.zeros(len(ra), dtype=int)
+    anchors = []
+
+    start = 0
+    while start < len(ra):
+        anchors.append(start)
+
+        # Offsets of the remaining epochs from the anchor, in one pass.
+        xi, eta = gnomonic(ra[start:], dec[start:], ra[start], dec[start])
+        far = np.flatnonzero(np.maximum(np.abs(xi), np.abs(eta)) > tol)
+        stop = start + (far[0] if len(far) else len(xi))
+
+        labels[start:stop] = len(anchors) - 1
+        start = stop
+
+    return labels, np.array(anchors, dtype=int)
+
+
+def members_in_box(ra, dec, center_ra, center_dec, width: float):
+    '''
+    Returns the indices of the positions (ra, dec) inside the square box of
+    side width (deg) centered on (center_ra, center_dec), measured on the
+    tangent plane.
+    '''
+
+    xi, eta = gnomonic(ra, dec, center_ra, center_dec)
+
+    return np.flatnonzero((np.abs(xi) <= width / 2) & (np.abs(eta) <= width / 2))
+
+
+
+def share_clusters(tracks: list, tol: float):
+    '''
+    Groups the epochs of several tracks into shared fields. The epochs of a
+    track within tol of the anchor of a field made for an earlier track join
+    that field, and the rest are clustered along the track (cluster_track)
+    into new fields. Every epoch is thus within tol of the anchor of its
+    field, which is covered by a square of side fov + 2 tol around the
+    anchor, as for a single track.
+
+    Returns the field of every epoch of every track, and the RA and Dec of
+    the anchor of every field.
+
+    --------------
+    Parameters
+    --------------
+
+    tracks: list of (ra, dec) pairs of numpy arrays. Epoch centers of every
+    track in track order (deg).
+    tol: float. Largest offset of an epoch from the anchor of its field (deg).
+    '''
+
+    field_ra, field_dec = np.empty(0), np.empty(0)
+    labels = []
+
+    for ra, dec in tracks:
+        ra = np.asarray(ra, dtype=float)
+        dec = np.asarray(dec, dtype=float)
+
+        fields = np.full(len(ra), -1)
+
+        if len(field_ra):
+            # Offsets of every epoch from every field anchor, in one pass. The
+            # projection also maps the far hemisphere, which is left out.
+            xi, eta = gnomonic(ra[:, None], dec[:, None], field_ra[None, :], field_dec[None, :])
+            facing = unit_vectors(ra, dec) @ unit_vectors(field_ra, field_dec).T > 0
+            inside = (np.maximum(np.abs(xi), np.abs(eta)) <= tol) & facing
+
+            fields[inside.any(axis=1)] = np.argmax(inside, axis=1)[inside.any(axis=1)]
+
+        rest = np.flatnonzero(fields < 0)
+        clusters, anchors = cluster_track(ra[rest], dec[rest], tol)
+        fields[rest] = len(field_ra) + clusters
+
+        field_ra = np.append(field_ra, ra[rest][anchors])
+        field_dec = np.append(field_dec, dec[rest][anchors])
+        labels.append(fields)
+
+    return labels, field_ra, field_dec
@@ -0,0 +1,146 @@
+import numpy as np
+from astropy.table import Table
+from scipy.spatial import cKDTree
+from backend.dedup import unit_vectors
+import backend.variables as v
+
+
+'''
+Crossmatch of catalogs, to gather the magnitudes of every star in all the
+bands of the optical and infrared catalogs.
+'''
+
+
+def compact(table, name: str) -> dict:
+    '''
+    Returns the positions and magnitudes of a catalog table as a dict of
+    numpy arrays: 'ra' and 'dec' (float64, deg) and 'bands', a dict with
+    the magnitude of every band of the catalog (float32, NaN if missing).
+    The columns are looked up in v.catalog_columns.
+
+    --------------
+    Parameters
+    --------------
+
+    table: astropy Table or None. A Vizier result of the catalog. None is
+    taken as an empty table.
+    name: str. Catalog name, a key of v.catalog_columns.
+    '''
+
+    columns = v.catalog_columns[name]
+
+    if table is None:
+        empty = np.empty(0)
+        return {'ra': empty, 'dec': empty,
+                'bands': {band: empty.astype(np.float32) for band in columns['bands']}}
+
+    def values(col, dtype):
+        column = table[col]
+        data = np.asarray(getattr(column, 'data', column), dtype=dtype)
+        mask = getattr(column, 'mask', None)
+
+        if mask is not None and np.any(mask):
+            data = np.where(mask, np.nan, data).astype(dtype)
+
+        return data
+
+    info = {
+        'ra': values(columns['ra'], np.float64),
+        'dec': values(columns['dec'], np.float64),
+        'bands': {band: values(col, np.float32) for band, col in columns['bands'].items()}
+    }
+
+    return info
+
+
+def nearest(ra1, dec1, ra2, dec2, radius: float):
+    '''
+    Returns, for every position of the first set, the index of the nearest
+    position of the second set within radius (arcsec), or -1, and their
+    separation (arcsec, NaN without a match). Matches are one to one: when
+    several positions share a nearest neighbour, only the closest keeps it.
+
+    The second set goes in a k-d tree of unit vectors, so matching takes
+    O(n log n) and works anywhere on the sky.
+    '''
+
+    j = np.full(len(ra1), -1)
+    sep = np.full(len(ra1), np.nan)
+
+    if not len(ra1) or not len(ra2):
+        return j, sep
+
+    chord = 2 * np.sin(np.radians(radius / 3600) / 2)
+
+    # Threads only pay off on large sets.
+    workers = -1 if len(ra1) > 100_000 else 1
+
+    tree = cKDTree(unit_vectors(ra2, dec2))
+    dist, found = tree.query(unit_vectors(ra1, dec1), distance_upper_bound=chord,
+                             workers=workers)
+
+    # Closest claim first, so that unique keeps the closest one of every target.
+    hits = np.flatnonzero(np.isfinite(dist))
+    hits = hits[np.argsort(dist[hits], kind='stable')]
+    _, first = np.unique(found[hits], return_index=True)
+    hits = hits[first]
+
+    j[hits] = found[hits]
+    sep[hits] = np.degrees(2 * np.arcsin(dist[hits] / 2)) * 3600
+
+    return j, sep
+
+
+def crossmatch(left, right, radius: float, names=('SDSS16', '2MASS')) -> Table:
+    '''
+    Joins two catalog tables by nearest neighbour within radius (arcsec) and
+    returns a compact astropy Table with one row per star: every row of left,
+    with its match in right if any, followed by the rows of right without a
+    match. Columns:
+
+    'ra', 'dec': float64 (deg). From left when the star is in left.
+    One float32 column per band of both catalogs, NaN where the star is not
+    detected. Bands named alike in both catalogs get the catalog name of
+    right as a suffix.
+    'sep': float32. Separation of the match (arcsec), NaN without a match.
+    '<name>_row': int32. Row of the star in each input table, -1 if missing.
+
+    --------------
+    Parameters
+    --------------
+
+    left, right: astropy Tables or None. Vizier results of both catalogs.
+    radius: float. Match radius (arcsec).
+    names: tuple of str. Catalog names of left and right, keys of v.catalog_columns.
+    '''
+
+    a, b = compact(left, names[0]), compact(right, names[1])
+    n_a = len(a['ra'])
+
+    j, sep = nearest(a['ra'], a['dec'], b['ra'], b['dec'], radius)
+
+    alone = np.setdiff1d(np.arange(len(b['ra'])), j[j >= 0])
+    rows_a = np.concatenate([np.arange(n_a), np.full(len(alone), -1)])
+    rows_b = np.concatenate([j, alone])
+    has_b = rows_b >= 0
+
+    columns = {
+        'ra': np.concatenate([a['ra'], b['ra'][alone]]),
+        'dec': np.concatenate([a['dec'], b['dec'][alone]])
+    }
+
+    for band, mags in a['bands'].items():
+        columns[band] = np.concatenate([mags, np.full(len(alone), np.nan, dtype=np.float32)])
+
+    for band, mags in b['bands'].items():
+        column = np.full(len(rows_b), np.nan, dtype=np.float32)
+        column[has_b] = mags[rows_b[has_b]]
+        columns[band if band not in columns else f'{band}_{names[1]}'] = column
+
+    columns['sep'] = np.concatenate([sep, np.full(len(alone), np.nan)]).astype(np.float32)
+
+    for name, rows in zip(names, (rows_a, rows_b)):
+        columns[f'{name.lower().replace(" ", "_")}_row'] = rows.astype(np.int32)
+
+    # Built in one go, without copying the arrays.
+    return Table(columns, copy=False)
@@ -0,0 +1,306 @@
+import json
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from astropy.io import fits
+import backend.fetch as fetch
+from backend.instrument import Tracer
+from backend.variables import hips_surveys, cutout_cache, survey_resolution
+from backend.variables import display_pixels, image_dtype, surveys_of
+
+
+'''
+Image cutouts of the HiPS surveys (variables.hips_surveys) from hips2fits.
+The bands of a band set are fetched at once, on the same pixel grid, so that
+they can be stacked, and every cutout is kept in a cache shared by the whole
+application: showing another band, or querying the same field again, does
+not fetch it again. The mosaic of a band set is made with a single
+reprojection of every image, for all its bands at once (coadd_bands).
+
+Cutouts and mosaics are only displayed, so they are kept in float32, or in
+int16 scaled to their range (variables.image_dtype, see compact and display).
+
+The size of the cutouts follows what can be seen of them (pixel_scale): the
+screen shows a few hundred pixels across a sky, and no survey is sharper than
+its native resolution. Zooming into the mosaic fetches a sharper cutout of
+the view only (detail).
+'''
+
+
+cache = OrderedDict() # (survey, query parameters) -> PrimaryHDU, least recently used first.
+
+_cache_lock = threading.Lock()
+
+_scaling = ('BSCALE', 'BZERO', 'BLANK')
+
+
+def raw_hdu(data, header, kind=fits.PrimaryHDU):
+    '''
+    Returns an HDU of the given kind with the data as they are, and the
+    header with its scaling keywords, which astropy drops when it is given
+    the data. They are kept for integer data only: floats are already scaled.
+    '''
+
+    hdu = kind(data=data, header=header)
+
+    if data.dtype.kind != 'f':
+        for key in _scaling:
+            if key in header:
+                hdu.header[key] = header[key]
+
+    return hdu
+
+
+def compact(hdu, dtype=image_dtype) -> fits.PrimaryHDU:
+    '''
+    Returns a cutout stored as dtype: 'float32', or 'int16' with BSCALE and
+    BZERO spanning the range of its values (a step of 1/65533 of it) and NaN
+    as BLANK, as in FITS files. The header keeps the WCS.
+    '''
+
+    data = np.asarray(hdu.data, dtype=np.float32)
+    header = hdu.header.copy()
+
+    for key in _scaling:
+        header.remove(key, ignore_missing=True)
+
+    if dtype != 'int16':
+        return fits.PrimaryHDU(data=data, header=header)
+
+    raw, scale, zero = quantize(data)
+    header['BSCALE'], header['BZERO'], header['BLANK'] = scale, zero, -32768
+
+    return raw_hdu(raw, header)
+
+
+def quantize(data) -> tuple:
+    '''
+    Returns data in int16, spanning their range from -32767 to 32766, with
+    -32768 where they are NaN, and the scale and zero that give them back:
+    data = raw * scale + zero.
+    '''
+
+    finite = np.isfinite(data)
+    low, high = (float(data[finite].min()), float(data[finite].max())) if finite.any() else (0., 0.)
+
+    scale = (high - low) / 65533 or 1.
+    zero = low + 32767 * scale
+
+    raw = np.full(data.shape, -32768, dtype=np.int16)
+    raw[finite] = np.clip(np.round((data[finite] - zero) / scale), -32767, 32766)
+
+    return raw, scale, zero
+
+
+def display(mosaic, dtype=image_dtype) -> tuple:
+    '''
+    Returns a mosaic (bands, ny, nx) as it is kept for display: float32, or
+    every band in int16 scaled to its range (see quantize). The scaling is
+    linear, so the mosaic looks the same with a normalization by percentiles.
+    Also returns the (scale, zero) of every band.
+    '''
+
+    if dtype != 'int16':
+        return mosaic, [(1., 0.)] * len(mosaic)
+
+    out = np.empty(mosaic.shape, dtype=np.int16)
+    scaling = []
+
+    for band in range(len(mosaic)):
+        out[band], scale, zero = quantize(mosaic[band])
+        scaling.append((scale, zero))
+
+    return out, scaling
+
+
+def values(hdu) -> np.ndarray:
+    '''
+    Returns the values of a cutout as float32, whichever way it is stored
+    (see compact), with NaN where they are blank.
+    '''
+
+    data, header = hdu.data, hdu.header
+
+    if data.dtype.kind == 'f':
+        return np.asarray(data, dtype=np.float32)
+
+    out = data.astype(np.float32) * np.float32(header.get('BSCALE', 1.)) + np.float32(header.get('BZERO', 0.))
+
+    if 'BLANK' in header:
+        out[data == header['BLANK']] = np.nan
+
+    return out
+
+
+def cutout(survey: str, params: dict, tracer=None) -> fits.PrimaryHDU:
+    '''
+    Returns the cutout of a survey with the given hips2fits parameters (ra,
+    dec, fov, width, height), from the cache if it was already fetched.
+    '''
+
+    tracer = tracer or Tracer()
+    key = (survey, tuple(sorted(params.items())))
+
+    with _cache_lock:
+        hdu = cache.get(key)
+        if hdu is not None:
+            cache.move_to_end(key)
+
+    tracer.cache('cutouts', hit=hdu is not None)
+
+    if hdu is not None:
+        return hdu
+
+    hdu = compact(fetch.fits_file(dict(params, hips=hips_surveys[survey]), tracer)[0])
+
+    with _cache_lock:
+        cache[key] = hdu
+
+        # Least recently used cutouts out, down to the size of the cache.
+        size = sum(h.data.nbytes for h in cache.values())
+        while size > cutout_cache * 2 ** 20 and len(cache) > 1:
+            _, old = cache.popitem(last=False)
+            size -= old.data.nbytes
+
+    return hdu
+
+
+def pixel_scale(surveys: list, extent: float, pixels=display_pixels) -> float:
+    '''
+    Returns the pixel scale (arcsec) of the cutouts of the given surveys, for
+    a background of extent arcmin shown on screen: pixels across it, but not
+    sharper than the native resolution of the sharpest survey.
+    '''
+
+    native = min(survey_resolution.get(survey, 0.) for survey in surveys)
+
+    return max(native, extent * 60 / pixels)
+
+
+def fetch_bands(params: dict, surveys: list, tracer=None) -> list:
+    '''
+    Returns the cutouts of every survey with the same hips2fits parameters,
+    in the order of surveys, fetched concurrently. They share the pixel grid
+    and the WCS of the first one.
+    '''
+
+    tracer = tracer or Tracer()
+
+    if len(surveys) == 1:
+        return [cutout(surveys[0], params, tracer)]
+
+    with ThreadPoolExecutor(max_workers=len(surveys)) as pool:
+        return list(pool.map(lambda survey: cutout(survey, params, tracer), surveys))
+
+
+def coadd_bands(images: list, wcs_out, shape_out):
+    '''
+    Reprojects and coadds images of several bands into one mosaic per band,
+    averaging the overlaps, as reproject_and_coadd does for a single band.
+    Every image is reprojected once for all its bands, and only onto the part
+    of the mosaic it covers.
+
+    Returns the mosaic of every band (bands, ny, nx) and the coverage of every
+    pixel (ny, nx), in float32.
+
+    --------------
+    Parameters
+    --------------
+
+    images: list of (array, wcs). array: (bands, y, x) stack of the values of
+    the bands of an image (see values), wcs: its celestial astropy.wcs.WCS.
+    wcs_out: astropy.wcs.WCS of the mosaic.
+    shape_out: tuple. (ny, nx) of the mosaic.
+    '''
+
+    from reproject import reproject_interp
+
+    bands = images[0][0].shape[0]
+    ny, nx = shape_out
+
+    total = np.zeros((bands, ny, nx), dtype=np.float32)
+    weight = np.zeros((ny, nx), dtype=np.float32)
+
+    for array, wcs in images:
+        h, w = array.shape[-2:]
+
+        # Bounding box of the image on the mosaic, from its edges.
+        xs = np.concatenate([np.linspace(-0.5, w - 0.5, 20), np.full(20, w - 0.5),
+                             np.linspace(-0.5, w - 0.5, 20), np.full(20, -0.5)])
+        ys = np.concatenate([np.full(20, -0.5), np.linspace(-0.5, h - 0.5, 20),
+                             np.full(20, h - 0.5), np.linspace(-0.5, h - 0.5, 20)])
+        x, y = wcs_out.world_to_pixel_values(*wcs.pixel_to_world_values(xs, ys))
+
+        if not (np.isfinite(x).all() and np.isfinite(y).all()):
+            x0, x1, y0, y1 = 0, nx, 0, ny
+        else:
+            x0, x1 = max(int(np.floor(x.min())), 0), min(int(np.ceil(x.max())) + 1, nx)
+            y0, y1 = max(int(np.floor(y.min())), 0), min(int(np.ceil(y.max())) + 1, ny)
+
+        if x1 <= x0 or y1 <= y0:
+            continue
+
+        data = np.empty((bands, y1 - y0, x1 - x0), dtype=np.float32)
+        footprint = np.empty_like(data)
+
+        reproject_interp((array, wcs), wcs_out[y0:y1, x0:x1], shape_out=data.shape,
+                         output_array=data, output_footprint=footprint)
+
+        footprint = footprint[0]
+        total[:, y0:y1, x0:x1] += np.nan_to_num(data, copy=False) * footprint
+        weight[y0:y1, x0:x1] += footprint
+
+    # In place, the mosaic can be large.
+    np.divide(total, weight, out=total, where=weight > 0)
+    total[:, weight == 0] = 0.
+
+    return total, weight
+
+
+def detail_wcs(wcs, x0: int, x1: int, y0: int, y1: int, factor: float):
+    '''
+    Returns the WCS of the region [x0, x1) x [y0, y1) of a mosaic, in pixels
+    factor times smaller, and its shape (ny, nx). The pixels of the region
+    are an exact subdivision of the mosaic ones, so it can be drawn over the
+    mosaic without reprojecting it.
+    '''
+
+    nx = int(np.ceil((x1 - x0) * factor))
+    ny = int(np.ceil((y1 - y0) * factor))
+
+    sub = wcs.deepcopy()
+    crpix = sub.wcs.crpix - 1 # 0-based mosaic pixels.
+    sub.wcs.crpix = [(crpix[0] - x0 + 0.5) * factor + 0.5, (crpix[1] - y0 + 0.5) * factor + 0.5]
+
+    if sub.wcs.has_cd():
+        sub.wcs.cd = sub.wcs.cd / factor
+    else:
+        sub.wcs.cdelt = sub.wcs.cdelt / factor
+
+    return sub, (ny, nx)
+
+
+def detail(survey: str, wcs, region: tuple, factor: float, tracer=None) -> np.ndarray:
+    '''
+    Returns a cutout of a region of a mosaic, factor times sharper than it,
+    fetched from hips2fits directly on the grid of detail_wcs (its wcs
+    parameter), so that nothing is reprojected.
+
+    --------------
+    Parameters
+    --------------
+
+    survey: str. Survey of variables.hips_surveys.
+    wcs: astropy.wcs.WCS of the mosaic.
+    region: tuple. (x0, x1, y0, y1), integer pixel bounds on the mosaic.
+    factor: float. Mosaic pixels per pixel of the cutout, along each axis.
+    '''
+
+    sub, (ny, nx) = detail_wcs(wcs, *region, factor)
+
+    header = sub.to_header()
+    header['NAXIS1'], header['NAXIS2'] = nx, ny
+    params = {'wcs': json.dumps({key: header[key] for key in header})}
+
+    return values(cutout(survey, params, tracer))
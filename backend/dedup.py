@@ -0,0 +1,152 @@
+import numpy as np
+
+
+'''
+Merging of repeated detections of the same source, within one catalog
+(overlapping survey fields) or across catalogs.
+'''
+
+
+def unit_vectors(ra, dec):
+    '''
+    Returns the positions (ra, dec), in degrees, as an array (n, 3) of unit
+    vectors.
+    '''
+
+    ra, dec = np.radians(ra), np.radians(dec)
+    cos_dec = np.cos(dec)
+
+    return np.column_stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)])
+
+
+def close_pairs(ra, dec, tol: float):
+    '''
+    Returns the index arrays (i, j), i < j, of every pair of positions closer
+    than tol (arcsec).
+
+    The sky is cut in declination strips of height tol and the positions are
+    sorted by strip and RA. A copy of every position is added to the strip
+    above its own, and positions close to RA 0 get a copy past RA 360, so
+    that every close pair ends up next to each other in one strip. Every
+    position is then compared, in a single vectorized step, with its k-th
+    successor, for k = 1, 2... until no successor is in the same strip within
+    the RA tolerance. At catalog densities that takes a handful of steps.
+    '''
+
+    ra = np.asarray(ra, dtype=float) % 360
+    dec = np.asarray(dec, dtype=float)
+    n = len(ra)
+
+    tol_deg = tol / 3600
+    chord2 = (2 * np.sin(np.radians(tol_deg) / 2)) ** 2
+
+    # RA tolerance, valid for the strip of a position and the next one.
+    cos_dec = np.cos(np.radians(np.minimum(np.abs(dec) + 2 * tol_deg, 90)))
+    tol_ra = np.where(cos_dec > tol_deg / 360, tol_deg / np.maximum(cos_dec, 1e-300), 360)
+
+    strip = np.floor((dec + 90) / tol_deg).astype(np.int64)
+
+    # Positions and their copies: in the strip above, and past RA 360.
+    index = np.concatenate([np.arange(n), np.arange(n)])
+    p_strip = np.concatenate([strip, strip + 1])
+    p_ra = np.concatenate([ra, ra])
+    copy = np.concatenate([np.zeros(n, dtype=bool), np.ones(n, dtype=bool)])
+
+    wrap = np.flatnonzero(p_ra < tol_ra[index])
+    index = np.concatenate([index, index[wrap]])
+    p_strip = np.concatenate([p_strip, p_strip[wrap]])
+    p_ra = np.concatenate([p_ra, p_ra[wrap] + 360])
+    copy = np.concatenate([copy, copy[wrap]])
+
+    order = np.lexsort((p_ra, p_strip))
+    index, p_strip, p_ra, copy = index[order], p_strip[order], p_ra[order], copy[order]
+    p_tol = tol_ra[index]
+
+    xyz = unit_vectors(ra, dec)
+    first, second = [], []
+    k = 1
+
+    while k < len(index):
+        near = (p_strip[k:] == p_strip[:-k]) & (p_ra[k:] - p_ra[:-k] <= p_tol[:-k])
+        if not near.any():
+            break
+
+        a = np.flatnonzero(near)
+        i, j = index[a], index[a + k]
+
+        # Two copies in the strip above are a pair of the strip below.
+        valid = (i != j) & ~(copy[a] & copy[a + k])
+        i, j = i[valid], j[valid]
+
+        hit = ((xyz[i] - xyz[j]) ** 2).sum(axis=1) <= chord2
+        first.append(i[hit])
+        second.append(j[hit])
+        k += 1
+
+    i = np.concatenate(first + [np.empty(0, dtype=int)])
+    j = np.concatenate(second + [np.empty(0, dtype=int)])
+
+    # A pair can be found twice through the RA copies.
+    pairs = np.unique(np.column_stack([np.minimum(i, j), np.maximum(i, j)]), axis=0)
+
+    return pairs[:, 0], pairs[:, 1]
+
+
+def group_pairs(n: int, i, j):
+    '''
+    Returns the group of each of n elements, given the pairs (i, j) that
+    belong together (connected components). Groups are labelled by their
+    smallest element.
+    '''
+
+    labels = np.arange(n)
+
+    # Label propagation: every pair takes the smallest label of its two ends
+    # until nothing changes. Duplicate groups are tiny, so this takes a few
+    # passes.
+    while len(i):
+        low = np.minimum(labels[i], labels[j])
+        new = labels.copy()
+        np.minimum.at(new, i, low)
+        np.minimum.at(new, j, low)
+        new = new[new]
+
+        if np.array_equal(new, labels):
+            break
+        labels = new
+
+    return labels
+
+
+def merge_duplicates(ra, dec, tol: float, priority=None):
+    '''
+    Groups the positions that are within tol (arcsec) of each other, directly
+    or through a chain of close positions, as detections of the same source.
+
+    Returns the group of every position, labelled by the index of its first
+    member, and the sorted indices of the position kept for every group: the
+    one with the lowest priority, or the first one if priority is None.
+
+    --------------
+    Parameters
+    --------------
+
+    ra, dec: numpy arrays (deg). Positions from one or several catalogs.
+    tol: float. Match radius (arcsec).
+    priority: numpy array or None. Preference of every position; lower is kept.
+    '''
+
+    n = len(ra)
+    i, j = close_pairs(ra, dec, tol)
+    groups = group_pairs(n, i, j)
+
+    if priority is None:
+        keep = np.flatnonzero(groups == np.arange(n))
+    else:
+        # Sorted by group and then by priority, the first of every group is kept.
+        order = np.lexsort((np.arange(n), np.asarray(priority), groups))
+        start = np.ones(n, dtype=bool)
+        start[1:] = groups[order][1:] != groups[order][:-1]
+        keep = np.sort(order[start])
+
+    return groups, keep
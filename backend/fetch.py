@@ -0,0 +1,309 @@
+import io
+import logging
+import threading
+import time
+import requests
+from astropy.io import fits
+from urllib.parse import urlencode
+from backend.instrument import Tracer, Cancelled, Histogram
+from backend.variables import mirrors, rate_limits, fetch_timeout, breaker_failures, breaker_reset
+from backend.variables import slow_call
+
+
+'''
+Access to the remote CDS services, shared by the whole application.
+
+Every service has a list of mirrors (variables.mirrors), tried in order. Each
+host has a token bucket that limits the rate of the requests sent to it, and a
+circuit breaker that stops sending them to a host after breaker_failures
+consecutive failures or slow calls, until breaker_reset seconds later. So a
+slow or failing host is skipped instead of stalling every query, and the
+requests go to the next mirror.
+
+The images are downloaded through one persistent session.
+'''
+
+
+log = logging.getLogger(__name__)
+
+session = requests.Session()
+
+timeout = fetch_timeout # Seconds.
+
+
+class Unavailable(requests.exceptions.ConnectionError):
+    '''
+    Raised when the circuit breakers of all the mirrors of a service are open.
+    '''
+
+
+class TokenBucket:
+
+    '''
+    Allows rate requests per second on average, and bursts of up to burst
+    requests.
+    '''
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cancelled=None):
+        '''
+        Waits until a request can be sent. The wait ends early if the given
+        threading.Event is set (e.g. Tracer.cancelled).
+        '''
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            if cancelled is not None and cancelled.wait(wait):
+                return
+            elif cancelled is None:
+                time.sleep(wait)
+
+
+class CircuitBreaker:
+
+    '''
+    Closed while the host works. Opens after failures consecutive failures,
+    and rejects every request for reset seconds. It is then half-open: a
+    single request goes through, which closes it again if it succeeds and
+    opens it for another reset seconds if it fails.
+    '''
+
+    def __init__(self, failures: int, reset: float):
+        self.failures = failures
+        self.reset = reset
+        self.state = 'closed'
+        self.count = 0
+        self.opened = 0.
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened < self.reset:
+                    return False
+                self.state, self._trial = 'half-open', False
+
+            if self.state == 'half-open':
+                if self._trial:
+                    return False
+                self._trial = True
+
+            return True
+
+    def success(self):
+        with self._lock:
+            self.state, self.count, self._trial = 'closed', 0, False
+
+    def failure(self):
+        with self._lock:
+            self.count += 1
+            if self.state == 'half-open' or self.count >= self.failures:
+                self.state, self.opened, self._trial = 'open', time.monotonic(), False
+
+    def release(self):
+        '''
+        Gives back the request of a half-open breaker without a verdict, e.g.
+        when the query was cancelled.
+        '''
+
+        with self._lock:
+            self._trial = False
+
+
+class Host:
+
+    '''
+    Token bucket, circuit breaker and latency histogram of one mirror.
+    '''
+
+    def __init__(self, service: str, mirror: str):
+        rate, burst = rate_limits.get(service, (float('inf'), 1))
+
+        self.service = service
+        self.mirror = mirror
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self.histogram = Histogram()
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, failed: bool):
+        with self._lock:
+            self.histogram.add(seconds)
+            self.requests += 1
+            self.errors += failed
+
+        if failed or seconds > slow_call:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+
+hosts = {}
+
+_hosts_lock = threading.Lock()
+
+
+def host(service: str, mirror: str) -> Host:
+    '''
+    Returns the Host of a mirror, created on first use.
+    '''
+
+    with _hosts_lock:
+        if mirror not in hosts:
+            hosts[mirror] = Host(service, mirror)
+        return hosts[mirror]
+
+
+def retryable(e: Exception) -> bool:
+    '''
+    Whether an error is the host's fault, so that another mirror may answer:
+    connection errors, timeouts, and server errors or rate limiting responses.
+    '''
+
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return e.response.status_code >= 500 or e.response.status_code == 429
+
+    return False
+
+
+def raise_for_server(response, *args, **kwargs):
+    '''
+    Response hook raising HTTPError on server errors and rate limiting, for the
+    clients that would otherwise try to parse the response (e.g. astroquery).
+    '''
+
+    if response.status_code >= 500 or response.status_code == 429:
+        response.raise_for_status()
+
+
+def call(service: str, attempt, tracer=None):
+    '''
+    Returns attempt(mirror) for the first mirror of the service that answers.
+    Mirrors whose circuit breaker is open are skipped, and the rate of every
+    host is limited. Errors that are not the host's fault (see retryable) are
+    raised right away.
+
+    --------------
+    Parameters
+    --------------
+
+    service: str. Key of variables.mirrors, e.g. 'vizier'.
+    attempt: callable. Makes the request to the given mirror.
+    tracer: backend.instrument.Tracer or None. Its cancellation stops the wait
+    for the token bucket.
+    '''
+
+    tracer = tracer or Tracer()
+    error = None
+
+    for mirror in mirrors[service]:
+        h = host(service, mirror)
+
+        if not h.breaker.allow():
+            continue
+
+        h.bucket.acquire(tracer.cancelled)
+        start = time.perf_counter()
+
+        try:
+            tracer.check()
+            result = attempt(mirror)
+        except Cancelled:
+            h.breaker.release()
+            raise
+        except Exception as e:
+            if not retryable(e):
+                h.record(time.perf_counter() - start, failed=False)
+                raise
+
+            h.record(time.perf_counter() - start, failed=True)
+            log.warning(f'{service} mirror {mirror} failed: {e}')
+            error = e
+            continue
+
+        h.record(time.perf_counter() - start, failed=False)
+
+        return result
+
+    if error is not None:
+        raise error
+
+    raise Unavailable(f"Every {service} mirror is failing. They are tried again "
+                      f"{breaker_reset:.0f} s after their last failure.")
+
+
+def get(service: str, params: dict, tracer=None) -> bytes:
+    '''
+    Downloads the response of a service to the given query parameters, from
+    the first of its mirrors that answers (see call), and returns its body.
+    The request is recorded under the service name in the tracer, and
+    abandoned if the tracer is cancelled (see Tracer.run).
+
+    --------------
+    Parameters
+    --------------
+
+    service: str. e.g. 'hips2fits'.
+    params: dict. Query parameters.
+    tracer: backend.instrument.Tracer or None.
+    '''
+
+    tracer = tracer or Tracer()
+    query = urlencode(params)
+
+    def download(mirror):
+        with tracer.request(service, session):
+            response = session.get(f'{mirror}?{query}', timeout=timeout)
+            response.raise_for_status()
+
+        return response.content
+
+    return tracer.run(call, service, download, tracer)
+
+
+def fits_file(params: dict, tracer=None) -> fits.HDUList:
+    '''
+    Downloads a FITS file from hips2fits and opens it in memory.
+    '''
+
+    hdul = fits.open(io.BytesIO(get('hips2fits', params, tracer)))
+
+    # Detaching the HDUs from the buffer, reproject would otherwise try to
+    # memory-map them from a file.
+    return fits.HDUList([hdu.copy() for hdu in hdul])
+
+
+def health() -> dict:
+    '''
+    Returns the state of the circuit breaker, the requests, the errors and the
+    latency histogram of every host used so far, by mirror.
+    '''
+
+    with _hosts_lock:
+        current = list(hosts.values())
+
+    return {h.mirror: {'service': h.service, 'state': h.breaker.state, 'requests': h.requests,
+                       'errors': h.errors, 'latency': h.histogram.as_dict()}
+            for h in current}
@@ -0,0 +1,99 @@
+import csv
+import numpy as np
+
+
+'''
+Flags of a track as a typed table, one row per flagged source and epoch,
+instead of text: they can be sorted, filtered and exported (CSV, Parquet).
+'''
+
+
+# date: epoch of the flag (UTC).
+# kind: 'brightest' for the brightest source of the sky in the g band,
+# 'nearby' for every source within the flagging radius of the target.
+# mag: g magnitude, NaN if missing.
+# sep: distance to the target (arcsec).
+# source: dedup ID of the source (SourceStore.uid), the same on every epoch.
+# ra, dec: position of the source (deg).
+flag_dtype = np.dtype([('date', 'datetime64[ms]'), ('kind', 'U9'), ('mag', 'f4'), ('sep', 'f4'),
+                       ('source', 'i4'), ('ra', 'f8'), ('dec', 'f8')])
+
+
+def flag_table(skys, brightest) -> np.ndarray:
+    '''
+    Returns the flags of a track as an array of flag_dtype, by epoch, with
+    the brightest source of every epoch first.
+
+    skys: list of Sky objects attached to the same SourceStore, already
+    flagged (see backend.sky_handling.flag_track).
+    brightest: numpy array. Brightest source of every sky, -1 if it has none
+    (output of flag_track).
+    '''
+
+    from astropy.time import Time
+
+    store = skys[0].store
+    dates = Time([sky.date for sky in skys]).datetime64
+
+    brightest = np.asarray(brightest)
+    bright_skys = np.flatnonzero(brightest >= 0)
+    nearby = np.flatnonzero(store.flagged)
+
+    rows = np.concatenate([brightest[bright_skys], nearby]).astype(np.int64)
+    owner = np.concatenate([bright_skys, store.sky[nearby]])
+    kind = np.concatenate([np.zeros(len(bright_skys), dtype=int), np.ones(len(nearby), dtype=int)])
+
+    order = np.lexsort((kind, owner))
+    rows, owner, kind = rows[order], owner[order], kind[order]
+
+    flags = np.empty(len(rows), dtype=flag_dtype)
+    flags['date'] = dates[owner]
+    flags['kind'] = np.array(['brightest', 'nearby'])[kind]
+    flags['mag'] = store.band('g')[rows]
+    flags['sep'] = store.sep[rows] * 3600
+    flags['source'] = store.uid[rows]
+    flags['ra'] = store.ra[rows]
+    flags['dec'] = store.dec[rows]
+
+    return flags
+
+
+def write_csv(flags, path: str):
+    '''
+    Writes the flags to a CSV file, with a header row and ISO dates.
+    '''
+
+    columns = [np.datetime_as_string(flags['date'], unit='ms'), flags['kind'],
+               np.char.mod('%.3f', flags['mag']), np.char.mod('%.2f', flags['sep']),
+               flags['source'], np.char.mod('%.7f', flags['ra']), np.char.mod('%.7f', flags['dec'])]
+
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(flag_dtype.names)
+        writer.writerows(zip(*(column.tolist() for column in columns)))
+
+
+def write_parquet(flags, path: str):
+    '''
+    Writes the flags to a Parquet file. Needs pyarrow.
+    '''
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.table({name: pa.array(flags[name].tolist() if name == 'kind' else flags[name])
+                      for name in flag_dtype.names})
+
+    pq.write_table(table, path)
+
+
+def export(flags, path: str):
+    '''
+    Writes the flags to path, as Parquet if it ends in .parquet and as CSV
+    otherwise.
+    '''
+
+    if path.lower().endswith('.parquet'):
+        write_parquet(flags, path)
+    else:
+        write_csv(flags, path)
@@ -0,0 +1,196 @@
+import numpy as np
+from collections import namedtuple
+from backend.projection import gnomonic_inverse, rotate
+
+
+'''
+Instrument footprints and the sources that contaminate them, for every
+epoch of a track.
+'''
+
+
+Footprint = namedtuple('Footprint', ['date', 'ra', 'dec', 'fov', 'angle',
+                                     'corners', 'contaminants'])
+
+# corners: numpy array (4, 2) with the RA/Dec of the corners (deg).
+# contaminants: dict of numpy arrays 'ra', 'dec', 'mag' (g band) and
+# 'sep' (arcsec from the target) of the sources inside the footprint.
+
+
+def track_sources(skys):
+    '''
+    Returns the RA, Dec and g magnitude of the sources of every sky as flat
+    arrays, with the index of the sky each source belongs to and the cached
+    gnomonic offsets (xi, eta) of every source around the center of its sky,
+    all taken from the SourceStore of the track. Also returns the rows of the
+    store they come from.
+    '''
+
+    store = skys[0].store
+    rows, owner = store.rows([sky.num for sky in skys])
+
+    return (store.ra[rows], store.dec[rows], store.band('g')[rows], owner,
+            store.xi[rows], store.eta[rows], rows)
+
+
+def footprints(skys, fov: float, angle: float) -> dict:
+    '''
+    Computes, in one vectorized pass over all the sources of the track, the
+    square footprint of the instrument on every epoch and the sources that
+    fall inside it. Returns a dict of Footprint indexed by date, as shown in
+    the date selector.
+
+    --------------
+    Parameters
+    --------------
+
+    skys: list of Sky objects.
+    fov: float. Side of the instrument FOV (arcmin).
+    angle: float. Rotation of the FOV (deg).
+    '''
+
+    half = fov / 2 / 60
+
+    center_ra = np.array([sky.coords.ra.deg for sky in skys])
+    center_dec = np.array([sky.coords.dec.deg for sky in skys])
+
+    ra, dec, mag, owner, xi, eta, rows = track_sources(skys)
+
+    u, v = rotate(xi, eta, angle)
+    inside = (np.abs(u) <= half) & (np.abs(v) <= half)
+
+    sep = skys[0].store.sep[rows] * 3600
+
+    # Contaminants grouped by epoch; owner is sorted, so each group is a slice.
+    hits = np.flatnonzero(inside)
+    bounds = np.searchsorted(owner[hits], np.arange(len(skys) + 1))
+
+    # Corners of the footprint, from its frame back to the sky.
+    cu = np.array([-half, half, half, -half])
+    cv = np.array([-half, -half, half, half])
+    a = np.radians(angle)
+    cxi = -(cu * np.cos(a) - cv * np.sin(a))
+    ceta = cu * np.sin(a) + cv * np.cos(a)
+
+    index = {}
+
+    for n, sky in enumerate(skys):
+        rows = hits[bounds[n]:bounds[n + 1]]
+        corners = np.column_stack(gnomonic_inverse(cxi, ceta, center_ra[n], center_dec[n]))
+
+        contaminants = {
+            'ra': ra[rows],
+            'dec': dec[rows],
+            'mag': mag[rows],
+            'sep': sep[rows]
+        }
+
+        date = f'{sky.date.value}'
+        index[date] = Footprint(date, center_ra[n], center_dec[n], fov, angle,
+                                corners, contaminants)
+
+    return index
+
+
+def best_windows(dates: list, clean) -> list:
+    '''
+    Returns the runs of consecutive clean epochs (e.g. without flagged
+    sources) as (start date, end date, epochs), longest first.
+    '''
+
+    clean = np.concatenate([[False], np.asarray(clean, dtype=bool), [False]])
+    edges = np.flatnonzero(np.diff(clean.astype(int)))
+    starts, stops = edges[::2], edges[1::2]
+
+    order = np.argsort(starts - stops, kind='stable')
+
+    return [(dates[starts[k]], dates[stops[k] - 1], int(stops[k] - starts[k])) for k in order]
+
+
+def best_date(index: dict):
+    '''
+    Returns the date of the footprint with the least g band flux from its
+    contaminants, given the output of footprints, or None if it is empty.
+    '''
+
+    if not index:
+        return None
+
+    flux = [np.nansum(10 ** (-0.4 * fp.contaminants['mag'])) for fp in index.values()]
+
+    return list(index)[int(np.argmin(flux))]
+
+
+def rotation_sweep(skys, fov: float, angles, chunk=20_000_000) -> dict:
+    '''
+    Evaluates, for every epoch and every FOV rotation in angles, how many
+    sources fall inside the footprint and their total g band flux. All the
+    epochs and angles are processed together with vectorized point-in-square
+    tests on tangent-plane offsets, in chunks of angles so that at most chunk
+    offsets are held in memory at once.
+
+    Returns a dict with:
+
+    'dates': list of str, one per epoch.
+    'angles': numpy array (deg).
+    'counts': numpy array (epochs, angles). Sources inside the footprint.
+    'flux': numpy array (epochs, angles). Total flux inside the footprint,
+    relative to a 0 mag source.
+    'best': numpy array (epochs). Angle with the least flux for every epoch.
+
+    --------------
+    Parameters
+    --------------
+
+    skys: list of Sky objects.
+    fov: float. Side of the instrument FOV (arcmin).
+    angles: iterable. Rotations to evaluate (deg).
+    chunk: int.
+    '''
+
+    half = fov / 2 / 60
+    angles = np.asarray(angles, dtype=float)
+    n_skys = len(skys)
+
+    ra, dec, mag, owner, xi, eta, rows = track_sources(skys)
+
+    # Only the sources within the circle around the footprint can fall in it.
+    near = np.hypot(xi, eta) <= half * np.sqrt(2)
+    xi, eta, mag, owner = xi[near], eta[near], mag[near], owner[near]
+    flux = 10 ** (-0.4 * np.nan_to_num(mag, nan=np.inf))
+
+    counts = np.zeros((n_skys, len(angles)), dtype=np.int32)
+    total = np.zeros((n_skys, len(angles)))
+
+    # Sources are sorted by epoch, so every epoch is a slice for reduceat.
+    starts = np.searchsorted(owner, np.arange(n_skys))
+    filled = np.bincount(owner, minlength=n_skys) > 0
+
+    if len(owner):
+        step = max(chunk // len(owner), 1)
+
+        for a0 in range(0, len(angles), step):
+            block = angles[a0:a0 + step, None]
+            u, v = rotate(xi[None, :], eta[None, :], block)
+            inside = (np.abs(u) <= half) & (np.abs(v) <= half)
+
+            # A column of zeros after the last source, so that the empty
+            # epochs at the end of the track start at a valid index, without
+            # cutting the slice of the last epoch with sources short.
+            inside = np.pad(inside, ((0, 0), (0, 1)))
+            n_in = np.add.reduceat(inside, starts, axis=1, dtype=np.int32)
+            f_in = np.add.reduceat(inside * np.pad(flux, (0, 1)), starts, axis=1)
+
+            # reduceat gives the element at the start index for empty epochs.
+            counts[filled, a0:a0 + step] = n_in[:, filled].T
+            total[filled, a0:a0 + step] = f_in[:, filled].T
+
+    sweep = {
+        'dates': [f'{sky.date.value}' for sky in skys],
+        'angles': angles,
+        'counts': counts,
+        'flux': total,
+        'best': angles[np.argmin(total, axis=1)] if len(angles) else np.array([])
+    }
+
+    return sweep
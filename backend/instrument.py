@@ -0,0 +1,395 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from backend.variables import latency_buckets
+
+
+'''
+Structured instrumentation of the pipeline: spans per stage and per epoch,
+network bytes and latency per service, and cache hits. Drives the progress
+bar, the timing breakdown shown in the GUI and a machine-readable trace file.
+The tracer of a run is also the way to cancel it.
+'''
+
+
+log = logging.getLogger(__name__)
+
+
+class Cancelled(Exception):
+    '''
+    Raised inside a run once Tracer.cancel has been called.
+    '''
+
+
+class Histogram:
+
+    '''
+    Latency histogram with fixed buckets: counts[i] is the number of values
+    up to bounds[i] and above the previous bound, and the last count is the
+    number of values above every bound.
+
+    -------------
+    Attributes
+    -------------
+
+    bounds: list of float. Upper bounds of the buckets (s).
+    counts: list of int.
+    total: float. Sum of the values (s).
+    '''
+
+    def __init__(self, bounds=None):
+        self.bounds = list(bounds or latency_buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.
+
+    def add(self, seconds: float):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        '''
+        Upper bound of the bucket holding the given quantile, inf if it is
+        above every bound.
+        '''
+
+        rank = q * sum(self.counts)
+        seen = 0
+
+        for bound, count in zip(self.bounds + [float('inf')], self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+
+        return 0.
+
+    def as_dict(self) -> dict:
+        return {'bounds': self.bounds, 'counts': list(self.counts), 'count': sum(self.counts),
+                'sum': self.total, 'p50': self.quantile(0.5), 'p95': self.quantile(0.95)}
+
+
+class Tracer:
+
+    '''
+    Collects the spans, requests and cache lookups of one pipeline run.
+
+    -------------
+    Attributes
+    -------------
+
+    progress: callable or None. Receives a (percent, message) tuple every time
+    the overall progress changes, e.g. Backend.signal_progress.emit.
+
+    weights: dict. Share of the progress bar taken by every stage.
+
+    events: list. Finished spans in the Trace Event Format used by
+    chrome://tracing and Perfetto.
+
+    stages: dict. Wall time of every finished stage (s).
+
+    services: dict. Requests, bytes, errors and total latency per service.
+
+    caches: dict. Cache hits and misses per service.
+
+    histograms: dict. Histogram of the latency of the requests per service.
+
+    cancelled: threading.Event. Set by cancel.
+
+    -------------
+    Methods
+    -------------
+
+    plan: Sets the stages that make up the run.
+    stage: Context manager for a pipeline stage.
+    epoch: Context manager for the work done on one epoch of a stage.
+    request: Context manager around a request to a remote service.
+    cache: Records a cache lookup.
+    breakdown: Summary of the run.
+    dump: Writes the trace file.
+    cancel: Stops the run at the next epoch or request.
+    check: Raises Cancelled if the run was cancelled.
+    run: Calls a blocking function that can be abandoned on cancel.
+    '''
+
+    def __init__(self, progress=None, weights=None):
+        self.progress = progress
+        self.weights = weights or {}
+        self.events = []
+        self.stages = {}
+        self.services = defaultdict(lambda: {'requests': 0, 'bytes': 0, 'errors': 0, 'seconds': 0.})
+        self.caches = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self.histograms = defaultdict(Histogram)
+        self.t0 = time.perf_counter()
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._planned = 0.
+        self._done = 0.
+        self._stage = None
+        self._total = 0
+        self._count = 0
+        self._percent = -1
+
+    def plan(self, stages: list):
+        '''
+        Sets the stages that make up the run, so that the progress bar reaches
+        100% once all of them are finished.
+        '''
+
+        self._planned = sum(self.weights.get(stage, 1) for stage in stages)
+        self._done = 0.
+
+    def _span(self, name, cat, start, **args):
+        end = time.perf_counter()
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': (start - self.t0) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args
+        }
+        with self._lock:
+            self.events.append(event)
+        return end - start
+
+    def _emit(self, msg):
+        if self.progress is None or not self._planned:
+            return
+
+        done = self._done
+        if self._stage is not None and self._total:
+            done += self.weights.get(self._stage, 1) * self._count / self._total
+
+        percent = int(100 * done / self._planned)
+
+        if percent != self._percent:
+            self._percent = percent
+            self.progress((min(percent, 100), msg))
+
+    @contextmanager
+    def stage(self, name: str, total=None, msg=None):
+        '''
+        Span for a whole pipeline stage.
+
+        --------------
+        Parameters
+        --------------
+
+        name: str. Name of the stage, e.g. 'sky_init'.
+        total: int or None. Number of epochs the stage will go through.
+        msg: str. Message shown next to the progress bar.
+        '''
+
+        msg = msg or f'{name}...'
+        log.info(msg)
+
+        self._stage, self._total, self._count = name, total or 0, 0
+        self._emit(msg)
+        start = time.perf_counter()
+
+        try:
+            yield self
+        finally:
+            seconds = self._span(name, 'stage', start, epochs=self._total)
+            self.stages[name] = self.stages.get(name, 0.) + seconds
+            self._done += self.weights.get(name, 1)
+            self._stage, self._total, self._count = None, 0, 0
+            log.info(f'{name} finished in {seconds:.3f} s')
+            self._emit(f'Finished {name}.')
+
+    @contextmanager
+    def epoch(self, num: int, **args):
+        '''
+        Span for the work done on one epoch inside the current stage.
+        '''
+
+        self.check()
+
+        stage = self._stage
+        start = time.perf_counter()
+
+        try:
+            yield self
+        finally:
+            seconds = self._span(f'{stage} #{num}', 'epoch', start, num=num, **args)
+            log.debug(f'{stage} epoch {num} took {seconds:.3f} s')
+            self._count += 1
+            self._emit(f'{stage} ({self._count}/{self._total})...')
+
+    @contextmanager
+    def request(self, service: str, session=None, cached=False):
+        '''
+        Measures the latency of the requests made inside the block. If a
+        requests.Session is given, the size of every response it receives is
+        added to the service's bytes. With cached=True, a block that gets no
+        response from the network (e.g. answered by the astroquery cache)
+        counts as a cache hit, and as a miss otherwise.
+        '''
+
+        self.check()
+
+        sizes = []
+        thread = threading.get_ident()
+
+        # Hooks run in the thread of the request, so a session shared by
+        # several threads only counts the responses of this block.
+        def hook(response, *args, **kwargs):
+            if threading.get_ident() == thread:
+                sizes.append(len(response.content))
+
+        if session is not None:
+            session.hooks['response'].append(hook)
+
+        start = time.perf_counter()
+
+        try:
+            yield self
+        except Exception:
+            with self._lock:
+                self.services[service]['errors'] += 1
+            raise
+        finally:
+            if session is not None:
+                session.hooks['response'].remove(hook)
+
+        seconds = self._span(service, 'request', start, bytes=sum(sizes))
+
+        if session is not None and cached:
+            self.cache(service, hit=not sizes)
+
+        if not cached or sizes:
+            with self._lock:
+                stats = self.services[service]
+                stats['requests'] += max(len(sizes), 1)
+                stats['bytes'] += sum(sizes)
+                stats['seconds'] += seconds
+                self.histograms[service].add(seconds)
+
+    def cancel(self):
+        '''
+        Cancels the run: Cancelled is raised by the next epoch or request, and
+        by the blocking calls made through run that are still waiting. Can be
+        called from any thread.
+        '''
+
+        self.cancelled.set()
+
+    def check(self):
+        '''
+        Raises Cancelled if the run was cancelled.
+        '''
+
+        if self.cancelled.is_set():
+            raise Cancelled("The query was cancelled.")
+
+    def run(self, func, *args, **kwargs):
+        '''
+        Calls func in a separate thread and returns its result. If the run is
+        cancelled meanwhile, Cancelled is raised right away: the call is left
+        to finish on its own and its result is dropped. Requests can not be
+        interrupted once sent, so this is how they stop promptly.
+        '''
+
+        self.check()
+
+        done = threading.Event()
+        outcome = {}
+
+        def call():
+            try:
+                outcome['result'] = func(*args, **kwargs)
+            except BaseException as e:
+                outcome['error'] = e
+            finally:
+                done.set()
+
+        threading.Thread(target=call, name='request', daemon=True).start()
+
+        while not done.wait(0.05):
+            self.check()
+
+        if 'error' in outcome:
+            raise outcome['error']
+
+        return outcome['result']
+
+    def cache(self, service: str, hit: bool):
+        '''
+        Records a cache lookup for the given service.
+        '''
+
+        with self._lock:
+            self.caches[service]['hits' if hit else 'misses'] += 1
+
+    def breakdown(self) -> dict:
+        '''
+        Returns a summary of the run: time per stage, and requests, bytes,
+        mean latency and latency histogram per service, and cache hits.
+        '''
+
+        services = {}
+        for service, stats in self.services.items():
+            mean = stats['seconds'] / stats['requests'] if stats['requests'] else 0.
+            services[service] = dict(stats, mean_latency=mean,
+                                     latency=self.histograms[service].as_dict())
+
+        info = {
+            'total': time.perf_counter() - self.t0,
+            'stages': dict(self.stages),
+            'services': services,
+            'caches': {k: dict(v) for k, v in self.caches.items()}
+        }
+
+        return info
+
+    def dump(self, path: str, **extra) -> str:
+        '''
+        Writes the spans (Trace Event Format, readable by chrome://tracing or
+        Perfetto) and the breakdown to a JSON file, along with any extra
+        entries given, e.g. hosts=backend.fetch.health(). Returns the path.
+        '''
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        with self._lock:
+            trace = {
+                'traceEvents': list(self.events),
+                'displayTimeUnit': 'ms',
+                'breakdown': self.breakdown(),
+                **extra
+            }
+
+        with open(path, 'w') as file:
+            json.dump(trace, file, indent=1, default=str)
+
+        log.info(f'Trace written to {path}')
+
+        return path
+
+
+def format_breakdown(info: dict) -> str:
+    '''
+    Formats the output of Tracer.breakdown as text for the GUI and the logs.
+    '''
+
+    lines = [f'{"Total":<14}{info["total"]:9.2f} s']
+
+    for stage, seconds in info['stages'].items():
+        lines.append(f'{stage:<14}{seconds:9.2f} s')
+
+    for service, stats in info['services'].items():
+        lines.append(f'{service:<14}{stats["requests"]:5d} req {stats["bytes"] / 2 ** 20:8.2f} MiB '
+                     f'{stats["mean_latency"] * 1e3:7.0f} ms/req {stats["errors"]} err')
+
+    for service, stats in info['caches'].items():
+        lines.append(f'{service + " cache":<14}{stats["hits"]:5d} hits {stats["misses"]:5d} misses')
+
+    return '\n'.join(lines)
@@ -0,0 +1,112 @@
+import numpy as np
+
+
+'''
+Tangent-plane (gnomonic) projection, used to work with small sky regions
+as flat offsets instead of going through a WCS.
+'''
+
+
+def gnomonic(ra, dec, ra0, dec0):
+    '''
+    Returns the gnomonic offsets (xi, eta), in degrees, of the positions
+    (ra, dec) on the plane tangent to the sky at (ra0, dec0). xi grows
+    towards the East and eta towards the North. Works on scalars or arrays
+    that broadcast together.
+
+    --------------
+    Parameters
+    --------------
+
+    ra, dec: float or numpy array (deg).
+    ra0, dec0: float or numpy array (deg). Tangent point.
+    '''
+
+    ra, dec = np.radians(ra), np.radians(dec)
+    ra0, dec0 = np.radians(ra0), np.radians(dec0)
+
+    cos_dra = np.cos(ra - ra0)
+    cos_c = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * cos_dra
+
+    xi = np.cos(dec) * np.sin(ra - ra0) / cos_c
+    eta = (np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * cos_dra) / cos_c
+
+    return np.degrees(xi), np.degrees(eta)
+
+
+def gnomonic_inverse(xi, eta, ra0, dec0):
+    '''
+    Returns the sky positions (ra, dec), in degrees, of the gnomonic offsets
+    (xi, eta), in degrees, around the tangent point (ra0, dec0).
+    '''
+
+    xi, eta = np.radians(xi), np.radians(eta)
+    ra0, dec0 = np.radians(ra0), np.radians(dec0)
+
+    denom = np.cos(dec0) - eta * np.sin(dec0)
+
+    ra = ra0 + np.arctan2(xi, denom)
+    dec = np.arctan2(np.sin(dec0) + eta * np.cos(dec0), np.hypot(xi, denom))
+
+    return np.degrees(ra) % 360, np.degrees(dec)
+
+
+def rotate(xi, eta, angle):
+    '''
+    Returns the offsets (u, v), in the frame of a footprint rotated by angle
+    (deg, from North towards East, the way the FOV overlay is drawn on a
+    North-up, East-left image).
+    '''
+
+    a = np.radians(angle)
+
+    # On the image x = -xi and y = eta, and the footprint is rotated
+    # counterclockwise. Its frame is reached by the inverse rotation.
+    u = -xi * np.cos(a) + eta * np.sin(a)
+    v = xi * np.sin(a) + eta * np.cos(a)
+
+    return u, v
+
+
+def plain_tan(wcs) -> bool:
+    '''
+    Returns True if wcs is a celestial gnomonic (TAN) projection with RA on
+    the first axis and no distortions, so that pixels are a linear function
+    of the gnomonic offsets around its reference point.
+    '''
+
+    ctype = wcs.wcs.ctype
+
+    return (wcs.naxis == 2 and ctype[0] == 'RA---TAN' and ctype[1] == 'DEC--TAN'
+            and wcs.wcs.lonpole == 180 and wcs.sip is None and not wcs.has_distortion)
+
+
+def offsets_to_pixel(xi, eta, wcs):
+    '''
+    Returns the 0-based pixel coordinates (x, y) on a plain TAN wcs of the
+    gnomonic offsets (xi, eta), in degrees, around its reference point, using
+    its CRPIX and CD matrix directly.
+    '''
+
+    inverse = np.linalg.inv(wcs.pixel_scale_matrix)
+    crpix = wcs.wcs.crpix
+
+    x = inverse[0, 0] * xi + inverse[0, 1] * eta + crpix[0] - 1
+    y = inverse[1, 0] * xi + inverse[1, 1] * eta + crpix[1] - 1
+
+    return x, y
+
+
+def world_to_pixel(wcs, ra, dec):
+    '''
+    Returns the 0-based pixel coordinates (x, y) of the positions (ra, dec),
+    in degrees, on wcs. Plain TAN projections are evaluated in one vectorized
+    pass, any other wcs goes through astropy.
+    '''
+
+    if not plain_tan(wcs):
+        return wcs.world_to_pixel_values(ra, dec)
+
+    ra0, dec0 = wcs.wcs.crval
+
+    return offsets_to_pixel(*gnomonic(ra, dec, ra0, dec0), wcs)
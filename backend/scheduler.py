@@ -0,0 +1,221 @@
+import numpy as np
+import astropy.units as u
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from astropy.coordinates import SkyCoord
+from astroquery.mpc import MPCClass
+from backend.instrument import Tracer, Cancelled
+from backend.clusters import share_clusters
+from backend.footprint import footprints, best_windows, best_date
+from backend.sky_handling import query, query_fields, sky_init, sky_process, flag_track
+from backend.variables import cluster_tol, night_workers, vizier_batch
+
+
+'''
+Planning of a whole night: several targets whose ephemerides are fetched
+concurrently, and whose catalog queries and image cutouts are shared by sky
+field across targets.
+'''
+
+
+TargetPlan = namedtuple('TargetPlan', ['id', 'eph', 'skys', 'store', 'brightest', 'flagged',
+                                       'footprints', 'windows', 'best'])
+
+# skys: list of Sky objects attached to store, the SourceStore of the target.
+# brightest, flagged: output of backend.sky_handling.flag_track.
+# footprints: dict of backend.footprint.Footprint indexed by date.
+# windows: list of (start date, end date, epochs) of the runs of consecutive
+# epochs without flagged sources, longest first.
+# best: str. Date with the least flux inside the FOV.
+
+
+def keep(futures: dict, saved):
+    '''
+    Stores the result of every future that succeeds in saved, by the key of
+    the future, then raises the first error, if any: a checkpoint keeps all
+    that was fetched before a failure, not just what came before it in order.
+    '''
+
+    error = None
+
+    for key, future in futures.items():
+        try:
+            saved[key] = future.result()
+        except Exception as e:
+            error = error or e
+
+    if error is not None:
+        raise error
+
+
+def fetch_ephemerides(targets: list, tracer=None, workers=night_workers, saved=None):
+    '''
+    Queries the ephemeris of every target at once, with one MPC client per
+    request. Returns the ephemerides and the errors, both dicts by target ID.
+
+    --------------
+    Parameters
+    --------------
+
+    targets: list of dicts with the keyword arguments of
+    backend.sky_handling.query for every target.
+    tracer: backend.instrument.Tracer or None.
+    workers: int. Requests in flight at once.
+    saved: dict-like or None. Ephemerides already fetched, by target ID, e.g.
+    Checkpoint.eph. Filled with the ones fetched here.
+    '''
+
+    tracer = tracer or Tracer()
+    saved = {} if saved is None else saved
+
+    def run(params):
+        return query(**params, tracer=tracer, client=MPCClass())
+
+    ephs, errors = {}, {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {params['id']: pool.submit(run, params) for params in targets
+                   if params['id'] not in saved}
+
+        for params in targets:
+            id = params['id']
+
+            if id not in futures:
+                ephs[id] = saved[id]
+                continue
+
+            try:
+                ephs[id] = saved[id] = futures[id].result()
+            except Cancelled:
+                raise
+            except Exception as e:
+                errors[id] = e
+
+    return ephs, errors
+
+
+def plan_night(targets: list, fov: float, angle=0., thresh=0.5 * u.arcmin, tracer=None,
+               workers=night_workers, checkpoint=None, surveys=None, client=None):
+    '''
+    Plans every target of a night as the single-target pipeline does, with the
+    work shared between targets:
+
+    - the ephemerides are fetched concurrently (fetch_ephemerides);
+    - the epochs of all the targets are grouped in fields (share_clusters), and
+      the catalogs of every field are queried once, vizier_batch fields per
+      request, with the requests sent concurrently;
+    - the image cutout and the crossmatch of every field are made once, and
+      shared by every target that goes through it.
+
+    Returns a dict of TargetPlan and a dict of errors, both by target ID, in
+    the order of targets.
+
+    --------------
+    Parameters
+    --------------
+
+    targets: list of dicts with the keyword arguments of
+    backend.sky_handling.query for every target (id, start_from, step,
+    num_results, t_start, t_end).
+    fov: float. Side of the instrument FOV (arcmin).
+    angle: float. Rotation of the FOV (deg).
+    thresh: astropy Quantity. Flagging radius.
+    tracer: backend.instrument.Tracer or None. Records the stages query,
+    sky_init, sky_process, flagging and footprints.
+    workers: int. Requests in flight at once.
+    checkpoint: backend.checkpoint.Checkpoint or None. Keeps the ephemerides,
+    fields and cutouts as they arrive; the ones it already holds are not
+    fetched again.
+    surveys: list of str or None. Bands of the images (see backend.cutouts).
+    client: backend.vizier.CatalogClient or None. Client of the Vizier queries.
+    '''
+
+    tracer = tracer or Tracer()
+    saved = checkpoint.eph if checkpoint is not None else None
+    fields = checkpoint.fields if checkpoint is not None else {}
+    cutouts = checkpoint.cutouts if checkpoint is not None else {}
+
+    with tracer.stage('query', msg=f"Retrieving the ephemerides of {len(targets)} targets..."):
+        ephs, errors = fetch_ephemerides(targets, tracer, workers, saved)
+
+    ids = [params['id'] for params in targets if params['id'] in ephs and len(ephs[params['id']])]
+    for params in targets:
+        if params['id'] in ephs and not len(ephs[params['id']]):
+            errors[params['id']] = ValueError("No ephemeris in the time window.")
+
+    tol = cluster_tol * fov / 60 # deg
+    side = fov / 60 + 2 * tol
+
+    tracks = [(np.asarray(ephs[id]['RA']), np.asarray(ephs[id]['Dec'])) for id in ids]
+    labels, field_ra, field_dec = share_clusters(tracks, tol)
+
+    total = sum(len(ephs[id]) for id in ids)
+
+    with tracer.stage('sky_init', total=total, msg=f"Querying {len(field_ra)} shared fields..."):
+        centers = SkyCoord(ra=field_ra * u.deg, dec=field_dec * u.deg, frame='icrs')
+
+        missing = [n for n in range(len(centers)) if n not in fields]
+        batches = [missing[k:k + vizier_batch] for k in range(0, len(missing), vizier_batch)]
+        found = {}
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {tuple(batch): pool.submit(query_fields, centers[batch], side, tracer, client)
+                       for batch in batches}
+
+            try:
+                keep(futures, found)
+            finally:
+                for batch, results in found.items():
+                    for n, result in zip(batch, results):
+                        fields[n] = result
+
+        skys = {id: sky_init(ephs[id], fov, tracer, labels[n], fields, client)
+                for n, id in enumerate(ids)}
+
+    # The first sky of a field to be processed is its anchor, as the fields
+    # were made in this order, and it holds the image of the field.
+    queried = {}
+
+    with tracer.stage('sky_process', total=total, msg="Processing skys..."):
+        # The image of every field is fetched at once, by its anchor.
+        anchors = {}
+        for id in ids:
+            for sky in skys[id]:
+                anchors.setdefault(sky.cluster, sky)
+
+        missing = []
+        for label, sky in anchors.items():
+            if label in cutouts:
+                sky.set_img(cutouts[label])
+            else:
+                missing.append(sky)
+
+        def fetch_image(sky):
+            sky.img_query(fov, tracer, margin=cluster_tol * fov, surveys=surveys)
+            return sky.bands
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {sky.cluster: pool.submit(fetch_image, sky) for sky in missing}
+
+            keep(futures, cutouts)
+
+        stores = {id: sky_process(skys[id], fov, tracer, queried) for id in ids}
+
+    # Raw catalog results, kept by fields only from here on.
+    del fields, queried
+
+    with tracer.stage('flagging', msg="Flagging bright objects and objects within 0.5 arcmin..."):
+        flags = {id: flag_track(skys[id], thresh) for id in ids}
+
+    plans = {}
+
+    with tracer.stage('footprints', msg="Computing FOV footprints..."):
+        for id in ids:
+            index = footprints(skys[id], fov, angle)
+            brightest, flagged = flags[id]
+
+            plans[id] = TargetPlan(id, ephs[id], skys[id], stores[id], brightest, flagged,
+                                   index, best_windows(list(index), flagged == 0),
+                                   best_date(index))
+
+    return plans, errors
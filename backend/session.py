@@ -0,0 +1,258 @@
+import json
+import numpy as np
+import astropy.units as u
+from astropy.io import fits
+from astropy.table import Table
+from astropy.time import Time
+from astropy.wcs import WCS
+from astropy.coordinates import SkyCoord
+from backend.sky import Sky
+from backend.store import SourceStore
+from backend.cutouts import raw_hdu
+
+
+'''
+Single-file planning sessions: the ephemeris, the source store, the cutouts,
+the coadded mosaic with its WCS and the flags of a track, so that a target
+can be reopened without any network access or reprojection.
+
+Layout of a session file:
+
+magic (8 bytes) | header length (uint64, little endian) | JSON header |
+padding | arrays
+
+Every array is stored raw, in C order, at an offset aligned to ALIGN bytes
+from the start of the arrays, so that on loading they are views of a single
+memory map of the file and nothing is read until it is used.
+'''
+
+
+MAGIC = b'PSCSESS1'
+ALIGN = 64
+VERSION = 1
+
+
+def _aligned(n: int) -> int:
+    return -(-n // ALIGN) * ALIGN
+
+
+def _plain(array):
+    '''
+    Returns a column as a contiguous numpy array that can be stored raw:
+    masked values filled (NaN for floats) and quantities without units.
+    '''
+
+    if hasattr(array, 'filled'):
+        fill = np.nan if np.asarray(array).dtype.kind in 'fc' else None
+        array = array.filled(fill) if fill is not None else array.filled()
+
+    return np.ascontiguousarray(getattr(array, 'value', array))
+
+
+def _image_header(hdu):
+    '''
+    Header of a cutout. The data are stored as they are, so the scaling
+    keywords are kept for integer data (see backend.cutouts.compact), and
+    removed for floats, which are already scaled.
+    '''
+
+    header = hdu.header.copy()
+
+    if hdu.data.dtype.kind == 'f':
+        for key in ('BSCALE', 'BZERO', 'BLANK'):
+            header.remove(key, ignore_missing=True)
+
+    return header.tostring()
+
+
+def save_session(path: str, skys: list, wcs_out, array, eph=None, meta=None):
+    '''
+    Writes a whole planning session to a single file.
+
+    --------------
+    Parameters
+    --------------
+
+    path: str. Session file.
+    skys: list of Sky objects, attached to the SourceStore of the track.
+    wcs_out: astropy.wcs.WCS object of the mosaic.
+    array: numpy array. Coadded mosaic, 2D or one per band (bands, y, x).
+    eph: astropy Table or None. Ephemeris of the track.
+    meta: dict or None. JSON-serializable information of the run (FOV,
+    instrument, flagging radius...).
+    '''
+
+    store = skys[0].store
+    arrays = {}
+
+    for name in SourceStore.columns:
+        arrays[f'store/{name}'] = getattr(store, name)
+
+    # One image per cluster: the skys of a cluster share the same HDU.
+    images = {}
+    for sky in skys:
+        images.setdefault(id(sky.hdu), (len(images), sky.hdu))
+
+    for n, hdu in images.values():
+        arrays[f'image/{n}'] = hdu.data
+
+    dates = Time([sky.date for sky in skys])
+    arrays['skys/ra'] = np.array([sky.coords.ra.deg for sky in skys])
+    arrays['skys/dec'] = np.array([sky.coords.dec.deg for sky in skys])
+    arrays['skys/jd1'] = dates.jd1
+    arrays['skys/jd2'] = dates.jd2
+    arrays['skys/cluster'] = np.array([-1 if sky.cluster is None else sky.cluster for sky in skys])
+    arrays['skys/image'] = np.array([images[id(sky.hdu)][0] for sky in skys])
+    arrays['mosaic'] = array
+
+    eph_columns = []
+    if eph is not None:
+        for name in eph.colnames:
+            column = eph[name]
+
+            if isinstance(column, Time):
+                arrays[f'eph/{name}/jd1'] = column.jd1
+                arrays[f'eph/{name}/jd2'] = column.jd2
+                eph_columns.append({'name': name, 'kind': 'time',
+                                    'format': column.format, 'scale': column.scale})
+                continue
+
+            data = _plain(column)
+            if data.dtype.kind not in 'biufcU':
+                continue
+
+            arrays[f'eph/{name}'] = data
+            unit = getattr(column, 'unit', None)
+            eph_columns.append({'name': name, 'kind': 'array',
+                                'unit': None if unit is None else unit.to_string()})
+
+    header = {
+        'version': VERSION,
+        'bands': list(store.bands),
+        'date': {'format': skys[0].date.format, 'scale': skys[0].date.scale},
+        'images': [_image_header(hdu) for _, hdu in sorted(images.values(), key=lambda x: x[0])],
+        'mosaic_wcs': wcs_out.to_header_string(relax=True),
+        'eph': eph_columns if eph is not None else None,
+        'meta': meta or {},
+        'arrays': {}
+    }
+
+    offset = 0
+    for name, data in arrays.items():
+        data = np.ascontiguousarray(data)
+        arrays[name] = data
+        header['arrays'][name] = {'dtype': data.dtype.str, 'shape': list(data.shape),
+                                  'offset': offset}
+        offset = _aligned(offset + data.nbytes)
+
+    text = json.dumps(header).encode()
+    start = _aligned(len(MAGIC) + 8 + len(text))
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(text)).tobytes())
+        f.write(text)
+
+        for name, data in arrays.items():
+            f.seek(start + header['arrays'][name]['offset'])
+            data.tofile(f)
+
+        # Padding of the last array, so that the file ends on a boundary.
+        f.truncate(start + offset)
+
+
+def read_header(path: str):
+    '''
+    Returns the JSON header of a session file and the offset of its arrays.
+    '''
+
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a session file.")
+
+        length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(length))
+
+    if header['version'] > VERSION:
+        raise ValueError(f"Session file version {header['version']} is not supported.")
+
+    return header, _aligned(len(MAGIC) + 8 + length)
+
+
+def load_session(path: str) -> dict:
+    '''
+    Opens a session file written by save_session. Every array is a view of a
+    copy-on-write memory map of the file: they can be modified in memory,
+    but the file is never written.
+
+    Returns a dict with:
+
+    'skys': list of Sky objects, attached to the store, with their images.
+    'store': backend.store.SourceStore.
+    'wcs': astropy.wcs.WCS object of the mosaic.
+    'array': numpy array. Coadded mosaic, 2D or one per band (bands, y, x).
+    'eph': astropy Table or None. Ephemeris of the track.
+    'meta': dict.
+    '''
+
+    header, start = read_header(path)
+    mapped = np.memmap(path, dtype=np.uint8, mode='c')
+
+    def array(name):
+        info = header['arrays'][name]
+        dtype = np.dtype(info['dtype'])
+        begin = start + info['offset']
+        count = int(np.prod(info['shape'])) * dtype.itemsize
+
+        return np.asarray(mapped[begin:begin + count]).view(dtype).reshape(info['shape'])
+
+    store = SourceStore.from_columns(header['bands'],
+                                     {name: array(f'store/{name}') for name in SourceStore.columns})
+
+    hdus = []
+    for n, text in enumerate(header['images']):
+        hdus.append(raw_hdu(array(f'image/{n}'), fits.Header.fromstring(text)))
+    wcss = [WCS(hdu.header) for hdu in hdus]
+
+    dates = Time(array('skys/jd1'), array('skys/jd2'), format='jd', scale=header['date']['scale'])
+    dates.format = header['date']['format']
+    coords = SkyCoord(ra=array('skys/ra') * u.deg, dec=array('skys/dec') * u.deg, frame='icrs')
+
+    skys = []
+    for num, (cluster, image) in enumerate(zip(array('skys/cluster'), array('skys/image'))):
+        sky = Sky(num, None, coords[num], dates[num], None if cluster < 0 else int(cluster))
+
+        sky.hdu = hdus[image]
+        sky.wcs = wcss[image]
+        sky.img_data = sky.hdu.data
+        sky.bands = [sky.hdu]
+
+        sky.attach(store)
+        sky.separate()
+        skys.append(sky)
+
+    eph = None
+    if header['eph'] is not None:
+        eph = Table()
+        for column in header['eph']:
+            name = column['name']
+
+            if column['kind'] == 'time':
+                eph[name] = Time(array(f'eph/{name}/jd1'), array(f'eph/{name}/jd2'),
+                                 format='jd', scale=column['scale'])
+                eph[name].format = column['format']
+            else:
+                eph[name] = array(f'eph/{name}')
+                if column['unit'] is not None:
+                    eph[name].unit = column['unit']
+
+    session = {
+        'skys': skys,
+        'store': store,
+        'wcs': WCS(fits.Header.fromstring(header['mosaic_wcs'])),
+        'array': array('mosaic'),
+        'eph': eph,
+        'meta': header['meta']
+    }
+
+    return session
@@ -1,11 +1,15 @@
-from astropy.coordinates import SkyCoord
 import astropy.units as u
-from astropy.io import fits
 from astropy.wcs import WCS
-from urllib.parse import urlencode
 from urllib.parse import quote
-from regions import CircleSkyRegion
+import numpy as np
+from astropy.wcs.utils import proj_plane_pixel_scales
+from regions import CirclePixelRegion, PixCoord
 import backend.variables as v
+import backend.cutouts as cutouts
+from backend.dedup import merge_duplicates
+from backend.crossmatch import crossmatch
+from backend.clusters import members_in_box
+from backend.projection import plain_tan, offsets_to_pixel, world_to_pixel
 
 
 '''
@@ -15,7 +19,7 @@ and store their respective data.
 
 
 class Sky:
-    def __init__(self, num: int, result, coords, date):
+    def __init__(self, num: int, result, coords, date, cluster=None, ir_result=None):
         
         '''
         A class for storing important information about each sky region.
@@ -24,174 +28,274 @@ class Sky:
         Attributes
         --------------
         
-        num: int, identifier for the Sky object.
-        result: astroquery.utils.TableList object. Contains the initial result of the query.
+        num: int, identifier for the Sky object. Also its index in the SourceStore.
+        result: astroquery.utils.TableList object. Contains the initial result of the query,
+        shared by every Sky of the same cluster. Released once the store is built.
+        cluster: int or None. Cluster of epochs this sky shares its result and image with.
+        ir_result: astroquery.utils.TableList object or None. Result of the query to the
+        infrared catalog (v.ir_catalog), shared like result.
         coords: astropy.coordinates.SkyCoord object.
         date: astopy.time.Time object.
-        self.sources: Astropy table with filtered results. Astropy Table.
-        self.source_ra: Iterable that contains the RA coordinates of ALL self.sources (deg)
-        self.source_de: Iterable that contains the DEC coordinates of ALL self.sources (deg)
-        self.distances: Iterable that contains the distance from the source to the center (deg)
+        self.store: backend.store.SourceStore of the whole track, holding the sources of
+        every sky. The attributes below on sources are views of its columns.
+        self.sources: Astropy table with filtered results, built from the store on access.
+        self.matched: Astropy Table with the optical and infrared magnitudes of every
+        star of the cluster, see backend.crossmatch.crossmatch. Shared by the cluster.
+        self.matched_rows: numpy array. Rows of self.matched inside the FOV of this sky.
+        self.source_rows: numpy array. Rows of self.matched that are sources of this sky.
+        self.source_ra: numpy array that contains the RA coordinates of ALL self.sources (deg)
+        self.source_de: numpy array that contains the DEC coordinates of ALL self.sources (deg)
+        self.distances: numpy array that contains the distance from the source to the center (deg)
+        self.source_x, self.source_y: numpy arrays. Cached pixel coordinates of the
+        sources on the sky FITS, see Sky.pixels.
         self.thresh: Astropy Quantity object that sets the radius of the flagged items.
         self.wcs: astropy.wcs.WCS object of the sky FITS
-        self.flagged_ra: Iterable that contains the RA coordinates of the flagged items (deg)
-        self.flagged_de: Iterable that contains the DE coordinates of the flagged items (deg)
-        self.pix_region: regions.CircleSkyRegion object converted to pixels.
-        self.img_data: 2D array of the image data from the FITS file.
+        self.flagged_ra: numpy array that contains the RA coordinates of the flagged items (deg)
+        self.flagged_de: numpy array that contains the DE coordinates of the flagged items (deg)
+        self.pixel_region: regions.CirclePixelRegion of the flagging radius.
+        self.img_data: 2D array of the image data from the FITS file, as
+        stored (see backend.cutouts.compact).
         self.hdu: HDU object of the sky FITS file. 
+        self.bands: list of PrimaryHDU. Image of every band of the band set (see
+        backend.cutouts), on the pixel grid of self.hdu. The first one is self.hdu.
         '''
         self.num = num 
         self.result = result
+        self.cluster = cluster
+        self.ir_result = ir_result
         self.coords = coords
         self.date = date 
-        self.sources = None
-        self.source_ra = [] 
-        self.source_de = [] 
-        self.distances = [] 
+        self.store = None
+        self.matched = None
+        self.matched_rows = np.empty(0, dtype=int)
+        self.source_rows = np.empty(0, dtype=int)
+        self.distances = np.empty(0)
+        self.source_x = None
+        self.source_y = None
         self.thresh = None 
         self.wcs = None 
-        self.flagged_ra = [] 
-        self.flagged_de = [] 
-        self.pix_region = None 
+        self.pixel_region = None 
         self.img_data = None
         self.hdu = None 
+        self.bands = None
+
+    def _column(self, name):
+        if self.store is None:
+            return np.empty(0)
+
+        return getattr(self.store, name)[self.store.bounds(self.num)]
+
+    @property
+    def sources(self):
+        return None if self.store is None else self.store.table(self.num)
+
+    @property
+    def source_ra(self):
+        return self._column('ra')
+
+    @property
+    def source_de(self):
+        return self._column('dec')
+
+    @property
+    def flagged_ra(self):
+        return self.source_ra[self._column('flagged')]
+
+    @property
+    def flagged_de(self):
+        return self.source_de[self._column('flagged')]
         
+    def crossmatch(self, fov, matched=None):
+        '''
+        fov: float. Side of the instrument FOV (arcmin).
+        matched: Astropy Table or None. Crossmatch already computed by another sky
+        of the cluster.
+
+        Joins the optical and infrared results shared by the cluster, by nearest
+        neighbour within v.match_radius, once per cluster: repeated optical
+        detections closer than v.dup_tol are merged first. Stores the merged table,
+        with all the bands of both catalogs, to the attribute self.matched and the
+        rows inside the FOV of this sky to self.matched_rows. Returns the merged table.
+        '''
+
+        if matched is None:
+            optical = self.result[0] if len(self.result) else None
+            if optical is not None:
+                groups, keep = merge_duplicates(np.asarray(optical['RA_ICRS'], dtype=float),
+                                                np.asarray(optical['DE_ICRS'], dtype=float),
+                                                v.dup_tol)
+                optical = optical[keep]
+
+            ir_table = None
+            if self.ir_result is not None and len(self.ir_result):
+                ir_table = self.ir_result[0]
+
+            matched = crossmatch(optical, ir_table, v.match_radius,
+                                 names=('SDSS16', v.ir_catalog or '2MASS'))
+
+        self.matched = matched
+        self.matched_rows = members_in_box(np.asarray(matched['ra']), np.asarray(matched['dec']),
+                                           self.coords.ra.deg, self.coords.dec.deg, fov / 60)
+
+        return matched
+
     def filter_detec(self):
         '''
-        Takes itself and filters through the repeated detections by using the first field ID.
-        Stores the filtered results to the attribute self.sources
+        Takes itself and keeps the optical sources of the crossmatch inside the FOV,
+        where repeated detections of overlapping survey fields are already merged.
+        Stores their rows of self.matched to the attribute self.source_rows
         '''
-        detec_mask = (self.result[0]['fieldID'] == self.result[0]['fieldID'][0])
-        source_table = self.result[0][detec_mask]
-        self.sources = source_table
-        
-    def store_radec(self):
+
+        optical = np.asarray(self.matched['sdss16_row'])[self.matched_rows] >= 0
+        self.source_rows = self.matched_rows[optical]
+
+    def attach(self, store):
         '''
-        Takes the RADEC coordinates (in degrees) stored in self.sources and separates them into
-        self.source_ra and self.source_de to be able to plot them later.
+        store: backend.store.SourceStore holding the sources of this sky.
+
+        Makes the sources of this sky views of the store of the track.
         '''
 
-        for RA, DEC in zip(self.sources['RA_ICRS'], self.sources['DE_ICRS']):
-            c_source = SkyCoord(f'{RA} {DEC}', frame='icrs', unit=(u.deg, u.deg))
-            self.source_ra.append(c_source.ra.value)
-            self.source_de.append(c_source.dec.value)
-    
-        
-    def img_query(self, fov):
+        self.store = store
+        self.source_x = self.source_y = None
+
+    def offsets(self):
+        '''
+        Returns the gnomonic offsets (xi, eta), in degrees, of the sources on the
+        plane tangent to the sky at its center. They are computed once for the
+        whole track by the store, and reused by every distance, footprint and
+        pixel query.
+        '''
+
+        return self._column('xi'), self._column('eta')
+
+    def separations(self):
+        '''
+        Returns the angular distance from the center to each source (deg), from
+        the store.
+        '''
+
+        return self._column('sep')
+
+    def centered(self) -> bool:
+        '''
+        Returns True if the sky FITS is a plain TAN projection whose reference
+        point is the center of the sky, so that the cached offsets map linearly
+        to its pixels.
+        '''
+
+        ra0, dec0 = self.wcs.wcs.crval
+
+        return (plain_tan(self.wcs) and np.isclose(dec0, self.coords.dec.deg, rtol=0, atol=1e-9)
+                and np.isclose((ra0 - self.coords.ra.deg + 180) % 360 - 180, 0, rtol=0, atol=1e-9))
+
+    def pixels(self):
+        '''
+        Returns the pixel coordinates (x, y) of the sources on the sky FITS,
+        computed once from the cached offsets.
+        '''
+
+        if self.source_x is None:
+            if self.centered():
+                self.source_x, self.source_y = offsets_to_pixel(*self.offsets(), self.wcs)
+            else:
+                self.source_x, self.source_y = world_to_pixel(self.wcs, self.source_ra, self.source_de)
+
+        return self.source_x, self.source_y
+
+    def img_query(self, fov, tracer=None, margin=0., surveys=None):
     
         '''
-        fov: astropy Quantity object (arcmin or arcsec)
+        fov: float. FOV of the instrument (arcmin). The background spans
+        v.context FOVs, up to v.bg_fov.
+        tracer: backend.instrument.Tracer or None. Records the request.
+        margin: float. Extra width on every side of the image (arcmin), so that it
+        also covers the skys of the cluster. The pixel scale is kept.
+        surveys: list of str or None. Surveys of v.hips_surveys to query, all of
+        them on the same pixel grid. The first one is the image of the sky.
+        By default, the ones of v.survey.
 
         Takes the fov of the instrument and the central coordinates of the moving object and 
-        querys a FITS file from the DSS. Returns the image data
+        querys a FITS file from the survey, with as many pixels as can be
+        seen on screen (see backend.cutouts.pixel_scale). Returns the image data
         '''
 
+        surveys = surveys or cutouts.surveys_of(v.survey)
+
+        extent = min(v.bg_fov, v.context * fov)
+        side = extent + 2 * margin
+        pixels = int(np.ceil(side * 60 / cutouts.pixel_scale(surveys, extent)))
+
         query_params = { 
-         'hips': 'DSS',
          'ra': self.coords.ra.value, 
          'dec': self.coords.dec.value, 
-         'fov': (v.bg_fov * u.arcmin).to(u.deg).value, # Consider reducing the FOV by half.
-         'width': 1000, 
-         'height': 1000 
+         'fov': (side * u.arcmin).to(u.deg).value, # Consider reducing the FOV by half.
+         'width': pixels, 
+         'height': pixels 
      }   
-        url = f'http://alasky.u-strasbg.fr/hips-image-services/hips2fits?{urlencode(query_params)}'
 
-        hdu = fits.open(url) # Opening FITS file.
-        self.hdu = hdu[0]
-        self.wcs = WCS(hdu[0].header)
-
-        self.img_data = hdu[0].data
+        hdus = cutouts.fetch_bands(query_params, surveys, tracer) # Opening FITS files.
+        self.set_img(hdus)
         
         # Check if image data is empty.
-        
-    def flag_bright(self):
+
+    def set_img(self, bands):
         '''
-        Takes itself and automatically checks for any bright independent of a radius. 
-        In this case, it will search for that are similar to the brightest source in the image.
-        Prints a message alerting the user of the coordinates of this objects, the date it will be
-        found, and how far it is from the moving object, which band it's brightest in.
+        bands: list of astropy.io.fits.PrimaryHDU. Image of every band of the
+        sky, on the same pixel grid, e.g. from img_query or from a checkpoint
+        of an interrupted query. The first one is the image of the sky.
         '''
-        
-        # Search for top 5.
-        top_5 = []
-    
-        # Allow option to search through each magnitude.
-        mags = ['umag', 'gmag', 'rmag', 'imag', 'zmag']
-
-        # Brightest source in optical wavelength.
-        b_mask = self.sources['gmag'] == min(self.sources['gmag'])
-        brightest = self.sources[b_mask]
-
-        # Handling multiple detections
-        if len(brightest) > 0:
-            ra_brite, dec_brite = brightest['RA_ICRS'][0], brightest['DE_ICRS'][0]
-            # Magnitude of brightest object in the sky.
-            b_gmag = brightest['gmag'][0]
-        else:
-            ra_brite, dec_brite = brightest['RA_ICRS'], brightest['DE_ICRS']
-            b_gmag = brightest['gmag']
 
-        # Distance from target.
-        c_source = SkyCoord(f'{ra_brite} {dec_brite}', unit=(u.deg, u.deg), frame='icrs')
+        hdu = bands[0]
 
-        b_dist = c_source.separation(self.coords)
+        self.hdu = hdu
+        self.wcs = WCS(hdu.header)
+        self.img_data = hdu.data
+        self.bands = list(bands)
+        self.source_x = self.source_y = None
 
-        info = {
-            'mag': b_gmag,
-            'ra': ra_brite,
-            'dec': dec_brite,
-            'dist': b_dist,
-            'date': self.date
-        }
+    def share_img(self, other):
+        '''
+        other: Sky object of the same cluster, with its image already queried.
 
-        return info
-    
-    def flag_dist(self, thresh):
+        Uses the image of another sky instead of querying a new one. The HDU,
+        WCS and image data are the same objects, not copies.
+        '''
+
+        self.hdu = other.hdu
+        self.wcs = other.wcs
+        self.img_data = other.img_data
+        self.bands = other.bands
+        self.source_x = self.source_y = None
+        
+    def flag_region(self, thresh):
         '''
         thresh: Astropy Quantity object in arcminutes or arcseconds to define a 
         radius of a circle-shaped search region.
         
         Takes a circular region in the sky of radius "thresh", centered on the moving object 
-        (or center sky coordinates) and detects whether or not there are sources 
-        in this region. It adds all of the coordinates of sources that are in this region into 
-        the self.flagged_ra and self.flagged_de lists in degrees.
-        
+        (or center sky coordinates), and stores it in pixels of the sky FITS to
+        self.pixel_region. The sources in this region are flagged for the whole track
+        at once by SourceStore.flag_dist.
         '''
         self.thresh = thresh
-        
-        c = SkyCoord(self.source_ra, self.source_de, unit='deg')
-    
-        sky_region = CircleSkyRegion(center=self.coords, radius=thresh)
-        in_circle = sky_region.contains(c, wcs=self.wcs)
-
-        for n, flagged in enumerate(in_circle):
-            if flagged:
-                self.flagged_ra.append(self.source_ra[n])
-                self.flagged_de.append(self.source_de[n])
-                
-        self.pixel_region = sky_region.to_pixel(self.wcs)
-
-        info = {
-            'thresh': thresh,
-            'flagged': len(self.flagged_ra),
-            'date': self.date
-        }
-
-        return info
+
+        if self.centered():
+            center = self.wcs.wcs.crpix - 1
+        else:
+            center = world_to_pixel(self.wcs, self.coords.ra.deg, self.coords.dec.deg)
+
+        scale = np.mean(proj_plane_pixel_scales(self.wcs.celestial))
+        self.pixel_region = CirclePixelRegion(PixCoord(*center), radius=thresh.to_value(u.deg) / scale)
         
     def separate(self):
         '''
-        Calculates the angular separation between each of the flagged sources and
-        the center coorindate where the moving is supposed to be. Adds it to self.distances.
+        Calculates the angular separation between each of the sources and
+        the center coorindate where the moving is supposed to be. Stores it in self.distances.
         '''
-        for RA, DEC in zip(self.source_ra, self.source_de):
-            c_source = SkyCoord(f'{RA} {DEC}', frame='icrs', unit=(u.deg, u.deg))
-            
-            dist = c_source.separation(self.coords)
-        
-        self.distances.append(dist)
+
+        self.distances = self.separations()
         
         
     def __repr__(self):
         return f"sky {self.num} at {self.date.value}"
-        
\ No newline at end of file
@@ -1,17 +1,27 @@
 from backend.sky import Sky
+from backend.instrument import Tracer
+from backend.store import SourceStore
+from backend.clusters import cluster_track
+from backend.variables import cluster_tol, catalogs, ir_catalog, single_survey, vizier_batch
+from backend.cutouts import cutout, pixel_scale
+import backend.vizier as vizier
 from astropy.time import Time
 from astroquery.mpc import MPC
-from astroquery.vizier import Vizier
 from tqdm import tqdm
 from astropy.coordinates import SkyCoord, Angle
 import astropy.units as u
-from astropy.io import fits
+import numpy as np
 from astropy.wcs import WCS
-from urllib.parse import urlencode
 
 
 
-def query(id, start_from, step, num_results, t_start, t_end):
+# Vizier clients of the catalog and of the rows of sky_query (see backend.vizier).
+optical = dict(catalog='V/154', keywords=['optical'], row_limit=-1, columns=['all'],
+               column_filters={"gmag": "<21"}) # SDSS16
+preview = dict(catalog='V/154', keywords=['optical'], row_limit=1000, columns=['all']) # SDSS16
+
+
+def query(id, start_from, step, num_results, t_start, t_end, tracer=None, client=None):
 
     '''
     Generates the query from the Minor Planet Center according to the parameters
@@ -22,9 +32,19 @@ def query(id, start_from, step, num_results, t_start, t_end):
     step: str. An integer followed by the unit, e.g. 5s, 10min, 1h, 7d.
     t_start: str. in YYYY-MM-DD hh:mm:ss format.
     t_end: str. in YYYY-MM-DD hh:mm:ss format.
+    tracer: backend.instrument.Tracer or None. Records the request.
+    client: astroquery.mpc.MPCClass or None. Client of the request, one per thread
+    when several targets are queried at once. MPC by default.
     '''
 
-    eph = MPC.get_ephemeris(id, start=start_from, step=step, number=num_results)
+    tracer = tracer or Tracer()
+    client = client or MPC
+
+    def get_ephemeris():
+        with tracer.request('mpc', client._session):
+            return client.get_ephemeris(id, start=start_from, step=step, number=num_results)
+
+    eph = tracer.run(get_ephemeris)
 
     time_start = Time(t_start, format='iso', scale='utc')
     time_end = Time(t_end, format='iso', scale='utc')
@@ -34,48 +54,207 @@ def query(id, start_from, step, num_results, t_start, t_end):
     
     return eph_req
 
+
+def query_field(c, side, tracer=None, client=None):
+    '''
+    Queries the catalog, and the infrared catalog (ir_catalog) for the crossmatch,
+    over a square field. Returns both results, the second one None without
+    ir_catalog. Fields can be queried from several threads at once.
+
+    c: astropy.coordinates.SkyCoord. Center of the field.
+    side: float. Side of the field (deg).
+    tracer: backend.instrument.Tracer or None. Records the Vizier requests.
+    client: backend.vizier.CatalogClient or None. By default, the shared one.
+    '''
+
+    tracer = tracer or Tracer()
+    client = client or vizier.shared()
+
+    region = dict(coordinates=c, width=Angle(side, u.deg), height=Angle(side, u.deg), frame='icrs')
+
+    result = client.query_region(optical, tracer, **region)
+
+    ir_result = None
+    if ir_catalog is not None:
+        ir = dict(catalog=catalogs[ir_catalog], row_limit=-1, columns=['all'])
+        ir_result = client.query_region(ir, tracer, **region)
+
+    return result, ir_result
+
+
+def query_fields(centers, side, tracer=None, client=None):
+    '''
+    Same as query_field for several square fields, with one request per
+    catalog for all of them (see backend.vizier.CatalogClient.query_regions).
+    Returns the results of every field, in order.
+
+    centers: astropy.coordinates.SkyCoord. Array of the centers of the fields.
+    side: float. Side of the fields (deg).
+    tracer: backend.instrument.Tracer or None. Records the Vizier requests.
+    client: backend.vizier.CatalogClient or None. By default, the shared one.
+    '''
+
+    tracer = tracer or Tracer()
+    client = client or vizier.shared()
+
+    region = dict(width=Angle(side, u.deg), height=Angle(side, u.deg), frame='icrs')
+
+    results = client.query_regions(optical, centers, tracer, **region)
+
+    ir_results = [None] * len(results)
+    if ir_catalog is not None:
+        ir = dict(catalog=catalogs[ir_catalog], row_limit=-1, columns=['all'])
+        ir_results = client.query_regions(ir, centers, tracer, **region)
+
+    return list(zip(results, ir_results))
+
     
-def sky_init(eph, fov):
+def sky_init(eph, fov, tracer=None, labels=None, fields=None, client=None):
     '''
     Creates a sky object for each region of the sky that the object will pass through
     acccording the requested ephemeris files.
 
+    Epochs whose centers are within cluster_tol * fov of each other are grouped
+    (see backend.clusters), and the catalog is queried once per group over a
+    field that covers all of them, along with the infrared catalog (ir_catalog)
+    for the crossmatch. Every sky keeps the shared results. The fields are
+    queried vizier_batch at a time, in one request per catalog (query_fields).
+
     eph: astropy.Table that contains the requested ephemeris of the object.
+    tracer: backend.instrument.Tracer or None. Records a span per epoch and the
+    Vizier requests.
+    labels: numpy array or None. Group of every epoch, when the groups are shared
+    with other targets (see backend.scheduler). By default, from cluster_track.
+    fields: dict-like or None. Results of query_field of the groups already
+    queried, by label. Filled with the groups queried here, a batch at a time, so
+    that a backend.checkpoint.Checkpoint keeps them if the query stops halfway.
+    client: backend.vizier.CatalogClient or None. Client of the Vizier queries.
     '''
     
+    tracer = tracer or Tracer()
+    fields = {} if fields is None else fields
+
+    tol = cluster_tol * fov / 60 # deg
+    side = fov / 60 + 2 * tol
+
+    if labels is None:
+        labels, anchors = cluster_track(eph['RA'], eph['Dec'], tol)
+
+    # The first epoch of a group is its anchor, the center of the field.
+    first = {}
+    for i, label in enumerate(labels):
+        first.setdefault(label, i)
+
+    ra, dec = np.asarray(eph['RA'], dtype=float), np.asarray(eph['Dec'], dtype=float)
+    pending = [label for label in first if label not in fields]
+
     i = 0
     skys = []
 
     for RA, DEC, date in tqdm(zip(eph['RA'], eph['Dec'], eph['Date']), total=len(eph)):
-        c = SkyCoord(ra=RA*u.degree, dec=DEC*u.degree, frame='icrs')
-        v = Vizier(catalog='V/154', keywords=['optical'], row_limit=-1, columns=['all'],
-                   column_filters={"gmag":"<21"}) # SDSS16
-        result = v.query_region(coordinates=c, width=Angle(fov, u.arcminute), 
-                                height=Angle(fov, u.arcminute), frame='icrs')
-        sky = Sky(i, result, c, date)
-        skys.append(sky)
+        with tracer.epoch(i):
+            c = SkyCoord(ra=RA*u.degree, dec=DEC*u.degree, frame='icrs')
+
+            # The groups are met in the order of pending: this one and the
+            # next ones are queried together.
+            if labels[i] not in fields:
+                batch, pending = pending[:vizier_batch], pending[vizier_batch:]
+                index = [first[label] for label in batch]
+                centers = SkyCoord(ra=ra[index]*u.degree, dec=dec[index]*u.degree, frame='icrs')
+
+                for label, field in zip(batch, query_fields(centers, side, tracer, client)):
+                    fields[label] = field
+
+            result, ir_result = fields[labels[i]]
+            sky = Sky(i, result, c, date, labels[i], ir_result)
+            skys.append(sky)
         i += 1
         
     return skys
 
     
-def sky_process(skys, fov):
+def sky_process(skys, fov, tracer=None, queried=None, cutouts=None, surveys=None):
     '''
-    Receives iterable with Sky objects and applies each method.
+    Receives iterable with Sky objects and applies each method. The image is
+    queried once per cluster of skys, wide enough to cover all of them, and
+    shared by the rest of the cluster, and so is the crossmatch of the catalogs.
+
+    The sources of every sky are then gathered in one SourceStore for the whole
+    track, and the raw catalog results are released. Returns the store.
+
+    queried: dict or None. First sky of every cluster already processed, by
+    cluster, when clusters are shared with other targets. Filled with the
+    clusters processed here.
+    cutouts: dict-like or None. Images of the clusters already fetched, by
+    cluster, e.g. Checkpoint.cutouts. Filled with the images fetched here.
+    surveys: list of str or None. Bands of the images (see backend.cutouts).
     '''
+
+    tracer = tracer or Tracer()
+    queried = {} if queried is None else queried
+    cutouts = {} if cutouts is None else cutouts
+
     for sky in tqdm(skys):
-        sky.filter_detec()
-        sky.store_radec()
-        sky.img_query(fov / 2) # Divided by two because the image query takes a radius.
+        with tracer.epoch(sky.num):
+            if sky.cluster is not None and sky.cluster in queried:
+                first = queried[sky.cluster]
+                sky.share_img(first)
+                sky.crossmatch(fov, first.matched)
+            else:
+                if sky.hdu is not None: # Already fetched, see backend.scheduler.
+                    pass
+                elif sky.cluster in cutouts:
+                    sky.set_img(cutouts[sky.cluster])
+                else:
+                    sky.img_query(fov, tracer, margin=cluster_tol * fov, surveys=surveys)
+                    cutouts[sky.cluster] = sky.bands
+                sky.crossmatch(fov)
+                queried[sky.cluster] = sky
+
+            sky.filter_detec()
+
+    store = SourceStore.from_skys(skys)
+
+    for sky in skys:
+        sky.attach(store)
         sky.separate()
+        sky.result = sky.ir_result = None
 
+    return store
 
-def sky_query(coordinates, radius=None, fov=None):
+
+def flag_track(skys, thresh):
+    '''
+    Flags the sources of every sky of a track at once, on the columns of its
+    SourceStore, and sets the flagging region of every sky.
+
+    Returns, for every sky, the index in the store of its brightest source in
+    the g band (-1 if it has none) and the number of sources within thresh of
+    its center.
+
+    skys: list of Sky objects attached to the same SourceStore.
+    thresh: astropy Quantity. Flagging radius.
+    '''
+
+    store = skys[0].store
+
+    brightest = store.argmin(store.band('g'))
+    flagged = store.flag_dist(thresh.to_value(u.deg))
+
+    for sky in skys:
+        sky.flag_region(thresh)
+
+    return brightest, flagged
+
+
+def sky_query(coordinates, radius=None, fov=None, client=None):
 
     '''
     Queries sky images in the given coordinates.
     '''
 
+    client = client or vizier.shared()
+
     RA = [coordinates][0]
     DEC = [coordinates][1]
 
@@ -83,42 +262,41 @@ def sky_query(coordinates, radius=None, fov=None):
 
     if fov is not None:
 
-        v = Vizier(catalog='V/154', keywords=['optical'], row_limit=1000, columns=['all']) # SDSS16
-        result = v.query_region(coordinates=c, width=Angle(fov, u.arcminute), 
-                                    height=Angle(fov, u.arcminute), frame='icrs')
+        result = client.query_region(preview, coordinates=c, width=Angle(fov, u.arcminute), 
+                                     height=Angle(fov, u.arcminute), frame='icrs')
         
     elif radius is not None:
 
-        v = Vizier(catalog='V/154', keywords=['optical'], row_limit=1000, columns=['all']) # SDSS16
-        result = v.query_region(coordinates=c, radius=Angle(fov, u.arcminute), frame='icrs')
+        result = client.query_region(preview, coordinates=c, radius=Angle(fov, u.arcminute), frame='icrs')
 
 
     return result
 
 
-def get_img(fov, ra, dec):
+def get_img(fov, ra, dec, tracer=None, survey=single_survey):
     
         '''
         fov: int.
+        tracer: backend.instrument.Tracer or None. Records the request.
+        survey: str. Survey of hips_surveys.
 
         Takes the fov of the instrument and the central coordinates of the moving object and 
-        querys a FITS file from the DSS.
+        querys a FITS file from the survey, up to 500 pixels wide but not
+        sharper than the survey (see backend.cutouts.pixel_scale).
         '''
 
         coord = SkyCoord(f"{ra} {dec}", unit=(u.hourangle, u.deg), frame='icrs')
+        pixels = int(np.ceil(fov * 60 / pixel_scale([survey], fov, pixels=500)))
 
         query_params = { 
-         'hips': 'CDS/P/HLA/SDSSg',
          'ra': coord.ra.value,
          'dec': coord.dec.value,
          'fov': (fov * u.arcmin).to(u.deg).value, # Consider reducing the FOV by half.
-         'width': 500, 
-         'height': 500 
+         'width': pixels, 
+         'height': pixels 
      }   
-        url = f'http://alasky.u-strasbg.fr/hips-image-services/hips2fits?{urlencode(query_params)}'
 
-        hdu = fits.open(url) # Opening FITS file.
-        hdu = hdu[0]
+        hdu = cutout(survey, query_params, tracer) # Opening FITS file.
 
         wcs = WCS(hdu.header)
 
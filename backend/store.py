@@ -0,0 +1,221 @@
+import numpy as np
+from astropy.table import Table
+from backend.projection import gnomonic
+import backend.variables as v
+
+
+'''
+Columnar storage of the catalog sources of a whole track.
+'''
+
+
+class SourceStore:
+
+    '''
+    Struct-of-arrays store of the sources seen on every epoch of a track. The
+    sources of every sky are contiguous and in sky order, so the sources of a
+    sky are a slice and per-sky operations over all the epochs are single
+    segmented NumPy reductions.
+
+    -------------
+    Attributes
+    -------------
+
+    bands: tuple of str. Bands of the magnitude columns.
+    ra, dec: numpy arrays, float64. Coordinates (deg).
+    mags: numpy array, float32 (sources, bands). Magnitudes, NaN if missing.
+    sky: numpy array, int32. Sky (Sky.num) every source belongs to.
+    uid: numpy array, int32. Dedup ID. The same star seen on several skys
+    has the same uid.
+    xi, eta: numpy arrays, float32. Gnomonic offsets around the center of
+    their sky (deg).
+    sep: numpy array, float32. Distance to the center of their sky (deg).
+    flagged: numpy array, bool. Sources flagged by distance.
+    starts: numpy array, int64. First source of every sky, followed by the
+    number of sources.
+
+    -------------
+    Methods
+    -------------
+
+    from_skys: Builds the store from the crossmatch of every sky.
+    from_columns: Rebuilds a store from its saved columns.
+    bounds: Slice of the sources of a sky.
+    band: Magnitudes of a band.
+    rows: Indices of the sources of some skys.
+    count: Sources per sky that satisfy a condition.
+    argmin: Source with the smallest value on every sky.
+    flag_dist: Flags the sources within a distance of their sky center.
+    table: Sources of a sky as an astropy Table.
+    '''
+
+    # Columns that hold the whole state of the store, see backend.session.
+    columns = ('ra', 'dec', 'mags', 'sky', 'uid', 'xi', 'eta', 'sep', 'flagged', 'starts')
+
+    def __init__(self, bands, ra, dec, mags, sky, n_skys: int, center_ra, center_dec):
+        self.bands = tuple(bands)
+        self.ra = np.asarray(ra, dtype=np.float64)
+        self.dec = np.asarray(dec, dtype=np.float64)
+        self.mags = np.asarray(mags, dtype=np.float32).reshape(len(self.ra), len(self.bands))
+        self.sky = np.asarray(sky, dtype=np.int32)
+        self.starts = np.searchsorted(self.sky, np.arange(n_skys + 1)).astype(np.int64)
+
+        # Same catalog row, same coordinates: sorted positions give the IDs.
+        order = np.lexsort((self.dec, self.ra))
+        new = np.ones(len(order), dtype=bool)
+        new[1:] = (np.diff(self.ra[order]) != 0) | (np.diff(self.dec[order]) != 0)
+        self.uid = np.empty(len(order), dtype=np.int32)
+        self.uid[order] = np.cumsum(new) - 1
+
+        xi, eta = gnomonic(self.ra, self.dec, np.asarray(center_ra)[self.sky],
+                           np.asarray(center_dec)[self.sky])
+        self.xi = xi.astype(np.float32)
+        self.eta = eta.astype(np.float32)
+        self.sep = np.degrees(np.arctan(np.radians(np.hypot(xi, eta)))).astype(np.float32)
+
+        self.flagged = np.zeros(len(self.ra), dtype=bool)
+
+    @classmethod
+    def from_skys(cls, skys):
+        '''
+        Returns the store of the optical sources of every sky, taken from the
+        crossmatch shared by its cluster (Sky.matched, Sky.source_rows), with
+        the magnitudes of all the bands of the crossmatch.
+        '''
+
+        bands = None
+        ra, dec, mags, owner = [], [], [], []
+
+        for sky in skys:
+            matched, rows = sky.matched, sky.source_rows
+
+            if bands is None:
+                bands = [name for name in matched.colnames
+                         if name not in ('ra', 'dec', 'sep') and not name.endswith('_row')]
+
+            ra.append(np.asarray(matched['ra'])[rows])
+            dec.append(np.asarray(matched['dec'])[rows])
+            mags.append(np.column_stack([np.asarray(matched[band])[rows] for band in bands]))
+            owner.append(np.full(len(rows), sky.num, dtype=np.int32))
+
+        bands = bands or list(v.catalog_columns['SDSS16']['bands'])
+
+        return cls(bands,
+                   np.concatenate(ra + [[]]),
+                   np.concatenate(dec + [[]]),
+                   np.concatenate(mags + [np.empty((0, len(bands)))]),
+                   np.concatenate(owner + [np.empty(0, dtype=np.int32)]),
+                   len(skys),
+                   [sky.coords.ra.deg for sky in skys],
+                   [sky.coords.dec.deg for sky in skys])
+
+    @classmethod
+    def from_columns(cls, bands, columns: dict):
+        '''
+        Returns the store made of already computed columns, e.g. memory-mapped
+        from a session file, without copying or recomputing them.
+
+        --------------
+        Parameters
+        --------------
+
+        bands: iterable of str. Bands of the magnitude columns.
+        columns: dict of numpy arrays with every name of SourceStore.columns.
+        '''
+
+        store = cls.__new__(cls)
+        store.bands = tuple(bands)
+
+        for name in cls.columns:
+            setattr(store, name, columns[name])
+
+        return store
+
+    def __len__(self):
+        return len(self.ra)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.columns if name != 'starts')
+
+    def bounds(self, num: int) -> slice:
+        '''
+        Returns the slice of the sources of sky num.
+        '''
+
+        return slice(self.starts[num], self.starts[num + 1])
+
+    def band(self, name: str):
+        '''
+        Returns the magnitudes of every source in a band (a view).
+        '''
+
+        return self.mags[:, self.bands.index(name)]
+
+    def rows(self, nums):
+        '''
+        Returns the indices of the sources of the skys nums, and the position
+        in nums of the sky of every one of them.
+        '''
+
+        nums = np.asarray(nums, dtype=int)
+        lengths = self.starts[nums + 1] - self.starts[nums]
+        offsets = np.repeat(self.starts[nums] - np.cumsum(lengths) + lengths, lengths)
+        owner = np.repeat(np.arange(len(nums)), lengths)
+
+        return np.arange(lengths.sum()) + offsets, owner
+
+    def count(self, mask):
+        '''
+        Returns the number of sources of every sky where mask is True.
+        '''
+
+        return np.bincount(self.sky[mask], minlength=len(self.starts) - 1)
+
+    def argmin(self, values):
+        '''
+        Returns, for every sky, the index of its source with the smallest
+        value, ignoring NaN, or -1 if it has none.
+        '''
+
+        values = np.where(np.isnan(values), np.inf, values)
+
+        # Sorted by sky and value, the first source of every sky is its minimum.
+        order = np.lexsort((values, self.sky))
+        n_skys = len(self.starts) - 1
+        best = np.full(n_skys, -1)
+
+        filled = self.starts[:-1] < self.starts[1:]
+        first = order[self.starts[:-1][filled]]
+        best[filled] = np.where(np.isinf(values[first]), -1, first)
+
+        return best
+
+    def flag_dist(self, radius: float):
+        '''
+        Flags the sources closer than radius (deg) to the center of their sky,
+        and returns the number of flagged sources of every sky.
+        '''
+
+        self.flagged = self.sep <= radius
+
+        return self.count(self.flagged)
+
+    def table(self, num: int) -> Table:
+        '''
+        Returns the sources of sky num as an astropy Table, with the column
+        names of the catalogs (RA_ICRS, DE_ICRS, umag...).
+        '''
+
+        rows = self.bounds(num)
+        names = {band: col for columns in v.catalog_columns.values()
+                 for band, col in columns['bands'].items()}
+
+        table = Table()
+        table['RA_ICRS'] = self.ra[rows]
+        table['DE_ICRS'] = self.dec[rows]
+
+        for n, band in enumerate(self.bands):
+            table[names.get(band, band)] = self.mags[rows, n]
+
+        return table
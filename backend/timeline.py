@@ -0,0 +1,190 @@
+import numpy as np
+
+
+'''
+Contamination timeline of a track: when every nearby star comes within the
+flagging radius of the target, sampled densely between the epochs of the
+ephemeris instead of once per epoch.
+'''
+
+
+def separation(ra1, dec1, ra2, dec2):
+    '''
+    Returns the angular distance (deg) between positions (deg), with the
+    haversine formula, which keeps its precision at small distances.
+    '''
+
+    ra1, dec1, ra2, dec2 = (np.radians(x) for x in (ra1, dec1, ra2, dec2))
+
+    h = np.sin((dec2 - dec1) / 2) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2
+
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(h, 0, 1))))
+
+
+def wrap(dra):
+    '''
+    Returns RA differences (deg) in [-180, 180).
+    '''
+
+    return (dra + 180) % 360 - 180
+
+
+def track_path(eph) -> tuple:
+    '''
+    Returns the MJD, RA and Dec (deg) of every epoch of an ephemeris, the
+    centers of the skys of its track.
+    '''
+
+    from astropy.time import Time
+
+    return (Time(eph['Date']).mjd, np.asarray(eph['RA'], dtype=float),
+            np.asarray(eph['Dec'], dtype=float))
+
+
+def track_stars(store) -> tuple:
+    '''
+    Returns the RA, Dec and g magnitude of every star of the SourceStore of a
+    track once, however many skys it was seen on.
+    '''
+
+    _, first = np.unique(store.uid, return_index=True)
+
+    return store.ra[first], store.dec[first], store.band('g')[first]
+
+
+def contamination_timeline(store, path: tuple, radius: float, cadence: float) -> dict:
+    '''
+    Samples the path of the target every cadence seconds, interpolated
+    linearly between the epochs of the ephemeris, and returns every interval
+    in which a star of the track is within radius of it.
+
+    All the stars and samples are handled at once: the stars are sorted
+    along the track, so that the ones near every segment of the path (between
+    two epochs) are a slice, and only the samples of the segments a star is
+    near are evaluated.
+
+    Returns a dict of numpy arrays, one entry per interval, ordered by start:
+
+    'start', 'end': MJD of the first and last samples within radius.
+    'closest': MJD of the closest sample.
+    'min_sep': float. Distance at the closest sample (arcsec).
+    'mag': float. g magnitude of the star, NaN if missing.
+    'ra', 'dec': float. Position of the star (deg).
+
+    and 'cadence' (s), 'radius' (arcsec), 'samples' (number of samples of the
+    path) and 'epochs' (MJD of every epoch).
+
+    --------------
+    Parameters
+    --------------
+
+    store: backend.store.SourceStore of the track.
+    path: tuple. MJD, RA and Dec (deg) of every epoch, in time order (see
+    track_path).
+    radius: float. Contamination radius (deg), e.g. the flagging one.
+    cadence: float. Time between samples (s).
+    '''
+
+    t, path_ra, path_dec = (np.asarray(x, dtype=float) for x in path)
+
+    star_ra, star_dec, star_mag = track_stars(store)
+
+    step = cadence / 86400
+    n_samples = int(np.floor((t[-1] - t[0]) / step + 1e-9)) + 1 if len(t) else 0
+    samples = t[0] + step * np.arange(n_samples) if len(t) else np.empty(0)
+
+    timeline = {'cadence': cadence, 'radius': radius * 3600, 'samples': n_samples, 'epochs': t}
+
+    empty = {key: np.empty(0) for key in ('start', 'end', 'closest', 'min_sep', 'mag', 'ra', 'dec')}
+
+    if len(t) < 2 or not len(star_ra):
+        timeline.update(empty)
+        return timeline
+
+    # Segments of the path between consecutive epochs, and their samples: a
+    # sample on an epoch belongs to the segment that starts there.
+    ra0, dec0 = path_ra[:-1], path_dec[:-1]
+    dra = wrap(path_ra[1:] - ra0)
+    ddec = path_dec[1:] - dec0
+
+    first = np.searchsorted(samples, t[:-1] - 1e-9)
+    stop = np.append(first[1:], n_samples)
+
+    # The stars are sorted along the axis the track moves most on, RA or Dec,
+    # so that the ones near a segment on that axis are a slice, and a narrow
+    # one. RA offsets are taken around the middle of the track, where they
+    # are smallest on the sky at the Dec furthest from the equator.
+    ra_c = path_ra[len(t) // 2]
+    x0 = wrap(ra0 - ra_c)
+    x_star = wrap(star_ra - ra_c)
+
+    dec_low = np.minimum(dec0, dec0 + ddec) - radius
+    dec_high = np.maximum(dec0, dec0 + ddec) + radius
+    cos_far = np.cos(np.radians(np.minimum(np.maximum(np.abs(dec_low), np.abs(dec_high)), 89.999)))
+    x_low = np.minimum(x0, x0 + dra) - radius / cos_far
+    x_high = np.maximum(x0, x0 + dra) + radius / cos_far
+
+    if np.ptp(x0 + dra / 2) * np.cos(np.radians(dec0.mean())) > np.ptp(dec0 + ddec / 2):
+        key, low, high = x_star, x_low, x_high
+    else:
+        key, low, high = star_dec, dec_low, dec_high
+
+    order = np.argsort(key, kind='stable')
+    lo = np.searchsorted(key[order], low, 'left')
+    counts = np.searchsorted(key[order], high, 'right') - lo
+    counts[stop <= first] = 0
+
+    segment = np.repeat(np.arange(len(dra)), counts)
+    star = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - lo, counts)]
+
+    # Then the box of the segment on the other axis.
+    near = ((star_dec[star] >= dec_low[segment]) & (star_dec[star] <= dec_high[segment])
+            & (x_star[star] >= x_low[segment]) & (x_star[star] <= x_high[segment]))
+    segment, star = segment[near], star[near]
+
+    # Every sample of the segment of every pair.
+    n = (stop - first)[segment]
+    pair = np.repeat(np.arange(len(segment)), n)
+    sample = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + np.repeat(first[segment], n)
+    segment, star = segment[pair], star[pair]
+
+    frac = (samples[sample] - t[segment]) / (t[segment + 1] - t[segment])
+    ra = (ra0[segment] + frac * dra[segment]) % 360
+    dec = dec0[segment] + frac * ddec[segment]
+
+    sep = separation(ra, dec, star_ra[star], star_dec[star])
+
+    inside = sep <= radius
+    star, sample, sep = star[inside], sample[inside], sep[inside]
+
+    if not len(star):
+        timeline.update(empty)
+        return timeline
+
+    # Runs of consecutive samples of the same star are the intervals.
+    order = np.lexsort((sample, star))
+    star, sample, sep = star[order], sample[order], sep[order]
+
+    new = np.ones(len(star), dtype=bool)
+    new[1:] = (star[1:] != star[:-1]) | (sample[1:] != sample[:-1] + 1)
+    starts = np.flatnonzero(new)
+    ends = np.append(starts[1:], len(star)) - 1
+
+    run = np.cumsum(new) - 1
+    closest = np.lexsort((sep, run))[starts]
+    stars = star[starts]
+
+    intervals = {
+        'start': samples[sample[starts]],
+        'end': samples[sample[ends]],
+        'closest': samples[sample[closest]],
+        'min_sep': sep[closest] * 3600,
+        'mag': star_mag[stars].astype(float),
+        'ra': star_ra[stars],
+        'dec': star_dec[stars]
+    }
+
+    by_start = np.argsort(intervals['start'], kind='stable')
+    timeline.update({key: value[by_start] for key, value in intervals.items()})
+
+    return timeline
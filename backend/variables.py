@@ -10,6 +10,106 @@ fovs = {
 }
 
 
+# HiPS surveys of the image cutouts (see settings/config.yml).
+
+hips_surveys = {
+    "dss": "DSS",
+    "dss2red": "CDS/P/DSS2/red",
+    "dss2blue": "CDS/P/DSS2/blue",
+    "sdssg": "CDS/P/HLA/SDSSg",
+    "sdssr": "CDS/P/HLA/SDSSr",
+    "sdssz": "CDS/P/HLA/SDSSz"
+}
+
+# Sets of bands fetched together and stacked (see backend.cutouts). The
+# mosaic shows one band at a time, and any other is shown without fetching.
+
+band_sets = {
+    "dss2 red+blue": ["dss2red", "dss2blue"],
+    "sdss g+r+z": ["sdssg", "sdssr", "sdssz"]
+}
+
+
+def surveys_of(name: str) -> list:
+    '''
+    Returns the surveys of a choice of the Survey box: the bands of a band
+    set (band_sets), or a single survey.
+    '''
+
+    return list(band_sets.get(name, [name]))
+
+
+survey = "dss" # Default survey, or band set, of the mosaics.
+
+single_survey = "sdssg" # Default survey of the single images (coordinates search).
+
+cutout_cache = 512 # Size of the cache of cutouts (MiB).
+
+# Type of the cutouts in memory (see backend.cutouts.compact): "float32", or
+# "int16" scaled to the range of every cutout, as in FITS files. The images
+# are only displayed, the flags come from the catalogs.
+
+image_dtype = "int16"
+
+compress_cutouts = True # Tile-compressed (RICE) cutouts in the checkpoints.
+
+# Native pixel scale of every survey (arcsec). Cutouts are never sharper.
+
+survey_resolution = {
+    "dss": 1.0,
+    "dss2red": 1.0,
+    "dss2blue": 1.0,
+    "sdssg": 0.4,
+    "sdssr": 0.4,
+    "sdssz": 0.4
+}
+
+context = 4 # Side of the background of a sky, in instrument FOVs, up to bg_fov.
+
+display_pixels = 800 # Screen pixels across the background of a sky, at most.
+
+zoom_upgrade = 1.5 # A sharper cutout of the view is fetched when zooming in past
+                   # this many screen pixels per mosaic pixel.
+
+zoom_delay = 300 # Time without zooming or panning before it is fetched (ms).
+
+
+# Contamination timeline (see backend.timeline): default time between the
+# samples of the path (s), and the most samples of a track.
+
+timeline_cadence = 10.
+
+timeline_samples = 2_000_000
+
+
+# Grid of FOV rotations for the rotation sweep: start, stop, step (deg).
+# The footprints are square, so rotations repeat every 90 deg.
+
+rot_sweep = (0, 90, 1)
+
+
+# Epochs closer than this fraction of the FOV share one catalog query and one
+# image cutout.
+
+cluster_tol = 0.1
+
+
+# Requests in flight at once when planning several targets (see backend.scheduler).
+
+night_workers = 8
+
+# Fields queried in one Vizier request, as a list of positions (see
+# backend.vizier). 1 for a request per field.
+
+vizier_batch = 50
+
+
+# Detections closer than this are the same source seen in overlapping survey
+# fields (arcsec).
+
+dup_tol = 1.
+
+
 # Catalogs for the image query.
 
 catalogs = {
@@ -18,4 +118,102 @@ catalogs = {
     "2MASS 6X": "II/281/2mass6x"
 }
 
+# Columns of every catalog (see settings/config.yml): position and the
+# magnitude of each band.
+
+catalog_columns = {
+    "SDSS16": {
+        "ra": "RA_ICRS",
+        "dec": "DE_ICRS",
+        "bands": {"u": "umag", "g": "gmag", "r": "rmag", "i": "imag", "z": "zmag"}
+    },
+    "2MASS": {
+        "ra": "RAJ2000",
+        "dec": "DEJ2000",
+        "bands": {"J": "Jmag", "H": "Hmag", "K": "Kmag"}
+    },
+    "2MASS 6X": {
+        "ra": "RAJ2000",
+        "dec": "DEJ2000",
+        "bands": {"J": "Jmag", "H": "Hmag", "K": "Kmag"}
+    }
+}
+
+ir_catalog = "2MASS" # Crossmatched with SDSS16 for near-infrared magnitudes. None to skip.
+
+match_radius = 1.5 # Crossmatch radius (arcsec).
+
+
+# Share of the progress bar taken by each stage of the pipeline.
+
+stage_weights = {
+    "query": 5,
+    "sky_init": 35,
+    "sky_process": 40,
+    "flagging": 5,
+    "footprints": 2,
+    "send_mosaic": 15,
+    "single_img": 100,
+    "open_session": 20
+}
+
+trace_path = "traces" # Folder where the trace file of every run is written.
+
+# Mirrors of the CDS services, tried in this order (see backend.fetch): the
+# hips2fits endpoints, and the Vizier servers.
+
+mirrors = {
+    "hips2fits": [
+        "http://alasky.u-strasbg.fr/hips-image-services/hips2fits",
+        "http://alaskybis.u-strasbg.fr/hips-image-services/hips2fits"
+    ],
+    "vizier": [
+        "vizier.cds.unistra.fr",
+        "vizier.cfa.harvard.edu",
+        "vizier.iucaa.in"
+    ]
+}
+
+# Requests per second and burst allowed to every host of a service.
+
+rate_limits = {
+    "hips2fits": (10., 20),
+    "vizier": (10., 20)
+}
+
+fetch_timeout = (5, 60) # Connection and read timeouts of the image requests (s).
+
+breaker_failures = 3 # Consecutive failures or slow calls that stop the requests to a host.
+
+breaker_reset = 30. # Time before a stopped host is tried again (s).
+
+slow_call = 20. # Requests taking longer count as failures of the host (s).
+
+# Upper bounds of the buckets of the latency histograms (s).
+
+latency_buckets = [0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.]
+
+# Heavy modules imported in the background once the window shows, in the
+# order they are first needed by a query.
+
+warm_modules = [
+    "astropy.units",
+    "astropy.coordinates",
+    "astroquery.mpc",
+    "astroquery.vizier",
+    "backend.sky_handling",
+    "astropy.visualization.wcsaxes",
+    "reproject.mosaicking",
+    "backend.session"
+]
+
+session_path = "sessions" # Default folder of the session files.
+
+session_ext = ".pscs" # Extension of the session files.
+
+# Folder where the catalogs and images fetched by a query are kept until it
+# completes, so that a query that fails or is cancelled can be resumed.
+
+checkpoint_path = "checkpoints"
+
 ob_path = "" # CHANGE THIS PATH TO THE LOCATION OF THE OB FILES
\ No newline at end of file
@@ -0,0 +1,199 @@
+import copy
+import json
+import threading
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from astroquery.utils import TableList
+from astroquery.vizier import Vizier
+import backend.fetch as fetch
+from backend.instrument import Tracer
+from backend.variables import mirrors, night_workers
+
+
+'''
+Long-lived Vizier clients for the catalog queries.
+
+astroquery makes a new HTTP session for every Vizier object, and reads its
+keyword metadata again for every one of them. Here the clients are made once
+per configuration (catalog, columns, filters...) and kept in a pool, and they
+all share a single session, whose connections to every Vizier mirror are kept
+alive from one query to the next.
+
+Several fields can also be queried in one request, as a list of positions
+(query_regions): Vizier tags every row with the position it was found around
+(its _q column), which splits the result back into one per field.
+'''
+
+
+class CatalogClient:
+
+    '''
+    Pool of astroquery Vizier clients, owned by the backend and shared by
+    every query. A client is taken from the pool for each query, so that
+    queries can run from several threads at once, each sent to its own mirror
+    (see backend.fetch.call).
+
+    -------------
+    Attributes
+    -------------
+
+    session: requests.Session. Shared by every client, with up to size
+    connections kept alive per mirror.
+    size: int. Connections per mirror, as many as the queries run at once.
+
+    -------------
+    Methods
+    -------------
+
+    query_region: Vizier.query_region from the first mirror that answers.
+    query_regions: Same, for a list of positions in one request.
+    close: Closes the connections.
+    '''
+
+    def __init__(self, size=night_workers):
+        self.size = size
+        self.session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=len(mirrors['vizier']), pool_maxsize=size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # Server errors are raised, for a failover to the next mirror,
+        # instead of being parsed as an empty result.
+        self.session.hooks['response'].append(fetch.raise_for_server)
+
+        self._templates = {}
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _take(self, config: dict):
+        key = json.dumps(config, sort_keys=True)
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if idle:
+                return key, idle.pop()
+
+            template = self._templates.get(key)
+
+        if template is None:
+            # The keyword metadata are read here, once per configuration.
+            template = Vizier(**config)
+            template._session = self.session
+
+            with self._lock:
+                template = self._templates.setdefault(key, template)
+
+        return key, copy.copy(template)
+
+    def _give(self, key: str, client):
+        with self._lock:
+            self._idle[key].append(client)
+
+    def query_region(self, config: dict, tracer=None, **kwargs):
+        '''
+        Returns the result of Vizier.query_region, from the first Vizier
+        mirror that answers (see backend.fetch.call). The request is recorded
+        under 'vizier' in the tracer, and abandoned if the tracer is
+        cancelled (see Tracer.run).
+
+        --------------
+        Parameters
+        --------------
+
+        config: dict. Keyword arguments of astroquery Vizier (catalog,
+        columns, column_filters, row_limit...).
+        tracer: backend.instrument.Tracer or None.
+        kwargs: keyword arguments of Vizier.query_region.
+        '''
+
+        tracer = tracer or Tracer()
+
+        def query():
+            key, client = self._take(config)
+
+            def attempt(server):
+                client.VIZIER_SERVER = server
+                with tracer.request('vizier', self.session, cached=True):
+                    return client.query_region(**kwargs)
+
+            try:
+                return fetch.call('vizier', attempt, tracer)
+            finally:
+                self._give(key, client)
+
+        return tracer.run(query)
+
+    def query_regions(self, config: dict, coordinates, tracer=None, **kwargs) -> list:
+        '''
+        Queries the same region around every position at once, in a single
+        request (see query_region). Returns the result of every position, in
+        order, as query_region would (see demultiplex).
+
+        --------------
+        Parameters
+        --------------
+
+        config: dict. Keyword arguments of astroquery Vizier.
+        coordinates: astropy.coordinates.SkyCoord. Array of positions.
+        tracer: backend.instrument.Tracer or None.
+        kwargs: keyword arguments of Vizier.query_region (width, height...).
+        '''
+
+        result = self.query_region(config, tracer, coordinates=coordinates, **kwargs)
+
+        return demultiplex(result, len(coordinates))
+
+    def close(self):
+        '''
+        Closes the connections kept alive. The client can still be used, and
+        opens new ones.
+        '''
+
+        self.session.close()
+
+
+def demultiplex(result, n: int) -> list:
+    '''
+    Splits the result of a query for n positions into the result of every
+    position, by the _q column Vizier adds to every row (1 for the first
+    position). Positions without rows get an empty TableList, as Vizier
+    answers a query that finds nothing.
+    '''
+
+    tables = [{} for _ in range(n)]
+
+    for name in result.keys():
+        table = result[name]
+        q = np.asarray(table['_q'], dtype=int) - 1
+        table.remove_column('_q')
+
+        # Rows of every position, contiguous and in their order.
+        order = np.argsort(q, kind='stable')
+        bounds = np.searchsorted(q[order], np.arange(n + 1))
+
+        for k in range(n):
+            if bounds[k + 1] > bounds[k]:
+                tables[k][name] = table[order[bounds[k]:bounds[k + 1]]]
+
+    return [TableList(t) for t in tables]
+
+
+_shared = None
+
+_shared_lock = threading.Lock()
+
+
+def shared() -> CatalogClient:
+    '''
+    Returns the CatalogClient of the queries that are not given one, created
+    on first use.
+    '''
+
+    global _shared
+
+    with _shared_lock:
+        if _shared is None:
+            _shared = CatalogClient()
+        return _shared
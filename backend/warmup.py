@@ -0,0 +1,50 @@
+import importlib
+import logging
+import threading
+import time
+
+
+'''
+Background loading of the heavy scientific modules (astropy, astroquery,
+reproject...), so that the window shows first and the first query does not
+wait for them.
+'''
+
+
+log = logging.getLogger(__name__)
+
+
+def warm_up(modules: list, timings=None) -> threading.Thread:
+    '''
+    Imports modules, in order, in a daemon thread and returns the thread. A
+    module that is needed before it is warmed up is simply imported by the
+    caller: Python's import lock makes both wait for the same import.
+
+    --------------
+    Parameters
+    --------------
+
+    modules: list of str. Names of the modules, e.g. v.warm_modules.
+    timings: dict or None. Filled with the import time of every module (s).
+    '''
+
+    timings = {} if timings is None else timings
+
+    def run():
+        start = time.perf_counter()
+
+        for name in modules:
+            t0 = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                log.warning(f"Could not warm up {name}: {e}")
+                continue
+            timings[name] = time.perf_counter() - t0
+
+        log.info(f"Warmed up {len(timings)} modules in {time.perf_counter() - start:.2f} s")
+
+    thread = threading.Thread(target=run, name='warm_up', daemon=True)
+    thread.start()
+
+    return thread
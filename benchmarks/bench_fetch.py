@@ -0,0 +1,162 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest import mock
+import numpy as np
+from astropy.coordinates import SkyCoord
+
+from benchmarks.bench_pipeline import RESULTS_DIR, git_commit
+from benchmarks.standin import StandIn, serving
+from benchmarks.synthetic import Services, ephemeris
+import backend.fetch as fetch
+from backend.instrument import Tracer
+from backend.sky_handling import query_field
+from backend.variables import fovs, cluster_tol, warm_modules
+
+
+'''
+Benchmark of the fetch layer (backend.fetch) against local stand-ins of
+hips2fits and Vizier (benchmarks.standin). The primary mirror is degraded in
+several ways, and the throughput with failover to a healthy mirror is
+compared with the one of the primary alone:
+
+    python -m benchmarks.bench_fetch --fields 40
+'''
+
+
+# Faults of the primary mirror in every scenario.
+SCENARIOS = {
+    'healthy': {},
+    'slow': {'latency': 2.},
+    'errors': {'error_rate': 0.5},
+    'down': {'down': True}
+}
+
+
+def workload(n: int, fov: float, workers: int, tracer) -> dict:
+    '''
+    Queries the catalogs and the image of n fields, as the night planner
+    does, workers at a time. Returns the fields completed and failed, and the
+    wall time.
+    '''
+
+    rng = np.random.default_rng(0)
+    side = fov / 60 * (1 + 2 * cluster_tol)
+
+    def field(k):
+        ra, dec = 150. + rng.uniform(-1, 1), 2. + rng.uniform(-1, 1)
+        query_field(SkyCoord(ra, dec, unit='deg'), side, tracer)
+        fetch.fits_file({'hips': 'DSS', 'ra': ra, 'dec': dec, 'fov': side, 'width': 1000,
+                         'height': 1000}, tracer)
+
+    done = failed = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(field, k) for k in range(n)]:
+            try:
+                future.result()
+                done += 1
+            except Exception:
+                failed += 1
+
+    return {'done': done, 'failed': failed, 'seconds': time.perf_counter() - start}
+
+
+def run(scenario: str, failover: bool, args) -> dict:
+    services = Services(ephemeris(2), scale=args.scale)
+    faults = SCENARIOS[scenario]
+
+    primary = StandIn(services, latency=args.latency + faults.get('latency', 0.),
+                      error_rate=faults.get('error_rate', 0.))
+    mirror = StandIn(services, latency=args.latency)
+
+    if faults.get('down'):
+        primary.stop()
+
+    standins = (primary, mirror) if failover else (primary,)
+    tracer = Tracer()
+
+    with serving(*standins), mock.patch.object(fetch, 'slow_call', args.slow_call):
+        result = workload(args.fields, fovs[args.inst], args.workers, tracer)
+        hosts = fetch.health()
+
+    if not faults.get('down'):
+        primary.stop()
+    mirror.stop()
+
+    services_info = tracer.breakdown()['services']
+    result.update({
+        'throughput': result['done'] / result['seconds'],
+        'latency': {service: info['latency'] for service, info in services_info.items()},
+        'hosts': {('primary' if h.startswith(primary.hips2fits) or h == primary.vizier else 'mirror')
+                  + f' {info["service"]}': {k: info[k] for k in ('state', 'requests', 'errors')}
+                  for h, info in hosts.items()}
+    })
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the fetch layer on local stand-ins.')
+    parser.add_argument('--fields', type=int, default=40)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--inst', default='FORS2_std', choices=list(fovs.keys()))
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Time every healthy answer takes (s).')
+    parser.add_argument('--slow-call', type=float, default=1.,
+                        help='Requests taking longer count as failures of the host (s).')
+    parser.add_argument('--scale', type=float, default=0.1,
+                        help='Factor applied to the requested cutout size.')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--output', default=None, help='Path of the JSON results file.')
+    args = parser.parse_args(argv)
+
+    for name in warm_modules:
+        importlib.import_module(name)
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': vars(args),
+        'scenarios': {}
+    }
+
+    print(f'{"-" * 10} {args.fields} fields, {args.workers} at a time {"-" * 10}')
+
+    for scenario in args.scenarios:
+        results['scenarios'][scenario] = {}
+
+        for failover in (False, True):
+            mode = 'failover' if failover else 'primary'
+            result = run(scenario, failover, args)
+            results['scenarios'][scenario][mode] = result
+
+            p95 = max((info['p95'] for info in result['latency'].values()), default=0.)
+            print(f'{scenario:>8} {mode:>9}: {result["throughput"]:7.2f} fields/s '
+                  f'{result["done"]:4d} done {result["failed"]:4d} failed, p95 <= {p95:g} s')
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'fetch-{results["commit"]}-{stamp}.json')
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2, default=str)
+
+    print(f'Results stored in {output}')
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
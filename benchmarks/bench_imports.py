@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.bench_pipeline import RESULTS_DIR, git_commit
+
+
+'''
+Startup benchmark: time to window and import profile of the GUI.
+
+Every run starts a fresh interpreter that calls main.start() and reports
+when the window has been shown and when the background warm-up of the heavy
+modules (see backend.warmup) has finished. The import profile comes from
+python -X importtime on the same startup.
+
+Usage, from the repository root:
+
+    python -m benchmarks.bench_imports --runs 5
+    python -m benchmarks.bench_imports --compare benchmarks/results/<old>.json
+'''
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import sys, threading
+sys.path.insert(0, {root!r})
+import main
+app, front, back = main.start([])
+app.processEvents()
+print('window', flush=True)
+while not any(t.name == 'warm_up' for t in threading.enumerate()):
+    app.processEvents()
+for t in threading.enumerate():
+    if t.name == 'warm_up':
+        t.join()
+print('warm', flush=True)
+'''
+
+
+def environment(qt_platform: str) -> dict:
+    env = dict(os.environ)
+    if qt_platform:
+        env['QT_QPA_PLATFORM'] = qt_platform
+    return env
+
+
+def startup(qt_platform: str) -> dict:
+    '''
+    Starts the GUI in a fresh interpreter and returns the wall time from the
+    launch to the window being shown and to the end of the warm-up (s).
+    '''
+
+    code = CHILD.format(root=ROOT)
+    times = {}
+
+    start = time.perf_counter()
+    child = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, text=True, cwd=ROOT,
+                             env=environment(qt_platform))
+
+    for line in child.stdout:
+        times[line.strip()] = time.perf_counter() - start
+
+    child.wait()
+
+    if 'window' not in times:
+        raise RuntimeError(f'The GUI did not start (exit code {child.returncode}).')
+
+    return {'window_seconds': times['window'], 'warm_seconds': times.get('warm')}
+
+
+def import_profile(qt_platform: str, top: int) -> dict:
+    '''
+    Returns the cumulative import time (s) of the top-level modules imported
+    before the window shows, and of the slowest modules at any depth.
+    '''
+
+    code = f'import sys; sys.path.insert(0, {ROOT!r}); import main; main.start([])'
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True,
+                         text=True, cwd=ROOT, env=environment(qt_platform))
+
+    # "import time: self [us] | cumulative | imported package", nested by indent.
+    pattern = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+    modules = []
+
+    for line in out.stderr.splitlines():
+        match = pattern.match(line)
+        if match:
+            _, cumulative, indent, name = match.groups()
+            modules.append((name, int(cumulative) / 1e6, len(indent) // 2))
+
+    top_level = {name: seconds for name, seconds, depth in modules if depth == 0}
+    slowest = sorted(modules, key=lambda m: m[1], reverse=True)[:top]
+
+    profile = {
+        'total_seconds': sum(top_level.values()),
+        'top_level': dict(sorted(top_level.items(), key=lambda m: m[1], reverse=True)[:top]),
+        'slowest': {name: seconds for name, seconds, _ in slowest}
+    }
+
+    return profile
+
+
+def compare(current: dict, path: str):
+    '''
+    Prints the ratio between the startup times of the current results and
+    the ones stored in a previous results file.
+    '''
+
+    with open(path) as file:
+        previous = json.load(file)
+
+    print(f'{"-" * 10} compared to {path} {"-" * 10}')
+
+    for key in ('window_seconds', 'warm_seconds'):
+        old, new = previous['startup'].get(key), current['startup'].get(key)
+        if old and new:
+            print(f'{key:>16}: x{new / old:6.2f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the GUI.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='Modules listed in the profile.')
+    parser.add_argument('--target', type=float, default=1.,
+                        help='Time to window to stay under (s).')
+    parser.add_argument('--platform', default='offscreen',
+                        help='Qt platform plugin of the runs, empty for the default one.')
+    parser.add_argument('--output', default=None, help='Path of the JSON results file.')
+    parser.add_argument('--compare', default=None, help='Previous JSON results file.')
+    args = parser.parse_args(argv)
+
+    # The first run fills the bytecode and disk caches, and is left out.
+    startup(args.platform)
+    runs = [startup(args.platform) for _ in range(args.runs)]
+
+    window = sorted(run['window_seconds'] for run in runs)
+    warm = sorted(run['warm_seconds'] for run in runs if run['warm_seconds'] is not None)
+
+    print(f'{"-" * 10} startup, {args.runs} runs {"-" * 10}')
+    print(f'{"window":>12}: {window[len(window) // 2]:8.3f} s median, {window[0]:.3f} s best')
+    if warm:
+        print(f'{"warm-up":>12}: {warm[len(warm) // 2]:8.3f} s median, {warm[0]:.3f} s best')
+
+    profile = import_profile(args.platform, args.top)
+
+    print(f'{"-" * 10} imports before the window: {profile["total_seconds"]:.3f} s {"-" * 10}')
+    for name, seconds in profile['slowest'].items():
+        print(f'{name:>40}: {seconds:8.3f} s')
+
+    median = window[len(window) // 2]
+    print(f'Time to window {median:.3f} s, target {args.target:.3f} s: '
+          f'{"OK" if median <= args.target else "ABOVE TARGET"}')
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': {'runs': args.runs, 'qt_platform': args.platform},
+        'startup': {
+            'window_seconds': median,
+            'warm_seconds': warm[len(warm) // 2] if warm else None,
+            'runs': runs
+        },
+        'imports': profile
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'imports-{results["commit"]}-{stamp}.json')
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(f'Results stored in {output}')
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
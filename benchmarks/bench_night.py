@@ -0,0 +1,142 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import astropy.units as u
+
+from benchmarks.bench_pipeline import RESULTS_DIR, git_commit
+from benchmarks.synthetic import Services, ephemeris, offline
+from backend.instrument import Tracer
+from backend.footprint import footprints
+from backend.scheduler import plan_night
+from backend.sky_handling import query, sky_init, sky_process, flag_track
+from backend.variables import fovs, warm_modules
+
+
+'''
+Benchmark of the night planner (backend.scheduler) against planning every
+target on its own with the single-target pipeline, on synthetic targets that
+cross the same sky area:
+
+    python -m benchmarks.bench_night --targets 8 --epochs 100
+'''
+
+
+def targets(n: int, epochs: int, spread: float, seed=0) -> dict:
+    '''
+    Returns the synthetic ephemerides of n targets starting within spread
+    (arcmin) of each other, with different rates, by target ID.
+    '''
+
+    rng = np.random.default_rng(seed)
+    ephs = {}
+
+    for k in range(n):
+        ra0 = 150. + rng.uniform(-spread, spread) / 60
+        dec0 = 2. + rng.uniform(-spread, spread) / 60
+        ephs[f'target{k}'] = ephemeris(epochs, ra0=ra0, dec0=dec0, rate=rng.uniform(0.2, 1.))
+
+    return ephs
+
+
+def params(id: str, eph) -> dict:
+    return {
+        'id': id,
+        'start_from': eph['Date'][0].iso,
+        'step': '1min',
+        'num_results': len(eph),
+        't_start': eph['Date'][0].iso,
+        't_end': (eph['Date'][-1] + 1 * u.s).iso
+    }
+
+
+def single(id: str, eph, fov: float):
+    '''
+    Plans one target as Backend.sky_generator does, without the mosaic.
+    '''
+
+    tracer = Tracer()
+    eph = query(**params(id, eph), tracer=tracer)
+    skys = sky_init(eph, fov, tracer)
+    sky_process(skys, fov, tracer)
+    flag_track(skys, 0.5 * u.arcmin)
+    footprints(skys, fov, 0.)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the night planner on synthetic targets.')
+    parser.add_argument('--targets', type=int, default=8)
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--inst', default='FORS2_std', choices=list(fovs.keys()))
+    parser.add_argument('--spread', type=float, default=3.,
+                        help='Spread of the starting positions of the targets (arcmin).')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Time every request takes (s).')
+    parser.add_argument('--scale', type=float, default=0.25,
+                        help='Factor applied to the requested cutout size.')
+    parser.add_argument('--output', default=None, help='Path of the JSON results file.')
+    args = parser.parse_args(argv)
+
+    for name in warm_modules:
+        importlib.import_module(name)
+
+    fov = fovs[args.inst]
+    ephs = targets(args.targets, args.epochs, args.spread)
+
+    services = Services(ephs, scale=args.scale, latency=args.latency)
+
+    with offline(services):
+        start = time.perf_counter()
+        for id, eph in ephs.items():
+            single(id, eph, fov)
+        separate = time.perf_counter() - start
+        separate_requests = dict(services.requests)
+
+        services.requests.clear()
+
+        start = time.perf_counter()
+        plans, errors = plan_night([params(id, eph) for id, eph in ephs.items()], fov)
+        night = time.perf_counter() - start
+        night_requests = dict(services.requests)
+
+    print(f'{"-" * 10} {args.targets} targets x {args.epochs} epochs {"-" * 10}')
+    print(f'{"one by one":>12}: {separate:8.3f} s {separate_requests}')
+    print(f'{"night plan":>12}: {night:8.3f} s {night_requests}')
+    print(f'{"speed-up":>12}: x{separate / night:.2f}')
+
+    for id, plan in plans.items():
+        print(f'{id:>12}: best {plan.best}, {len(plan.windows)} clean windows')
+    for id, e in errors.items():
+        print(f'{id:>12}: {e}')
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': vars(args),
+        'separate': {'seconds': separate, 'requests': separate_requests},
+        'night': {'seconds': night, 'requests': night_requests}
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'night-{results["commit"]}-{stamp}.json')
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(f'Results stored in {output}')
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+import astropy.units as u
+
+from benchmarks.synthetic import Services, ephemeris, offline
+from backend.backend import Backend
+from backend.instrument import Tracer
+from backend.sky_handling import query, sky_init, sky_process
+from backend.variables import fovs, warm_modules
+
+
+'''
+End-to-end benchmark of the sky pipeline:
+
+    query -> sky_init -> sky_process -> flagging -> send_mosaic
+
+Runs against synthetic ephemerides, catalogs and cutouts (see
+benchmarks/synthetic.py) and stores the timing, peak memory and request
+counts of every stage as JSON.
+
+Usage, from the repository root:
+
+    python -m benchmarks.bench_pipeline --epochs 10 100 1000
+    python -m benchmarks.bench_pipeline --compare benchmarks/results/<old>.json
+'''
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+STAGES = ['query', 'sky_init', 'sky_process', 'flagging', 'send_mosaic']
+
+
+def measure(stage, services, func, *args):
+    '''
+    Runs func(*args) and returns its result together with the wall time,
+    the peak traced memory and the requests made during the call.
+    '''
+
+    before = dict(services.requests)
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+
+    result = func(*args)
+
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+
+    requests = {k: n - before.get(k, 0) for k, n in services.requests.items()
+                if n - before.get(k, 0)}
+
+    print(f'{stage:>12}: {seconds:8.3f} s {peak / 2 ** 20:9.1f} MiB {requests}')
+
+    info = {
+        'seconds': seconds,
+        'peak_mib': peak / 2 ** 20,
+        'requests': requests
+    }
+
+    return result, info
+
+
+def run(n: int, inst: str, density: float, scale: float, rate: float) -> dict:
+    '''
+    Benchmarks one synthetic track of n epochs. Returns a dict with the
+    measurements of every stage, and the bytes and latency per service
+    recorded by the pipeline's tracer.
+    '''
+
+    print(f'{"-" * 10} {n} epochs {"-" * 10}')
+
+    eph = ephemeris(n, rate=rate)
+    fov = fovs[inst]
+
+    params = {
+        'id': 'synthetic',
+        'start_from': eph['Date'][0].iso,
+        'step': '1min',
+        'num_results': n,
+        't_start': eph['Date'][0].iso,
+        't_end': (eph['Date'][-1] + 1 * u.s).iso
+    }
+
+    back = Backend()
+    back.fov = fov
+    tracer = back.tracer = Tracer()
+
+    stages = {}
+    services = Services(eph, density=density, scale=scale)
+
+    tracemalloc.start()
+
+    with offline(services):
+        eph_req, stages['query'] = measure('query', services, query, *params.values(), tracer)
+        skys, stages['sky_init'] = measure('sky_init', services, sky_init, eph_req, fov, tracer)
+        _, stages['sky_process'] = measure('sky_process', services, sky_process, skys, fov, tracer)
+        _, stages['flagging'] = measure('flagging', services, back.flagging, skys)
+        _, stages['send_mosaic'] = measure('send_mosaic', services, back.send_mosaic, skys)
+
+    tracemalloc.stop()
+
+    total = sum(stage['seconds'] for stage in stages.values())
+    slowest = max(stages, key=lambda k: stages[k]['seconds'])
+    print(f'{"total":>12}: {total:8.3f} s, dominated by {slowest}')
+
+    info = {
+        'epochs': n,
+        'instrument': inst,
+        'total_seconds': total,
+        'dominant_stage': slowest,
+        'stages': stages,
+        'services': tracer.breakdown()['services']
+    }
+
+    return info
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                             text=True, cwd=os.path.dirname(__file__))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(current: dict, path: str):
+    '''
+    Prints the ratio between the stage timings of the current results
+    and the ones stored in a previous results file.
+    '''
+
+    with open(path) as file:
+        previous = json.load(file)
+
+    old_runs = {run['epochs']: run for run in previous['runs']}
+
+    print(f'{"-" * 10} compared to {path} {"-" * 10}')
+
+    for new in current['runs']:
+        old = old_runs.get(new['epochs'])
+        if old is None:
+            continue
+        for stage in STAGES:
+            ratio = new['stages'][stage]['seconds'] / max(old['stages'][stage]['seconds'], 1e-9)
+            print(f'{new["epochs"]:>6} {stage:>12}: x{ratio:6.2f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the sky pipeline on synthetic data.')
+    parser.add_argument('--epochs', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--inst', default='FORS2_std', choices=list(fovs.keys()))
+    parser.add_argument('--density', type=float, default=5.,
+                        help='Catalog sources per square arcmin.')
+    parser.add_argument('--scale', type=float, default=0.25,
+                        help='Factor applied to the requested cutout size.')
+    parser.add_argument('--rate', type=float, default=0.5,
+                        help='Apparent motion of the target (arcsec per epoch).')
+    parser.add_argument('--output', default=None, help='Path of the JSON results file.')
+    parser.add_argument('--compare', default=None, help='Previous JSON results file.')
+    args = parser.parse_args(argv)
+
+    # The backend imports these on first use; loaded here so that no stage
+    # is charged for them (the GUI warms them up in the background).
+    for name in warm_modules:
+        importlib.import_module(name)
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': {
+            'inst': args.inst,
+            'density': args.density,
+            'scale': args.scale,
+            'rate': args.rate
+        },
+        'runs': [run(n, args.inst, args.density, args.scale, args.rate) for n in args.epochs]
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'pipeline-{results["commit"]}-{stamp}.json')
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(f'Results stored in {output}')
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import astropy.units as u
+
+from benchmarks.bench_pipeline import RESULTS_DIR, git_commit
+from benchmarks.synthetic import Services, ephemeris, offline
+from backend.instrument import Tracer
+from backend.footprint import rotation_sweep, track_sources
+from backend.projection import rotate
+from backend.sky_handling import query, sky_init, sky_process
+from backend.variables import fovs, warm_modules
+
+
+'''
+Benchmark of the FOV rotation sweep (backend.footprint.rotation_sweep) on a
+synthetic track, checked against a loop over the epochs. The check is also
+run with the epochs without sources near the FOV moved to the end of the
+track, where the vectorized sums are easiest to cut short:
+
+    python -m benchmarks.bench_rotation --epochs 500 --density 0.05
+'''
+
+
+def sweep_loop(skys, fov: float, angles) -> tuple:
+    '''
+    Returns the counts and fluxes of rotation_sweep, one epoch and one angle
+    at a time.
+    '''
+
+    half = fov / 2 / 60
+    _, _, mag, owner, xi, eta, _ = track_sources(skys)
+    flux = 10 ** (-0.4 * np.nan_to_num(mag, nan=np.inf))
+
+    counts = np.zeros((len(skys), len(angles)), dtype=np.int32)
+    total = np.zeros((len(skys), len(angles)))
+
+    for k in range(len(skys)):
+        mine = owner == k
+        for j, angle in enumerate(angles):
+            u, v = rotate(xi[mine], eta[mine], angle)
+            inside = (np.abs(u) <= half) & (np.abs(v) <= half)
+            counts[k, j] = inside.sum()
+            total[k, j] = flux[mine][inside].sum()
+
+    return counts, total
+
+
+def check(skys, fov: float, angles, label: str) -> bool:
+    '''
+    Compares rotation_sweep with sweep_loop and prints the result.
+    '''
+
+    sweep = rotation_sweep(skys, fov, angles)
+    counts, total = sweep_loop(skys, fov, angles)
+
+    # The magnitudes are float32, and so are the sums of their fluxes.
+    same = (np.array_equal(sweep['counts'], counts)
+            and np.allclose(sweep['flux'], total, rtol=1e-6, atol=0)
+            and np.array_equal(sweep['best'], angles[np.argmin(total, axis=1)]))
+
+    print(f'{label:>12}: {"matches" if same else "DIFFERS from"} the loop over epochs')
+
+    return same
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark and check the FOV rotation sweep.')
+    parser.add_argument('--epochs', type=int, default=500)
+    parser.add_argument('--inst', default='FORS2_std', choices=list(fovs.keys()))
+    parser.add_argument('--density', type=float, default=0.05,
+                        help='Catalog sources per square arcmin. Low densities leave '
+                             'epochs without sources near the FOV.')
+    parser.add_argument('--rate', type=float, default=20.,
+                        help='Apparent motion of the target (arcsec per epoch).')
+    parser.add_argument('--step', type=float, default=1., help='Step of the angles (deg).')
+    parser.add_argument('--output', default=None, help='Path of the JSON results file.')
+    args = parser.parse_args(argv)
+
+    for name in warm_modules:
+        importlib.import_module(name)
+
+    fov = fovs[args.inst]
+    angles = np.arange(0., 90., args.step)
+    eph = ephemeris(args.epochs, rate=args.rate)
+
+    params = {
+        'id': 'synthetic',
+        'start_from': eph['Date'][0].iso,
+        'step': '1min',
+        'num_results': args.epochs,
+        't_start': eph['Date'][0].iso,
+        't_end': (eph['Date'][-1] + 1 * u.s).iso
+    }
+
+    services = Services(eph, density=args.density, scale=0.1)
+
+    with offline(services):
+        tracer = Tracer()
+        skys = sky_init(query(**params, tracer=tracer), fov, tracer)
+        sky_process(skys, fov, tracer)
+
+    start = time.perf_counter()
+    rotation_sweep(skys, fov, angles)
+    seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sweep_loop(skys, fov, angles)
+    loop_seconds = time.perf_counter() - start
+
+    # Epochs with sources near the FOV first, the empty ones last.
+    half = fov / 2 / 60
+    _, _, _, owner, xi, eta, _ = track_sources(skys)
+    near = np.bincount(owner[np.hypot(xi, eta) <= half * np.sqrt(2)], minlength=len(skys)) > 0
+    reordered = [skys[k] for k in np.argsort(~near, kind='stable')]
+
+    print(f'{"-" * 10} {args.epochs} epochs x {len(angles)} angles, '
+          f'{np.count_nonzero(~near)} without sources near the FOV {"-" * 10}')
+    print(f'{"sweep":>12}: {seconds:8.3f} s')
+    print(f'{"loop":>12}: {loop_seconds:8.3f} s')
+
+    same = check(skys, fov, angles, 'track') & check(reordered, fov, angles, 'empty last')
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': vars(args),
+        'sweep_seconds': seconds,
+        'loop_seconds': loop_seconds,
+        'empty_epochs': int(np.count_nonzero(~near)),
+        'matches_loop': bool(same)
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'rotation-{results["commit"]}-{stamp}.json')
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(f'Results stored in {output}')
+
+    if not same:
+        sys.exit(1)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest import mock
+import numpy as np
+from astropy.coordinates import SkyCoord
+
+from benchmarks.bench_pipeline import RESULTS_DIR, git_commit
+from benchmarks.standin import StandIn, serving
+from benchmarks.synthetic import Services, ephemeris
+from backend.instrument import Tracer
+from backend.sky_handling import query_field, query_fields
+from backend.variables import fovs, cluster_tol, warm_modules, rate_limits, vizier_batch
+from backend.vizier import CatalogClient
+
+
+'''
+Benchmark of the Vizier clients (backend.vizier) against a local stand-in of
+Vizier (benchmarks.standin). The catalog fields are queried with a new client
+for every field, as every query used to make its own Vizier objects, with one
+pooled client for the whole run, and in batches of positions sent in one
+request (backend.sky_handling.query_fields), as the backend does:
+
+    python -m benchmarks.bench_vizier --fields 200
+'''
+
+
+MODES = ['per query', 'pooled', 'batched']
+
+
+def workload(n: int, fov: float, workers: int, mode: str, batch: int) -> dict:
+    '''
+    Queries the catalogs of n fields, workers requests at a time, in one of
+    MODES. Returns the wall time, the time per field and the latency of the
+    requests.
+    '''
+
+    rng = np.random.default_rng(0)
+    side = fov / 60 * (1 + 2 * cluster_tol)
+    centers = SkyCoord(150. + rng.uniform(-1, 1, n), 2. + rng.uniform(-1, 1, n), unit='deg')
+
+    tracer = Tracer()
+    client = CatalogClient(size=workers) if mode != 'per query' else None
+
+    def field(c):
+        query_field(c, side, tracer, client or CatalogClient(size=workers))
+
+    def fields(k):
+        query_fields(centers[k:k + batch], side, tracer, client)
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if mode == 'batched':
+            list(pool.map(fields, range(0, n, batch)))
+        else:
+            list(pool.map(field, centers))
+
+    seconds = time.perf_counter() - start
+
+    return {'seconds': seconds, 'ms_per_field': 1e3 * seconds / n,
+            'latency': tracer.breakdown()['services']['vizier']['latency']}
+
+
+def run(mode: str, workers: int, args) -> dict:
+    services = Services(ephemeris(2), density=args.density)
+    standin = StandIn(services, latency=args.latency)
+
+    # Without the rate limit of the hosts, which would be all that is measured.
+    with serving(standin), mock.patch.dict(rate_limits, {'vizier': (float('inf'), 1)}):
+        result = workload(args.fields, fovs[args.inst], workers, mode, args.batch)
+
+    standin.stop()
+    result['connections'] = standin.connections
+    result['requests'] = services.requests['vizier']
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Vizier clients on a local stand-in.')
+    parser.add_argument('--fields', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--inst', default='FORS2_std', choices=list(fovs.keys()))
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='Time every answer of the stand-in takes (s).')
+    parser.add_argument('--density', type=float, default=5.,
+                        help='Catalog sources per square arcmin.')
+    parser.add_argument('--batch', type=int, default=vizier_batch,
+                        help='Fields per request in the batched mode.')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--output', default=None, help='Path of the JSON results file.')
+    args = parser.parse_args(argv)
+
+    for name in warm_modules:
+        importlib.import_module(name)
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': vars(args),
+        'runs': {}
+    }
+
+    print(f'{"-" * 10} {args.fields} fields {"-" * 10}')
+
+    for workers in args.workers:
+        for mode in args.modes:
+            result = run(mode, workers, args)
+            results['runs'][f'{mode}, {workers} at a time'] = result
+
+            print(f'{mode:>9}, {workers:2d} at a time: {result["ms_per_field"]:7.2f} ms/field '
+                  f'p50 {result["latency"]["p50"]:g} s, {result["requests"]:4d} requests, '
+                  f'{result["connections"]:4d} connections')
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'vizier-{results["commit"]}-{stamp}.json')
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2, default=str)
+
+    print(f'Results stored in {output}')
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import io
+import re
+import threading
+import time
+import numpy as np
+import astropy.units as u
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qsl
+from astropy.coordinates import SkyCoord, Angle
+from astropy.io.votable import from_table
+from astroquery import cache_conf
+from astroquery.vizier import VizierClass
+import backend.fetch as fetch
+import backend.cutouts as cutouts
+from backend.variables import mirrors
+
+
+'''
+Local stand-ins for the CDS services: HTTP servers answering hips2fits and
+Vizier requests with the synthetic data of benchmarks.synthetic.Services,
+with injected latency and errors, to measure backend.fetch while the
+services are degraded.
+'''
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written apart: with Nagle's algorithm, a kept-alive
+    # connection would wait for the delayed ACK of the client in between.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+
+        with self.server.standin._lock:
+            self.server.standin.connections += 1
+
+    def answer(self, body: bytes, kind: str):
+        standin = self.server.standin
+
+        if standin.latency:
+            time.sleep(standin.latency)
+
+        if standin.fail():
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', kind)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self.path.startswith('/hips-image-services/hips2fits'):
+            self.send_error(404)
+            return
+
+        # Services.hips2fits reads the parameters from a full URL.
+        body = self.server.standin.services.hips2fits(f'http://standin{self.path}')
+        self.answer(body, 'application/fits')
+
+    def do_POST(self):
+        if not self.path.startswith('/viz-bin/votable'):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        payload = self.rfile.read(length).decode()
+
+        # astroquery sends the query as "key=value" lines, or url-encoded, and
+        # a list of positions between "-c=<<====AstroqueryList" and
+        # "====AstroqueryList".
+        lines = payload.splitlines() if '\n' in payload else [f'{k}={v}' for k, v in parse_qsl(payload)]
+        params, positions, listing = {}, [], False
+
+        for line in lines:
+            if line == '====AstroqueryList':
+                listing = False
+            elif listing:
+                positions.append(line)
+            elif line == '-c=<<====AstroqueryList':
+                listing = True
+            elif '=' in line:
+                key, value = line.split('=', 1)
+                params[key] = value
+
+        centers = [re.match(r'([\d.]+)([+-][\d.]+)', c).groups() for c in positions or [params['-c']]]
+        ra, dec = (np.array(x, dtype=float) for x in zip(*centers))
+        width, height = (float(x) for x in params['-c.bd'].split('x'))
+
+        tables = self.server.standin.services.query_region(
+            SkyCoord(ra if positions else ra[0], dec if positions else dec[0], unit='deg'),
+            width=Angle(width, u.deg), height=Angle(height, u.deg), survey=params['-source'])
+
+        self.answer(votable(tables), 'text/xml')
+
+
+def votable(tables) -> bytes:
+    '''
+    Writes a TableList as the VOTable Vizier would send.
+    '''
+
+    body = io.BytesIO()
+    name = list(tables.keys())[0]
+
+    vot = from_table(tables[name])
+    vot.resources[0].tables[0].ID = name.replace('/', '_')
+    vot.resources[0].tables[0].name = name
+    vot.to_xml(body)
+
+    return body.getvalue()
+
+
+class StandIn:
+
+    '''
+    One mirror of hips2fits and Vizier, on a local port.
+
+    --------------
+    Attributes
+    --------------
+
+    services: benchmarks.synthetic.Services. Data of the answers.
+    latency: float. Time added to every answer (s).
+    error_rate: float. Fraction of the requests answered with 503.
+    hips2fits: str. Mirror of the hips2fits service, for variables.mirrors.
+    vizier: str. Mirror of the Vizier service, for variables.mirrors.
+    connections: int. Connections accepted so far.
+    '''
+
+    def __init__(self, services, latency=0., error_rate=0., seed=0):
+        self.services = services
+        self.latency = latency
+        self.error_rate = error_rate
+        self.connections = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server.standin = self
+
+        host, port = self.server.server_address
+        self.hips2fits = f'http://{host}:{port}/hips-image-services/hips2fits'
+        self.vizier = f'{host}:{port}'
+
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def fail(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+    def stop(self):
+        '''
+        Stops the server: its connections are refused from then on, as for
+        a host that is down.
+        '''
+
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@contextmanager
+def serving(*standins):
+    '''
+    Routes the hips2fits and Vizier requests of backend.fetch to the given
+    stand-ins, in order, with fresh hosts, an empty cache of cutouts, and with
+    the astroquery cache off.
+    '''
+
+    # The stand-ins speak plain HTTP, astroquery would use HTTPS.
+    def server_to_url(self, return_type='votable'):
+        return f'http://{self.VIZIER_SERVER}/viz-bin/{return_type}'
+
+    with mock.patch.dict(mirrors, {'hips2fits': [s.hips2fits for s in standins],
+                                   'vizier': [s.vizier for s in standins]}), \
+         mock.patch.dict(fetch.hosts, clear=True), \
+         mock.patch.dict(cutouts.cache, clear=True), \
+         mock.patch.object(VizierClass, '_server_to_url', server_to_url), \
+         cache_conf.set_temp('cache_active', False):
+        yield standins
@@ -0,0 +1,294 @@
+import io
+import json
+import time
+import numpy as np
+import requests
+from contextlib import contextmanager
+from collections import Counter
+from unittest import mock
+from urllib.parse import urlparse, parse_qs
+from astropy.table import Table, vstack
+from astropy.time import Time, TimeDelta
+from astropy.io import fits
+from astropy.wcs import WCS
+from astroquery.utils import TableList
+from astroquery.vizier import VizierClass
+from astroquery.mpc import MPCClass
+import astropy.units as u
+import backend.fetch as fetch
+import backend.cutouts as cutouts
+
+
+'''
+Synthetic ephemerides, catalogs and FITS cutouts for benchmarking the sky
+pipeline without touching the MPC, Vizier or hips2fits services.
+'''
+
+
+def ephemeris(n: int, ra0=150., dec0=2., rate=0.5, step=60, start='2024-03-01 00:00:00'):
+    '''
+    Returns an astropy Table shaped like the output of MPC.get_ephemeris.
+
+    --------------
+    Parameters
+    --------------
+
+    n: int. Number of epochs.
+    ra0, dec0: float. Position of the first epoch (deg).
+    rate: float. Apparent motion of the target (arcsec per epoch).
+    step: int. Time between epochs (s).
+    start: str. Date of the first epoch in YYYY-MM-DD hh:mm:ss format.
+    '''
+
+    steps = np.arange(n)
+    motion = steps * (rate * u.arcsec).to(u.deg).value
+
+    eph = Table()
+    eph['Date'] = Time(start, format='iso', scale='utc') + TimeDelta(steps * step, format='sec')
+    eph['RA'] = ra0 + motion / np.cos(np.radians(dec0))
+    eph['Dec'] = dec0 + 0.3 * motion
+
+    return eph
+
+
+def catalog(ra, dec, width, density=5., dup_frac=0.1, seed=None):
+    '''
+    Returns an astropy Table shaped like a V/154 (SDSS16) Vizier result
+    for a box centered on (ra, dec). Sources belong to several fieldIDs, and a
+    fraction of them is repeated under a second fieldID, the way overlapping
+    SDSS fields are.
+
+    --------------
+    Parameters
+    --------------
+
+    ra, dec: float. Center of the box (deg).
+    width: float. Side of the box (arcmin).
+    density: float. Sources per square arcmin.
+    dup_frac: float. Fraction of sources detected in a neighbouring field.
+    seed: int.
+    '''
+
+    rng = np.random.default_rng(seed)
+    n = max(int(density * width ** 2), 1)
+    half = (width / 2 * u.arcmin).to(u.deg).value
+
+    src_ra = ra + rng.uniform(-half, half, n) / np.cos(np.radians(dec))
+    src_de = dec + rng.uniform(-half, half, n)
+    # Survey fields are 3 arcmin wide strips in RA, so a box spans several.
+    strip = np.floor((src_ra - ra) * np.cos(np.radians(dec)) * 60 / 3).astype(int)
+    field = 1000 + rng.integers(0, 100) + 10 * strip
+
+    # Repeated detections, a fraction of an arcsec away, in another field.
+    dups = rng.choice(n, int(n * dup_frac), replace=False)
+    jitter = (0.1 * u.arcsec).to(u.deg).value
+    src_ra = np.concatenate([src_ra, src_ra[dups] + rng.normal(0, jitter, len(dups))])
+    src_de = np.concatenate([src_de, src_de[dups] + rng.normal(0, jitter, len(dups))])
+    field = np.concatenate([field, field[dups] + 1])
+
+    total = len(src_ra)
+    gmag = rng.uniform(14, 21, total)
+
+    cat = Table()
+    cat['RA_ICRS'] = src_ra
+    cat['DE_ICRS'] = src_de
+    cat['fieldID'] = field
+    cat['objID'] = rng.integers(10 ** 17, 10 ** 18, total)
+    cat['umag'] = gmag + rng.normal(1.2, 0.3, total)
+    cat['gmag'] = gmag
+    cat['rmag'] = gmag - rng.normal(0.4, 0.1, total)
+    cat['imag'] = gmag - rng.normal(0.6, 0.1, total)
+    cat['zmag'] = gmag - rng.normal(0.7, 0.1, total)
+
+    return cat
+
+
+def tmass(ra, dec, width, density=5., seed=None):
+    '''
+    Returns an astropy Table shaped like a II/246 (2MASS) Vizier result for
+    the same box and seed as catalog: its stars brighter than g = 19, a few
+    tenths of an arcsec away, plus a few stars seen only in the infrared.
+    '''
+
+    rng = np.random.default_rng(None if seed is None else seed + 1)
+    optical = catalog(ra, dec, width, density=density, dup_frac=0., seed=seed)
+    optical = optical[optical['gmag'] < 19]
+
+    jitter = (0.2 * u.arcsec).to(u.deg).value
+    n_ir = max(int(len(optical) * 0.05), 1)
+    half = (width / 2 * u.arcmin).to(u.deg).value
+
+    src_ra = np.concatenate([optical['RA_ICRS'] + rng.normal(0, jitter, len(optical)),
+                             ra + rng.uniform(-half, half, n_ir) / np.cos(np.radians(dec))])
+    src_de = np.concatenate([optical['DE_ICRS'] + rng.normal(0, jitter, len(optical)),
+                             dec + rng.uniform(-half, half, n_ir)])
+    jmag = np.concatenate([optical['gmag'] - rng.normal(1.5, 0.3, len(optical)),
+                           rng.uniform(12, 16, n_ir)])
+
+    total = len(src_ra)
+
+    cat = Table()
+    cat['2MASS'] = [f'{n:08d}+{seed or 0:07d}' for n in range(total)]
+    cat['RAJ2000'] = src_ra
+    cat['DEJ2000'] = src_de
+    cat['Jmag'] = jmag
+    cat['Hmag'] = jmag - rng.normal(0.4, 0.1, total)
+    cat['Kmag'] = jmag - rng.normal(0.5, 0.1, total)
+
+    return cat
+
+
+def cutout(ra, dec, fov, width, height, seed=None):
+    '''
+    Returns a fits.HDUList shaped like a hips2fits response: a single
+    PrimaryHDU with a TAN WCS centered on (ra, dec).
+
+    --------------
+    Parameters
+    --------------
+
+    ra, dec: float. Center of the image (deg).
+    fov: float. Width of the image (deg).
+    width, height: int. Image size in pixels.
+    seed: int.
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crval = [ra, dec]
+    wcs.wcs.crpix = [width / 2 + 0.5, height / 2 + 0.5]
+    wcs.wcs.cdelt = [-fov / width, fov / width]
+
+    data = rng.normal(1000., 30., (height, width)).astype(np.float32)
+
+    return fits.HDUList([fits.PrimaryHDU(data, header=wcs.to_header())])
+
+
+class Services:
+    '''
+    Stand-ins for the remote services used by the pipeline. Every call is
+    counted per service in self.requests.
+
+    --------------
+    Attributes
+    --------------
+
+    eph: astropy Table returned by the MPC stand-in, or dict of them by
+    target ID for several targets.
+    density: float. Catalog sources per square arcmin.
+    scale: float. Factor applied to the requested cutout size, to keep
+    large benchmarks within memory.
+    latency: float. Time every request takes (s), to mimic the network.
+    requests: collections.Counter. Number of requests per service.
+    '''
+
+    def __init__(self, eph, density=5., scale=1., latency=0.):
+        self.eph = eph
+        self.density = density
+        self.scale = scale
+        self.latency = latency
+        self.requests = Counter()
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_ephemeris(self, target=None, *args, **kwargs):
+        self.requests['mpc'] += 1
+        self.wait()
+        return self.eph[target] if isinstance(self.eph, dict) else self.eph
+
+    def query_region(self, coordinates, width=None, height=None, survey=None, **kwargs):
+        self.requests['vizier'] += 1
+        self.wait()
+
+        if coordinates.isscalar:
+            return TableList([self.field(coordinates, width, survey)])
+
+        # A list of positions is answered in one table, as Vizier does, whose
+        # _q column is the position of every row (1 for the first).
+        tables = []
+        for q, c in enumerate(coordinates, 1):
+            name, table = self.field(c, width, survey)
+            table['_q'] = np.full(len(table), q, dtype=np.int32)
+            tables.append(table)
+
+        return TableList({name: vstack(tables, metadata_conflicts='silent')})
+
+    def field(self, coordinates, width, survey) -> tuple:
+        ra, dec = coordinates.ra.deg, coordinates.dec.deg
+
+        # Seeded by the position, so that both catalogs see the same stars.
+        seed = int(round(ra * 3600) * 7919 + round(dec * 3600)) % 2 ** 31
+
+        if survey is not None and survey.startswith('II/246'):
+            return 'II/246/out', tmass(ra, dec, width.to(u.arcmin).value, density=self.density, seed=seed)
+
+        return 'V/154/sdss16', catalog(ra, dec, width.to(u.arcmin).value, density=self.density, seed=seed)
+
+    def hips2fits(self, url):
+        self.requests['hips2fits'] += 1
+        self.wait()
+        query = parse_qs(urlparse(url).query)
+
+        if 'wcs' in query:
+            # Cutout on a given grid (see backend.cutouts.detail), kept at full size.
+            header = fits.Header(json.loads(query['wcs'][0]))
+            rng = np.random.default_rng(self.requests['hips2fits'])
+            data = rng.normal(1000., 30., (header['NAXIS2'], header['NAXIS1'])).astype(np.float32)
+            hdul = fits.HDUList([fits.PrimaryHDU(data, header=WCS(header).to_header())])
+        else:
+            params = {k: float(v[0]) for k, v in query.items()
+                      if k in ('ra', 'dec', 'fov', 'width', 'height')}
+            width = max(int(params['width'] * self.scale), 8)
+            height = max(int(params['height'] * self.scale), 8)
+            hdul = cutout(params['ra'], params['dec'], params['fov'], width, height,
+                          seed=self.requests['hips2fits'])
+
+        body = io.BytesIO()
+        hdul.writeto(body)
+
+        return body.getvalue()
+
+
+class Adapter(requests.adapters.BaseAdapter):
+    '''
+    Transport adapter answering the HTTP requests of backend.fetch.session
+    with synthetic hips2fits cutouts.
+    '''
+
+    def __init__(self, services: Services):
+        super().__init__()
+        self.services = services
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.services.hips2fits(request.url)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def offline(services: Services):
+    '''
+    Routes the pipeline's MPC, Vizier and hips2fits calls to the given
+    Services instance for the duration of the block, with fresh rate limits
+    and circuit breakers (see backend.fetch), and an empty cache of cutouts.
+    '''
+
+    with mock.patch.object(MPCClass, 'get_ephemeris',
+                           lambda self, *args, **kwargs: services.get_ephemeris(*args, **kwargs)), \
+         mock.patch.object(VizierClass, 'query_region',
+                           lambda self, *args, **kwargs: services.query_region(*args, survey=self.catalog,
+                                                                               **kwargs)), \
+         mock.patch.dict(fetch.session.adapters, {'http://': Adapter(services)}), \
+         mock.patch.dict(fetch.hosts, clear=True), \
+         mock.patch.dict(cutouts.cache, clear=True):
+        yield services
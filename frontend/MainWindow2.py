@@ -1,6 +1,6 @@
 import sys
 import os
-from PyQt5.QtCore import pyqtSignal, Qt,  QThread
+from PyQt5.QtCore import pyqtSignal, Qt,  QThread, QTimer
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import (
     QApplication,
@@ -16,19 +16,27 @@ from PyQt5.QtWidgets import (
     QRadioButton,
     QProgressBar,
     QButtonGroup,
-    QSlider
+    QSlider,
+    QFileDialog,
+    QTableView,
+    QHeaderView,
+    QAbstractItemView
 )
 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-from matplotlib.widgets import Slider, Button
 import matplotlib.pyplot as plt
-import astropy.units as u
-from astropy.visualization.wcsaxes import add_scalebar
-from matplotlib.patches import FancyArrowPatch, Rectangle
-from astropy.visualization import (MinMaxInterval, SqrtStretch, AsinhStretch,
-                                   ImageNormalize, LogStretch, simple_norm)
-import astropy.units as u
+from matplotlib.figure import Figure
+from matplotlib.patches import FancyArrowPatch
+import numpy as np
+from frontend.hover import MarkerIndex
+from frontend.plotting import marker_arrays, scatter_markers
+from backend.projection import world_to_pixel
+from frontend.pyramid import ImagePyramid, PyramidView
+from frontend.overlay import FovOverlay
+from frontend.flagtable import FlagModel
+from backend.variables import session_path, session_ext, hips_surveys, band_sets, survey
+from backend.variables import zoom_upgrade, zoom_delay, timeline_cadence
 
 
 
@@ -43,10 +51,27 @@ class MainWindow(QMainWindow):
     signal_thread = pyqtSignal(str)
     signal_rotate = pyqtSignal(int)
     signal_date = pyqtSignal(str)
+    signal_sweep = pyqtSignal()
+    signal_timeline = pyqtSignal(str)
+    signal_save = pyqtSignal(str)
+    signal_open = pyqtSignal(str)
+    signal_target = pyqtSignal(str)
+    signal_cancel = pyqtSignal()
+    signal_band = pyqtSignal(str)
+    signal_zoom = pyqtSignal(dict)
+    signal_export = pyqtSignal(str)
 
     def __init__(self):
         super().__init__()
-        self.angle = None
+        self.angle = 0
+        self.hover_index = None
+        self.markers = None
+        self.annotation = None
+        self.overlay = None
+        self.view = None
+        self.background = None
+        self.sweep_window = None
+        self.timeline_window = None
         self.initialize_gui()
 
     def initialize_gui(self):
@@ -94,6 +119,13 @@ class MainWindow(QMainWindow):
 
         self.cat_cbox.addItems(self.instruments)
 
+        # Survey, or set of bands, of the images.
+        self.survey_label = QLabel('Survey', self)
+
+        self.survey_cbox = QComboBox()
+        self.survey_cbox.addItems(list(hips_surveys) + list(band_sets))
+        self.survey_cbox.setCurrentText(survey)
+
         # Step scroll menu.
         self.step_cbox = QComboBox()
         self.steps = ["s", "min", "h", "d"]
@@ -105,11 +137,36 @@ class MainWindow(QMainWindow):
             'font: bold 20px'
         )
 
-        self.bright_label = QLabel('Brightest objects:', self)
-        self.brightest_label = QLabel('', self)
+        # Flags of every epoch, in a table that only lays out the visible rows.
+        self.flags_title = QLabel('Flags:', self)
+
+        self.flag_kind = QComboBox(self)
+        self.flag_kinds = {'All flags': None, 'Brightest': 'brightest', 'Nearby': 'nearby'}
+        self.flag_kind.addItems(list(self.flag_kinds))
+        self.flag_kind.currentTextChanged.connect(lambda text: self.flag_model.set_kind(self.flag_kinds[text]))
+
+        self.export_button = QPushButton('Export Flags', self)
+        self.export_button.clicked.connect(self.clicked_export)
 
-        self.nearby_label = QLabel('Sources nearby:', self)
-        self.dist_label = QLabel('', self)
+        self.flag_model = FlagModel(self)
+        self.flag_view = QTableView(self)
+        self.flag_view.setModel(self.flag_model)
+        self.flag_view.setSortingEnabled(True)
+        self.flag_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.flag_view.setAlternatingRowColors(True)
+        self.flag_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.flag_view.verticalHeader().setDefaultSectionSize(20)
+        self.flag_view.horizontalHeader().setStretchLastSection(True)
+        self.flag_view.doubleClicked.connect(self.pick_flag)
+
+        # Sources inside the FOV footprint of the selected date.
+        self.contam_title = QLabel('Sources in FOV:', self)
+        self.contam_label = QLabel('', self)
+
+        # Timing breakdown of the last run.
+        self.timing_title = QLabel('Timing:', self)
+        self.timing_label = QLabel('', self)
+        self.timing_label.setStyleSheet('font-family: monospace')
 
 
         self.time_dot1 = QLabel(':', self)
@@ -274,6 +331,19 @@ class MainWindow(QMainWindow):
 
         self.op_datetime = QLabel('BEST SEEN:', self) # Label for best dates
         self.op_datetime.setStyleSheet('font: bold 15px')
+        self.best_label = QLabel('', self)
+
+        # Targets of a night plan (several comma-separated IDs).
+        self.target_cbox = QComboBox()
+        self.target_cbox.setPlaceholderText("Target")
+        self.target_cbox.setVisible(False)
+        self.target_cbox.textActivated.connect(self.signal_target.emit)
+
+        # Bands of the mosaic, when its survey is a band set.
+        self.band_cbox = QComboBox()
+        self.band_cbox.setPlaceholderText("Band")
+        self.band_cbox.setVisible(False)
+        self.band_cbox.textActivated.connect(self.signal_band.emit)
 
         # Progress bar
         self.prog_bar = QProgressBar(self)
@@ -282,12 +352,39 @@ class MainWindow(QMainWindow):
         self.query_button = QPushButton('Query', self)
         self.query_button.clicked.connect(self.clicked_query)
 
+        # Stops the running query, see Backend.cancel.
+        self.cancel_button = QPushButton('Cancel', self)
+        self.cancel_button.clicked.connect(self.signal_cancel.emit)
+
         self.exit_button = QPushButton('Exit', self)
         self.exit_button.clicked.connect(self.exit)
 
         self.fov_button = QPushButton('View Fov', self)
         self.fov_button.clicked.connect(self.get_coords)
 
+        self.sweep_button = QPushButton('Rotation Sweep', self)
+        self.sweep_button.clicked.connect(self.signal_sweep.emit)
+
+        # Contamination timeline, with the path sampled every cadence seconds.
+        self.timeline_button = QPushButton('Timeline', self)
+        self.timeline_button.clicked.connect(self.clicked_timeline)
+        self.cadence_label = QLabel('Cadence (s):', self)
+        self.cadence_inp = QLineEdit(f'{timeline_cadence:g}', self)
+        self.cadence_inp.setFixedWidth(50)
+
+        self.save_button = QPushButton('Save Session', self)
+        self.save_button.clicked.connect(self.clicked_save)
+
+        self.open_button = QPushButton('Open Session', self)
+        self.open_button.clicked.connect(self.clicked_open)
+
+        # FOV rotation, kept for every plot.
+        self.rot_label = QLabel('FOV Rotation: 0°', self)
+        self.rot_slider = QSlider(Qt.Horizontal, self)
+        self.rot_slider.setRange(0, 359)
+        self.rot_slider.setFixedWidth(200)
+        self.rot_slider.valueChanged.connect(self.rotate)
+
         self.utc_button = QRadioButton('UTC', self)
         self.etc_button = QRadioButton('Other', self)
 
@@ -303,6 +400,13 @@ class MainWindow(QMainWindow):
         self.toolbar = NavigationToolbar(self.canvas, self)
 
         self.canvas.mpl_connect('motion_notify_event', self.motion_hover)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+        # Asks for a sharper cutout of the view once zooming and panning stop.
+        self.zoom_timer = QTimer(self)
+        self.zoom_timer.setSingleShot(True)
+        self.zoom_timer.setInterval(zoom_delay)
+        self.zoom_timer.timeout.connect(self.request_detail)
 
         self.target_group = QButtonGroup(self)
         self.target_group.addButton(self.targ_button)
@@ -425,12 +529,14 @@ class MainWindow(QMainWindow):
 
         self.info_vbox5.addWidget(self.inst_label)
         self.info_vbox5.addWidget(self.cat_label)
+        self.info_vbox5.addWidget(self.survey_label)
         self.info_vbox5.addWidget(self.center_label)
 
         # Updating vbox 6.
 
         self.info_vbox6.addWidget(self.inst_cbox, alignment=Qt.AlignCenter)
         self.info_vbox6.addWidget(self.cat_cbox, alignment=Qt.AlignCenter)
+        self.info_vbox6.addWidget(self.survey_cbox, alignment=Qt.AlignCenter)
         self.info_vbox6.addWidget(self.date_cbox, alignment=Qt.AlignCenter)
 
         # Main central box layout init
@@ -474,8 +580,17 @@ class MainWindow(QMainWindow):
 
         self.button_box1.addStretch(1)
         self.button_box1.addWidget(self.query_button, alignment=Qt.AlignCenter)
+        self.button_box1.addWidget(self.cancel_button, alignment=Qt.AlignCenter)
         self.button_box1.addWidget(self.exit_button, alignment=Qt.AlignCenter)
         self.button_box1.addWidget(self.fov_button, alignment=Qt.AlignCenter)
+        self.button_box1.addWidget(self.sweep_button, alignment=Qt.AlignCenter)
+        self.button_box1.addWidget(self.timeline_button, alignment=Qt.AlignCenter)
+        self.button_box1.addWidget(self.cadence_label, alignment=Qt.AlignCenter)
+        self.button_box1.addWidget(self.cadence_inp, alignment=Qt.AlignCenter)
+        self.button_box1.addWidget(self.save_button, alignment=Qt.AlignCenter)
+        self.button_box1.addWidget(self.open_button, alignment=Qt.AlignCenter)
+        self.button_box1.addWidget(self.rot_label, alignment=Qt.AlignCenter)
+        self.button_box1.addWidget(self.rot_slider, alignment=Qt.AlignCenter)
         self.button_box1.addStretch(1)
 
         # Progress bar layout.
@@ -496,11 +611,21 @@ class MainWindow(QMainWindow):
         
         plot_info.addLayout(self.prog_hbox)
         plot_info.addWidget(self.results_label, alignment=Qt.AlignCenter)
+        plot_info.addWidget(self.target_cbox, alignment=Qt.AlignCenter)
+        plot_info.addWidget(self.band_cbox, alignment=Qt.AlignCenter)
         plot_info.addWidget(self.op_datetime, alignment=Qt.AlignCenter)
-        plot_info.addWidget(self.bright_label, alignment=Qt.AlignCenter)
-        plot_info.addWidget(self.brightest_label, alignment=Qt.AlignCenter)
-        plot_info.addWidget(self.nearby_label, alignment=Qt.AlignCenter)
-        plot_info.addWidget(self.dist_label)
+        plot_info.addWidget(self.best_label, alignment=Qt.AlignCenter)
+        flag_hbox = QHBoxLayout()
+        flag_hbox.addWidget(self.flags_title)
+        flag_hbox.addStretch(1)
+        flag_hbox.addWidget(self.flag_kind)
+        flag_hbox.addWidget(self.export_button)
+        plot_info.addLayout(flag_hbox)
+        plot_info.addWidget(self.flag_view)
+        plot_info.addWidget(self.contam_title, alignment=Qt.AlignCenter)
+        plot_info.addWidget(self.contam_label)
+        plot_info.addWidget(self.timing_title, alignment=Qt.AlignCenter)
+        plot_info.addWidget(self.timing_label)
 
         results = QHBoxLayout()
         results.addLayout(plot)
@@ -558,6 +683,7 @@ class MainWindow(QMainWindow):
             inputs['inst'] = self.inst_cbox.currentText()
             #inputs['rot'] = (self.rotate_inp.text(), self.rot_u.currentText())
             inputs['cat'] = (self.cat_cbox.currentText())
+            inputs['survey'] = self.survey_cbox.currentText()
 
             print(inputs)
             self.signal_valid_input.emit(inputs)
@@ -573,7 +699,8 @@ class MainWindow(QMainWindow):
                 'dec': dec,
                 'inst': self.inst_cbox.currentText(),
                 #'rot': (self.rotate_inp.text(), self.rot_u.currentText()),
-                'cat': self.cat_cbox.currentText()
+                'cat': self.cat_cbox.currentText(),
+                'survey': self.survey_cbox.currentText()
             }
 
             print(inputs)
@@ -729,6 +856,15 @@ class MainWindow(QMainWindow):
 
         self.prog_bar.setValue(percent)
         self.prog_msg.setText(display)
+
+    def update_timing(self, breakdown: str):
+        '''
+        Returns None.
+
+        Updates the label that holds the timing breakdown of the last run.
+        '''
+
+        self.timing_label.setText(breakdown)
     
         
     def error(self, msg):
@@ -747,6 +883,10 @@ class MainWindow(QMainWindow):
         of skys, the optimal WCS, and the final array for plotting.
         '''
 
+        # Imported on first use, so that the window shows before astropy is loaded.
+        import astropy.units as u
+        from astropy.visualization.wcsaxes import add_scalebar
+
         self.skys = info[0]
         wcs_out = info[1]
         array = info[2]
@@ -754,13 +894,18 @@ class MainWindow(QMainWindow):
         # clearing old figure
 
         self.figure.clear()
+        self.hover_index = None
         
-        # Plotting the mosaic.
-        norm = simple_norm(array, 'sqrt', percent=99.)
+        # Plotting the mosaic, through a pyramid so that only the tiles in view
+        # are drawn, at the resolution of the current zoom.
+        self.pyramid = ImagePyramid(array)
+        norm = self.pyramid.norm('sqrt', percent=99.)
 
-        self.ax = plt.subplot(projection=wcs_out)
+        self.ax = self.figure.add_subplot(projection=wcs_out)
 
-        self.ax.imshow(array, cmap='Greys', origin='lower', norm=norm)
+        self.view = PyramidView(self.ax, self.pyramid, cmap='Greys', norm=norm)
+        self.ax.callbacks.connect('xlim_changed', lambda ax: self.zoom_timer.start())
+        self.ax.callbacks.connect('ylim_changed', lambda ax: self.zoom_timer.start())
         self.ax.set_xlabel('Right Ascension', fontsize=15)
         self.ax.set_ylabel('Declination', fontsize=15)
         self.ax.grid(color='white', ls='solid', b=True)
@@ -772,53 +917,121 @@ class MainWindow(QMainWindow):
             textcoords='offset points',
             bbox={'boxstyle': 'round', 'fc': 'w'},
             arrowprops={'arrowstyle': '->'},
-            xycoords='axes fraction'
+            xycoords='data',
+            animated=True # Only drawn through blitting, see self.motion_hover.
         )
         self.annotation.set_visible(False)
 
-        self.targets = []
-
-
-        for sky in self.skys:
-            target = self.ax.plot(sky.coords.ra.value, sky.coords.dec.value, 
-                    '+', color='blue', mfc='None', 
-                    transform=self.ax.get_transform('world'), 
-                    ms=20, mew=0.5) # Center marker
-            
-            self.targets.append(target[0])
+        # One collection per kind of marker, placed in pixel coordinates.
+        self.markers = marker_arrays(self.skys, wcs_out)
+        scatter_markers(self.ax, self.markers)
             
         add_scalebar(self.ax, label="1'", length=1 * u.arcmin, 
                      color='black', label_top=True)
-    
-        self.figure.add_subplot(self.ax)
+
+        # Targets first, so that they win the hit-test over sources.
+        x = np.concatenate([self.markers['targets']['x'], self.markers['sources']['x']])
+        y = np.concatenate([self.markers['targets']['y'], self.markers['sources']['y']])
+        self.hover_index = MarkerIndex(self.ax, x, y)
+
+        self.overlay = FovOverlay(self.ax, wcs_out)
+        self.overlay.rotate(self.angle)
 
         self.canvas.draw()
 
-        self.update_progbar((100, "Successfully plotted mosaic."))
-        print("Succesfully plotted mosaic.")
+    def on_draw(self, event):
+        '''
+        Returns None.
+
+        After every full draw (including zooms, pans and resizes), caches the
+        rendered figure for blitting, draws the animated artists on top of it
+        and moves the hover index to the new display positions of the markers.
+        '''
+
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_animated()
+
+        if self.hover_index is not None:
+            self.hover_index.update()
+
+    def draw_animated(self):
+        '''
+        Returns None.
+
+        Draws the artists that are left out of full draws: the hover
+        annotation and the FOV footprints.
+        '''
+
+        if self.annotation is not None and self.annotation.get_visible():
+            self.figure.draw_artist(self.annotation)
+
+        if self.overlay is not None:
+            for artist in self.overlay.artists():
+                self.figure.draw_artist(artist)
+
+    def blit(self):
+        '''
+        Returns None.
+
+        Redraws the animated artists over the cached background, without
+        rendering the mosaic again.
+        '''
+
+        if self.background is None:
+            return
+
+        self.canvas.restore_region(self.background)
+        self.draw_animated()
+        self.canvas.blit(self.figure.bbox)
+
+    def hover_text(self, i: int) -> str:
+        '''
+        Returns str.
+
+        Annotation for the i-th marker of the hover index, built from the
+        metadata arrays of self.markers.
+        '''
+
+        targets = self.markers['targets']
+        if i < len(targets['x']):
+            return targets['date'][i]
+
+        sources = self.markers['sources']
+        i -= len(targets['x'])
+
+        return f"g = {sources['mag'][i]:.2f} mag\n{sources['sep'][i]:.1f}\" from target\non {sources['date'][i]}"
 
     def motion_hover(self, event):
+        '''
+        Returns None.
+
+        Shows the date of the target marker, or the magnitude and separation
+        of the source under the mouse.
+        '''
+
+        if self.hover_index is None or self.background is None:
+            return
+
         annotation_visibility = self.annotation.get_visible()
+        hit = None
+
         if event.inaxes == self.ax:
-            for sky, target_obj in zip(self.skys, self.targets):  # Loop through each sky and its target
-                is_contained, _ = target_obj.contains(event)
-                if is_contained:
-
-                    # Access the corresponding date
-                    hovered_date = sky.date.value
-
-                    # Format the annotation text with the date
-                    text_label = f"{hovered_date}"
-                    self.annotation.set_text(text_label)
-                    
-                    self.annotation.set_visible(True)
-                    self.canvas.draw_idle()
-                    return  # Exit after processing the first valid hover point
-            
-            # If no point is hovered, hide the annotation
-            if annotation_visibility:
-                self.annotation.set_visible(False)
-                self.canvas.draw_idle()
+            hit = self.hover_index.query(event.x, event.y)
+
+        if hit is not None:
+            xy = (self.hover_index.x[hit], self.hover_index.y[hit])
+            if annotation_visibility and self.annotation.xy == xy:
+                return
+
+            self.annotation.xy = xy
+            self.annotation.set_text(self.hover_text(hit))
+            self.annotation.set_visible(True)
+            self.blit()
+
+        # If no point is hovered, hide the annotation
+        elif annotation_visibility:
+            self.annotation.set_visible(False)
+            self.blit()
 
 
     def single_plot(self, info):
@@ -828,19 +1041,26 @@ class MainWindow(QMainWindow):
         Plots a single image on the canvas.
         '''
 
+        import astropy.units as u
+        from astropy.visualization import simple_norm
+        from astropy.visualization.wcsaxes import add_scalebar
+
         self.figure.clear()
+        self.view = None
+        self.hover_index = None
+        self.annotation = None
 
         norm = simple_norm(info['data'], 'sqrt', percent=99.)
 
-        self.ax = plt.subplot(projection=info['wcs'])
+        self.ax = self.figure.add_subplot(projection=info['wcs'])
 
         self.ax.imshow(info['data'], cmap='Greys', origin='lower', norm=norm)
         self.ax.set_xlabel('Right Ascension', fontsize=15)
         self.ax.set_ylabel('Declination', fontsize=15)
         self.ax.grid(color='white', ls='solid', b=True)
 
-        self.ax.plot(info['ra'], info['dec'], '+', color='blue', mfc='None', 
-                    transform=self.ax.get_transform('world'), 
+        x, y = world_to_pixel(info['wcs'], info['ra'], info['dec'])
+        self.ax.plot(x, y, '+', color='blue', mfc='None', 
                     ms=20, mew=0.5) # Center marker
         
         add_scalebar(self.ax, label="1'", length=1 * u.arcmin, 
@@ -861,20 +1081,14 @@ class MainWindow(QMainWindow):
         self.ax.text(72, 10, 'E', ha='left', va='center', 
                 fontsize=15, weight='bold')
 
-        
-        axfov = plt.axes([0.25, 0.15, 0.65, 0.03])
-        fov = Slider(axfov, self.figure, 'FOV Rotation', 0, 
-                     360, dragging=True)
-        
-        fov.on_changed(self.rotate)
-        
-        self.figure.add_subplot(self.ax)
+        # The FOV footprint is shown on the image center, and rotated with
+        # the FOV rotation slider.
+        self.overlay = FovOverlay(self.ax, info['wcs'])
+        self.overlay.rotate(self.angle)
+        self.overlay.show(self.inst_cbox.currentText(), info['ra'], info['dec'], info['fov'])
 
         self.canvas.draw()
 
-        self.update_progbar((100, "Succesfully plotted image."))
-        print("Succesfully plotted image.")
-
     def update_angle(self, deg: int):
         '''
         Returns int.
@@ -885,39 +1099,177 @@ class MainWindow(QMainWindow):
 
         self.angle = deg
 
-    def plot_fov(self, ra, dec, fov):
+    def rotate(self, deg: int):
         '''
         Returns None.
 
-        Plots the rectangle on the canvas with the chosen FOV.
+        Response to moving the FOV rotation slider. Only the footprint is
+        redrawn, by blitting.
         '''
 
-        d = (fov / 2) * u.arcmin
-        d_deg = d.to(u.deg).value
+        self.update_angle(deg)
+        self.rot_label.setText(f'FOV Rotation: {deg}°')
 
-        anchor_ra = ra - d_deg
-        anchor_de = dec - d_deg
-        
-        r = Rectangle((anchor_ra, anchor_de), (fov*u.arcmin).to(u.deg).value, 
-                      (fov*u.arcmin).to(u.deg).value, edgecolor='red', facecolor='none',
-                      transform=self.figure.get_axes()[0].get_transform('world'), 
-                      linewidth=0.8, linestyle='-', rotation_point=(ra, dec),
-                      angle=self.angle)
+        if self.overlay is not None:
+            self.overlay.rotate(deg)
+            self.blit()
 
-        self.figure.get_axes()[0].add_patch(r)
+        self.signal_rotate.emit(deg)
 
-    def update_bestseen(self):
-        pass
+    def plot_fov(self, footprint: dict):
+        '''
+        Returns None.
 
-    def update_flags(self, b_notice: str, dist_notice: str):
+        Moves the footprint of the chosen instrument FOV to the target position
+        on the selected date, and shows the sources that fall inside it.
+        '''
+
+        if self.overlay is None:
+            return
+
+        inst = self.inst_cbox.currentText()
+        contaminants = footprint['contaminants']
+
+        self.overlay.show(inst, footprint['ra'], footprint['dec'], footprint['fov'])
+        self.overlay.mark(contaminants['ra'], contaminants['dec'])
+        self.blit()
+
+        # Listing the brightest ones only.
+        brightest = sorted(zip(contaminants['mag'], contaminants['sep']))
+
+        text = f"{len(brightest)} sources in the {inst} FOV on {footprint['date']}"
+        for mag, sep in brightest[:10]:
+            text += f'\ng = {mag:.2f} mag at {sep:.1f}" from the target'
+
+        self.contam_label.setText(text)
+
+    def update_bestseen(self, text: str):
         '''
         Returns None.
 
-        Updates the labels that will hold the flag notices.
+        Updates the label that holds the best date and windows of the shown target.
         '''
-        
-        self.brightest_label.setText(b_notice)
-        self.dist_label.setText(dist_notice)
+
+        self.best_label.setText(text)
+
+    def update_targets(self, targets: list):
+        '''
+        Returns None.
+
+        Fills the QComboBox that selects the target of a night plan shown, and
+        shows it when there is more than one target.
+        '''
+
+        self.target_cbox.clear()
+        self.target_cbox.addItems(targets)
+        self.target_cbox.setVisible(len(targets) > 1)
+
+    def update_bands(self, bands: list):
+        '''
+        Returns None.
+
+        Fills the QComboBox that selects the band of the mosaic shown, and
+        shows it when there is more than one band.
+        '''
+
+        self.band_cbox.clear()
+        self.band_cbox.addItems(bands)
+        self.band_cbox.setVisible(len(bands) > 1)
+
+    def show_band(self, array):
+        '''
+        Returns None.
+
+        Shows the mosaic of another band of the same field, keeping the
+        markers, the FOV and the current zoom.
+        '''
+
+        if self.view is None:
+            return
+
+        self.pyramid = ImagePyramid(array)
+        self.view.set_pyramid(self.pyramid, norm=self.pyramid.norm('sqrt', percent=99.))
+        self.canvas.draw()
+
+        # The sharper cutout of the view was of the previous band.
+        self.request_detail()
+
+    def request_detail(self):
+        '''
+        Returns None.
+
+        Asks the backend for a sharper cutout of the part of the mosaic in
+        view, when it is zoomed in past zoom_upgrade screen pixels per mosaic
+        pixel.
+        '''
+
+        if self.view is None:
+            return
+
+        x0, x1 = sorted(self.ax.get_xlim())
+        y0, y1 = sorted(self.ax.get_ylim())
+        pixels = self.ax.bbox.width
+
+        if pixels / max(x1 - x0, 1e-9) < zoom_upgrade:
+            return
+
+        self.signal_zoom.emit({'x0': x0, 'x1': x1, 'y0': y0, 'y1': y1, 'pixels': pixels,
+                               'shape': self.pyramid.shape})
+
+    def show_detail(self, info: dict):
+        '''
+        Returns None.
+
+        Draws a sharper cutout of a part of the mosaic over it, unless the
+        mosaic changed since it was asked for.
+        '''
+
+        if self.view is None or tuple(info['shape']) != self.pyramid.shape:
+            return
+
+        self.view.set_detail(info['data'], info['extent'])
+        self.canvas.draw_idle()
+
+    def update_flags(self, flags, radius: float):
+        '''
+        Returns None.
+
+        Shows the flags of a track (see backend.flags) in the flag table.
+        radius: float. Flagging radius (arcsec).
+        '''
+
+        self.flag_model.set_flags(flags)
+        self.flags_title.setText(f'Flags ({len(flags)}, nearby within {radius:g}"):')
+
+    def pick_flag(self, index):
+        '''
+        Returns None.
+
+        Response to double-clicking on a flag: shows the FOV on its date.
+        '''
+
+        row = self.flag_model.rows[index.row()]
+        date = np.datetime_as_string(self.flag_model.flags['date'][row], unit='ms')
+
+        self.date_cbox.setCurrentText(date.replace('T', ' '))
+        self.get_coords()
+
+    def clicked_export(self):
+        '''
+        Returns None.
+
+        Asks for a CSV or Parquet file and sends its path to the backend to
+        export every flag of the shown target.
+        '''
+
+        path, kind = QFileDialog.getSaveFileName(self, 'Export Flags', 'flags.csv',
+                                                 'CSV (*.csv);;Parquet (*.parquet)')
+
+        if path:
+            ext = '.parquet' if kind.startswith('Parquet') else '.csv'
+            if not path.lower().endswith(('.csv', '.parquet')):
+                path += ext
+            self.signal_export.emit(path)
 
     def update_datebox(self, dates: list):
         '''
@@ -927,6 +1279,7 @@ class MainWindow(QMainWindow):
         place the FOV rectangle.
         '''
 
+        self.date_cbox.clear()
         self.date_cbox.addItems(dates)
 
     def get_coords(self):
@@ -934,11 +1287,262 @@ class MainWindow(QMainWindow):
         self.signal_date.emit(self.date_cbox.currentText())
 
 
+    def show_sweep(self, sweep: dict):
+        '''
+        Returns None.
+
+        Opens the date x rotation heatmap of the FOV contamination.
+        '''
+
+        self.sweep_window = SweepWindow(sweep, self.pick_sweep)
+
+    def pick_sweep(self, date: str, angle: int):
+        '''
+        Returns None.
+
+        Response to clicking on the rotation sweep heatmap: shows the FOV on
+        that date with that rotation.
+        '''
+
+        self.date_cbox.setCurrentText(date)
+        self.rot_slider.setValue(angle)
+        self.get_coords()
+
+    def clicked_timeline(self):
+        '''
+        Returns None.
+
+        Sends the cadence of the contamination timeline to the backend.
+        '''
+
+        self.signal_timeline.emit(self.cadence_inp.text())
+
+    def show_timeline(self, timeline: dict):
+        '''
+        Returns None.
+
+        Opens the timeline of the stars within the flagging radius.
+        '''
+
+        self.timeline_window = TimelineWindow(timeline, self.pick_timeline)
+
+    def pick_timeline(self, date: str):
+        '''
+        Returns None.
+
+        Response to clicking on the timeline: shows the FOV on the epoch
+        closest to that time.
+        '''
+
+        self.date_cbox.setCurrentText(date)
+        self.get_coords()
+
+    def clicked_save(self):
+        '''
+        Returns None.
+
+        Asks for a session file and sends its path to the backend to save the
+        current session.
+        '''
+
+        os.makedirs(session_path, exist_ok=True)
+        path, _ = QFileDialog.getSaveFileName(self, 'Save Session', session_path,
+                                              f'Sessions (*{session_ext})')
+
+        if path:
+            if not path.endswith(session_ext):
+                path += session_ext
+            self.signal_save.emit(path)
+
+    def clicked_open(self):
+        '''
+        Returns None.
+
+        Asks for a session file and sends its path to the backend to open it.
+        '''
+
+        path, _ = QFileDialog.getOpenFileName(self, 'Open Session', session_path,
+                                              f'Sessions (*{session_ext})')
+
+        if path:
+            self.signal_open.emit(path)
+
+    def update_inst(self, inst: str):
+        '''
+        Returns None.
+
+        Selects the instrument of an opened session, so that its FOV is drawn.
+        '''
+
+        self.inst_cbox.setCurrentText(inst)
+
     def exit(self):
         self.close()
 
 
 
+class SweepWindow(QDialog):
+
+    '''
+    Heatmaps of the number of sources and of the flux inside the FOV for
+    every date and FOV rotation. The rotation with the least flux on every
+    date is marked. Clicking on a cell calls pick(date, angle).
+    '''
+
+    def __init__(self, sweep, pick=None):
+        super().__init__()
+        self.sweep = sweep
+        self.pick = pick
+        self.initialize_gui()
+
+    def initialize_gui(self):
+        self.setWindowTitle("FOV Rotation Sweep")
+        self.setGeometry(150, 150, 900, 600)
+
+        sweep = self.sweep
+        angles = sweep['angles']
+        rows = np.arange(len(sweep['dates']))
+        step = angles[1] - angles[0] if len(angles) > 1 else 1
+        extent = (angles[0] - step / 2, angles[-1] + step / 2, -0.5, len(rows) - 0.5)
+
+        self.figure = Figure()
+        self.canvas = FigureCanvas(self.figure)
+        self.canvas.mpl_connect('button_press_event', self.clicked)
+
+        ax_n, ax_f = self.figure.subplots(1, 2, sharey=True)
+
+        im = ax_n.imshow(sweep['counts'], origin='lower', aspect='auto', extent=extent,
+                         cmap='viridis', interpolation='nearest')
+        self.figure.colorbar(im, ax=ax_n, label='Sources in FOV')
+
+        with np.errstate(divide='ignore'):
+            im = ax_f.imshow(np.log10(sweep['flux']), origin='lower', aspect='auto',
+                             extent=extent, cmap='magma', interpolation='nearest')
+        self.figure.colorbar(im, ax=ax_f, label='log10 flux in FOV (0 mag = 1)')
+
+        for ax in (ax_n, ax_f):
+            ax.plot(sweep['best'], rows, '.', color='white', ms=3)
+            ax.set_xlabel('FOV Rotation (deg)')
+
+        # Labelling a few dates only.
+        ticks = rows[::max(len(rows) // 10, 1)]
+        ax_n.set_yticks(ticks)
+        ax_n.set_yticklabels([sweep['dates'][i] for i in ticks], fontsize=7)
+
+        vbox = QVBoxLayout()
+        vbox.addWidget(QLabel('Click on a cell to show the FOV on that date and rotation.', self))
+        vbox.addWidget(self.canvas)
+        self.setLayout(vbox)
+
+        self.canvas.draw()
+        self.show()
+
+    def clicked(self, event):
+        if event.inaxes is None or self.pick is None:
+            return
+
+        row = int(round(event.ydata))
+        angles = self.sweep['angles']
+        angle = angles[np.argmin(np.abs(angles - event.xdata))]
+
+        if 0 <= row < len(self.sweep['dates']):
+            self.pick(self.sweep['dates'][row], int(round(angle)))
+
+
+class TimelineWindow(QDialog):
+
+    '''
+    Contamination timeline of a track (see backend.timeline): how many stars
+    are within the flagging radius of the target over time, and every
+    interval a star spends within it, at the height of its magnitude and
+    colored by its closest distance. Clicking on an interval describes it and
+    calls pick(date) with the epoch closest to its closest approach.
+    '''
+
+    def __init__(self, timeline, pick=None):
+        super().__init__()
+        self.timeline = timeline
+        self.pick = pick
+        self.initialize_gui()
+
+    def initialize_gui(self):
+        import matplotlib.dates as mdates
+
+        self.setWindowTitle("Contamination Timeline")
+        self.setGeometry(150, 150, 1000, 650)
+
+        tl = self.timeline
+        start, end = tl['start'], tl['end']
+
+        # Matplotlib dates count days from 1970-01-01, MJD 40587.
+        def to_date(mjd):
+            return np.asarray(mjd) - 40587.
+
+        self.figure = Figure()
+        self.canvas = FigureCanvas(self.figure)
+        self.canvas.mpl_connect('button_press_event', self.clicked)
+
+        ax_n, ax_i = self.figure.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [1, 3]})
+
+        # Stars within the radius on every sample, from the interval edges.
+        step = tl['cadence'] / 86400
+        samples = tl['epochs'][0] + step * np.arange(tl['samples'])
+        counts = (np.searchsorted(np.sort(start), samples + step / 2)
+                  - np.searchsorted(np.sort(end), samples - step / 2))
+
+        ax_n.step(to_date(samples), counts, where='mid', color='tab:red', lw=1)
+        ax_n.set_ylabel('Stars within\n{:g}"'.format(tl['radius']))
+
+        mag = np.where(np.isnan(tl['mag']), np.nanmax(tl['mag'], initial=25.) + 1, tl['mag'])
+        # Single samples get the width of a sample.
+        ax_i.hlines(mag, to_date(start - step / 2), to_date(end + step / 2),
+                            colors=plt.cm.viridis(tl['min_sep'] / max(tl['radius'], 1e-9)), lw=3)
+        self.figure.colorbar(plt.cm.ScalarMappable(plt.Normalize(0, tl['radius']), 'viridis'),
+                             ax=[ax_n, ax_i], label='Closest distance (arcsec)')
+        ax_i.invert_yaxis()
+        ax_i.set_ylabel('g magnitude')
+        ax_i.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:%M'))
+        ax_i.set_xlabel('UTC')
+
+        for epoch in to_date(tl['epochs'][[0, -1]]):
+            for ax in (ax_n, ax_i):
+                ax.axvline(epoch, color='grey', lw=0.5, ls='--')
+
+        self.mag = mag
+        self.info = QLabel(f"{len(start)} intervals within {tl['radius']:g} arcsec, "
+                           f"{tl['samples']} samples every {tl['cadence']:g} s. "
+                           f"Click on an interval to describe it and show the FOV.", self)
+
+        vbox = QVBoxLayout()
+        vbox.addWidget(self.info)
+        vbox.addWidget(self.canvas)
+        self.setLayout(vbox)
+
+        self.canvas.draw()
+        self.show()
+
+    def clicked(self, event):
+        tl = self.timeline
+
+        if event.inaxes is None or not len(tl['start']):
+            return
+
+        # Interval closest to the click, in time, then in magnitude.
+        mjd = event.xdata + 40587.
+        gap = np.maximum(tl['start'] - mjd, 0) + np.maximum(mjd - tl['end'], 0)
+        k = int(np.lexsort((np.abs(self.mag - (event.ydata or 0)), gap))[0])
+
+        from astropy.time import Time
+        start, end, closest = Time([tl['start'][k], tl['end'][k], tl['closest'][k]], format='mjd').iso
+
+        self.info.setText(f"Star at RA {tl['ra'][k]:.5f}, Dec {tl['dec'][k]:.5f}, g = {tl['mag'][k]:.2f}: "
+                          f"within {tl['radius']:g} arcsec from {start} to {end}, closest "
+                          f"({tl['min_sep'][k]:.1f} arcsec) at {closest}.")
+
+        if self.pick is not None and tl['dates']:
+            self.pick(tl['dates'][int(np.argmin(np.abs(tl['epochs'] - tl['closest'][k])))])
+
+
 class ErrorWindow(QDialog):
     def __init__(self, msg=None):
         super().__init__()
@@ -0,0 +1,136 @@
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+
+'''
+Table model of the flags of a track (see backend.flags), for a QTableView.
+'''
+
+
+class FlagModel(QAbstractTableModel):
+
+    '''
+    Read-only model over the array of flags, which it never copies: the view
+    only asks for the cells it shows, and they are formatted then. Sorting and
+    filtering only reorder an array of row indices, so they stay fast with
+    tens of thousands of flags.
+
+    -------------
+    Attributes
+    -------------
+
+    flags: numpy array of backend.flags.flag_dtype.
+    rows: numpy array. Rows of flags shown, in display order.
+    kind: str or None. Kind of flag shown, None for all.
+    order: tuple. (column, Qt.SortOrder) of the last sort, or None.
+
+    -------------
+    Methods
+    -------------
+
+    set_flags: Shows a new array of flags.
+    set_kind: Shows the flags of one kind only.
+    '''
+
+    # Field of flag_dtype, header and format of every column.
+    columns = [
+        ('date', 'Date (UTC)', None),
+        ('kind', 'Flag', '{}'),
+        ('mag', 'g (mag)', '{:.3f}'),
+        ('sep', 'Separation (")', '{:.2f}'),
+        ('source', 'Source ID', '{}'),
+        ('ra', 'RA (deg)', '{:.6f}'),
+        ('dec', 'Dec (deg)', '{:.6f}')
+    ]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.flags = None
+        self.rows = np.empty(0, dtype=np.int64)
+        self.kind = None
+        self.order = None
+
+    def set_flags(self, flags):
+        self.beginResetModel()
+        self.flags = flags
+        self._select()
+        self.endResetModel()
+
+    def set_kind(self, kind):
+        self.beginResetModel()
+        self.kind = kind
+        self._select()
+        self.endResetModel()
+
+    def _select(self):
+        if self.flags is None:
+            self.rows = np.empty(0, dtype=np.int64)
+            return
+
+        if self.kind is None:
+            self.rows = np.arange(len(self.flags))
+        else:
+            self.rows = np.flatnonzero(self.flags['kind'] == self.kind)
+
+        if self.order is not None:
+            self._sort(*self.order)
+
+    def _sort(self, column: int, order):
+        values = self.flags[self.columns[column][0]][self.rows]
+
+        # Stable, with NaN last in both orders.
+        if values.dtype.kind == 'f':
+            keys = np.argsort(values, kind='stable')
+            if order == Qt.DescendingOrder:
+                nan = np.isnan(values[keys])
+                keys = np.concatenate([keys[~nan][::-1], keys[nan]])
+        else:
+            keys = np.argsort(values, kind='stable')
+            if order == Qt.DescendingOrder:
+                keys = keys[::-1]
+
+        self.rows = self.rows[keys]
+
+    def sort(self, column: int, order=Qt.AscendingOrder):
+        if self.flags is None:
+            return
+
+        self.layoutAboutToBeChanged.emit()
+        self.order = (column, order)
+        self._sort(column, order)
+        self.layoutChanged.emit()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        name, _, fmt = self.columns[index.column()]
+
+        if role == Qt.DisplayRole:
+            value = self.flags[name][self.rows[index.row()]]
+
+            if fmt is None:
+                return np.datetime_as_string(value, unit='s').replace('T', ' ')
+            if value != value: # NaN
+                return ''
+            return fmt.format(value)
+
+        if role == Qt.TextAlignmentRole and name not in ('date', 'kind'):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+
+        if orientation == Qt.Horizontal:
+            return self.columns[section][1]
+
+        return str(section + 1)
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+'''
+Hit-testing of plot markers against the mouse position.
+'''
+
+
+class MarkerIndex:
+
+    '''
+    Spatial hash of the display positions of a set of markers, so that
+    finding the marker under the mouse takes the same time whatever the
+    number of markers.
+
+    -------------
+    Attributes
+    -------------
+
+    ax: matplotlib Axes the markers are drawn on.
+    x, y: numpy arrays. Marker positions in data (pixel) coordinates.
+    radius: float. Hit radius in display pixels, also the size of the grid cells.
+    keys: numpy array. Sorted cell key of every marker.
+    order: numpy array. Marker index for every entry of keys.
+    disp: numpy array. Display position of every marker, shape (n, 2).
+
+    -------------
+    Methods
+    -------------
+
+    update: Recomputes the display positions, after a zoom, pan or resize.
+    query: Returns the index of the marker under a display position.
+    '''
+
+    def __init__(self, ax, x, y, radius=8.):
+        self.ax = ax
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.radius = radius
+        self.keys = np.empty(0, dtype=np.int64)
+        self.order = np.empty(0, dtype=np.int64)
+        self.disp = np.empty((0, 2))
+        self.update()
+
+    @staticmethod
+    def _key(cx, cy):
+        # Packs the two cell indices into one integer.
+        return (cx.astype(np.int64) << 32) + cy.astype(np.int64)
+
+    def update(self):
+        '''
+        Transforms every marker to display coordinates once and rebuilds the
+        grid. Called after every full draw of the canvas.
+        '''
+
+        if not len(self.x):
+            return
+
+        self.disp = self.ax.transData.transform(np.column_stack([self.x, self.y]))
+        cells = np.floor(self.disp / self.radius)
+        keys = self._key(cells[:, 0], cells[:, 1])
+
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def query(self, xd: float, yd: float):
+        '''
+        Returns the index of the marker closest to the display position
+        (xd, yd) within self.radius, or None. Only the 3x3 cells around the
+        position are looked at.
+        '''
+
+        if not len(self.keys):
+            return None
+
+        cx, cy = np.floor(xd / self.radius), np.floor(yd / self.radius)
+        ox, oy = np.meshgrid([-1, 0, 1], [-1, 0, 1])
+        wanted = self._key(cx + ox.ravel(), cy + oy.ravel())
+
+        lo = np.searchsorted(self.keys, wanted, side='left')
+        hi = np.searchsorted(self.keys, wanted, side='right')
+
+        if not (hi - lo).any():
+            return None
+
+        candidates = np.concatenate([self.order[a:b] for a, b in zip(lo, hi)])
+        dist = np.hypot(self.disp[candidates, 0] - xd, self.disp[candidates, 1] - yd)
+        best = np.argmin(dist)
+
+        if dist[best] > self.radius:
+            return None
+
+        return int(candidates[best])
@@ -0,0 +1,137 @@
+import numpy as np
+from matplotlib.patches import Rectangle
+from matplotlib.transforms import Affine2D
+from backend.projection import world_to_pixel
+
+
+'''
+Instrument FOV footprints drawn over the mosaic.
+'''
+
+
+class FovOverlay:
+
+    '''
+    Persistent layer with one footprint artist per instrument. Changing the
+    date or the rotation only moves the artist by updating its transform;
+    the artists are animated, so they are drawn by blitting over the cached
+    canvas background and never trigger a full redraw.
+
+    -------------
+    Attributes
+    -------------
+
+    ax: WCSAxes the footprints are drawn on.
+    wcs: astropy.wcs.WCS of the image shown on ax.
+    patches: dict. Footprint artist of every instrument shown so far.
+    current: str or None. Instrument whose footprint is visible.
+    center: tuple. Pixel coordinates of the footprint center.
+    size: float. Side of the footprint in pixels.
+    angle: float. Rotation of the footprint (deg).
+    marks: PathCollection. Markers on the sources inside the footprint.
+
+    -------------
+    Methods
+    -------------
+
+    show: Places the footprint of an instrument on a sky position.
+    rotate: Changes the rotation of the visible footprint.
+    mark: Marks the sources inside the footprint.
+    artists: Visible footprint artists, for blitting.
+    '''
+
+    def __init__(self, ax, wcs):
+        self.ax = ax
+        self.wcs = wcs
+        self.patches = {}
+        self.current = None
+        self.center = (0., 0.)
+        self.size = 1.
+        self.angle = 0.
+
+        from astropy.wcs.utils import proj_plane_pixel_scales
+
+        # Mean pixel size of the image (deg).
+        self.scale = np.mean(proj_plane_pixel_scales(wcs.celestial))
+
+        self.marks = ax.scatter([], [], s=15 ** 2, marker='o', facecolors='none',
+                                edgecolors='yellow', linewidths=1., animated=True)
+
+    def _patch(self, inst):
+        if inst not in self.patches:
+            # Unit square centered on the origin, placed by its transform.
+            patch = Rectangle((-0.5, -0.5), 1, 1, edgecolor='red', facecolor='none',
+                              linewidth=0.8, linestyle='-', animated=True)
+            patch.set_visible(False)
+            self.ax.add_patch(patch)
+            self.patches[inst] = patch
+
+        return self.patches[inst]
+
+    def _update(self):
+        if self.current is None:
+            return
+
+        transform = (Affine2D()
+                     .scale(self.size)
+                     .rotate_deg(self.angle)
+                     .translate(*self.center))
+
+        self.patches[self.current].set_transform(transform + self.ax.transData)
+
+    def show(self, inst: str, ra: float, dec: float, fov: float):
+        '''
+        Returns None.
+
+        Shows the footprint of the given instrument centered on (ra, dec),
+        hiding the footprints of the other instruments.
+
+        --------------
+        Parameters
+        --------------
+
+        inst: str. Instrument name.
+        ra, dec: float. Center of the footprint (deg).
+        fov: float. Side of the instrument FOV (arcmin).
+        '''
+
+        for name, patch in self.patches.items():
+            patch.set_visible(name == inst)
+
+        x, y = world_to_pixel(self.wcs, ra, dec)
+
+        self.current = inst
+        self.center = (float(x), float(y))
+        self.size = (fov / 60) / self.scale
+
+        self._patch(inst).set_visible(True)
+        self._update()
+
+    def rotate(self, angle: float):
+        '''
+        Returns None.
+
+        Rotates the visible footprint around its center (deg).
+        '''
+
+        self.angle = angle
+        self._update()
+
+    def mark(self, ra, dec):
+        '''
+        Returns None.
+
+        Moves the contaminant markers to the given positions (deg).
+        '''
+
+        x, y = world_to_pixel(self.wcs, ra, dec)
+        self.marks.set_offsets(np.column_stack([x, y]))
+
+    def artists(self) -> list:
+        '''
+        Returns the visible footprint artists.
+        '''
+
+        patches = [patch for patch in self.patches.values() if patch.get_visible()]
+
+        return patches + [self.marks]
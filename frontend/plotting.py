@@ -1,23 +1,114 @@
-from reproject import reproject_interp
-from reproject.mosaicking import reproject_and_coadd, find_optimal_celestial_wcs
+import numpy as np
 import matplotlib.pyplot as plt
-import astropy.units as u
-from astropy.visualization.wcsaxes import add_scalebar
 from matplotlib.patches import FancyArrowPatch
-from astropy.visualization import (MinMaxInterval, SqrtStretch, AsinhStretch,
-                                   ImageNormalize, LogStretch, simple_norm)
+from backend.projection import world_to_pixel
 
 '''
 Plotting methods.
+
+astropy and reproject are imported inside the functions that draw images,
+so that importing this module for marker_arrays does not load them.
 '''
 
 
+def marker_arrays(skys, wcs):
+    '''
+    skys: iterable that contains Sky objects.
+    wcs: astropy.wcs.WCS object of the image the markers are drawn on.
+
+    Gathers the epoch centers, catalog sources and flagged sources of every sky
+    into flat arrays, with their pixel coordinates computed in one vectorized
+    pass per kind of marker. Sources, distances and flags are read from the
+    SourceStore of the track, and the pixels of a sky drawn on its own image
+    from the offsets cached by the Sky. Sources seen by several overlapping
+    skys (same dedup ID) are kept once.
+    Returns a dict with one dict of arrays per kind of marker:
+
+    'targets': x, y, ra, dec, date.
+    'sources': x, y, ra, dec, mag (g band), sep (arcsec from the target), date.
+    'flagged': x, y, ra, dec, date.
+
+    The 'date' arrays hold the date of the sky each marker belongs to, as text.
+    '''
+
+    def pixels(info):
+        if 'x' not in info:
+            info['x'], info['y'] = world_to_pixel(wcs, info['ra'], info['dec'])
+        return info
+
+    targets = {
+        'ra': np.array([sky.coords.ra.deg for sky in skys]),
+        'dec': np.array([sky.coords.dec.deg for sky in skys]),
+        'date': np.array([f'{sky.date.value}' for sky in skys])
+    }
+
+    store = skys[0].store
+    rows, owner = store.rows([sky.num for sky in skys])
+
+    # Overlapping skys hold the same catalog rows, drawn only once.
+    _, first = np.unique(store.uid[rows], return_index=True)
+    first = np.sort(first)
+
+    sources = {
+        'ra': store.ra[rows[first]],
+        'dec': store.dec[rows[first]],
+        'mag': store.band('g')[rows[first]],
+        'sep': store.sep[rows[first]] * 3600.,
+        'date': targets['date'][owner[first]]
+    }
+
+    if len(skys) == 1 and skys[0].wcs is wcs:
+        x, y = skys[0].pixels()
+        sources['x'], sources['y'] = x[first], y[first]
+
+    hits = store.flagged[rows]
+
+    flagged = {
+        'ra': store.ra[rows[hits]],
+        'dec': store.dec[rows[hits]],
+        'date': targets['date'][owner[hits]]
+    }
+
+    info = {
+        'targets': pixels(targets),
+        'sources': pixels(sources),
+        'flagged': pixels(flagged)
+    }
+
+    return info
+
+
+def scatter_markers(ax, markers, ms_target=20, ms_source=25):
+    '''
+    ax: WCSAxes object.
+    markers: dict returned by marker_arrays.
+
+    Draws every kind of marker as a single collection, in pixel coordinates.
+    Returns the target, source and flagged source collections.
+    '''
+
+    sources = ax.scatter(markers['sources']['x'], markers['sources']['y'], s=ms_source ** 2,
+                         marker='o', facecolors='none', edgecolors='red', linewidths=0.5)
+
+    flagged = ax.scatter(markers['flagged']['x'], markers['flagged']['y'], s=(0.8 * ms_source) ** 2,
+                         marker='o', facecolors='none', edgecolors='lime', linewidths=0.5)
+
+    targets = ax.scatter(markers['targets']['x'], markers['targets']['y'], s=ms_target ** 2,
+                         marker='+', color='blue', linewidths=0.5) # Center markers
+
+    return targets, sources, flagged
+
+
 def plot_region(sky):
     
     '''
     Takes a Sky object and accesses all of the corresponding attributes to make a plot
     of the sky region.
     '''
+
+    import astropy.units as u
+    from astropy.visualization import simple_norm
+    from astropy.visualization.wcsaxes import add_scalebar
     
     fig = plt.figure(figsize=(11, 11))
     norm = simple_norm(sky.img_data, 'sqrt', percent=99.)
@@ -25,15 +116,8 @@ def plot_region(sky):
     ax = plt.subplot(projection=sky.wcs)
 
     ax.imshow(sky.img_data, cmap='Greys', origin='lower', norm=norm)
-    ax.plot(sky.source_ra, sky.source_de, 'o', color='red', mfc='None',
-    transform=ax.get_transform('world'), ms=25, mew=0.5)
-    
-    ax.plot(sky.coords.ra.value, sky.coords.dec.value, '+', color='blue', mfc='None',
-            transform=ax.get_transform('world'), ms=20, mew=0.5) # Center marker
-    
-    if sky.flagged_ra != [] and sky.flagged_de != []: # Make sure the flagged lists aren't empty.
-        ax.plot(sky.flagged_ra, sky.flagged_de, 'o', color='lime', mfc='None',
-            transform=ax.get_transform('world'), ms=20, mew=0.5)
+
+    scatter_markers(ax, marker_arrays([sky], sky.wcs))
         
     ax.set_xlabel('Right Ascension', fontsize=15)
     ax.set_ylabel('Declination', fontsize=15)
@@ -66,12 +150,21 @@ def mosaic(skys):
     Receives an iterable that contains Sky objects and creates a mosaic using their
     PrimaryHDUs.
     '''
+
+    import astropy.units as u
+    from astropy.visualization import simple_norm
+    from astropy.visualization.wcsaxes import add_scalebar
+    from reproject import reproject_interp
+    from reproject.mosaicking import reproject_and_coadd, find_optimal_celestial_wcs
     
-    sky_hdus = [sky.hdu for sky in skys] # Storing the PrimaryHDU objects of each sky FITS
+    from backend.cutouts import values
+
+    sky_hdus = list({id(sky.hdu): sky.hdu for sky in skys}.values()) # PrimaryHDUs, once per shared image
     wcs_out, shape_out = find_optimal_celestial_wcs(sky_hdus, frame='icrs') 
     # Creating an optimal WCS and shape for the final image
     
-    array, footprint = reproject_and_coadd(sky_hdus,
+    # Values of the images, whichever way they are stored (see backend.cutouts.compact).
+    array, footprint = reproject_and_coadd([(values(hdu), hdu.header) for hdu in sky_hdus],
                                        wcs_out, shape_out=shape_out,
                                        reproject_function=reproject_interp)
 
@@ -90,9 +183,7 @@ def mosaic(skys):
     ax.set_ylabel('Declination', fontsize=15)
     ax.grid(color='white', ls='solid', b=True)
 
-    for sky in skys:
-        ax.plot(sky.coords.ra.value, sky.coords.dec.value, '+', color='blue', mfc='None',
-                transform=ax.get_transform('world'), ms=20, mew=0.5) # Center marker
+    scatter_markers(ax, marker_arrays(skys, wcs_out))
         
     add_scalebar(ax, label="1'", length=1 * u.arcmin, color='black', label_top=True)
 
@@ -0,0 +1,250 @@
+import numpy as np
+
+
+'''
+Multi-resolution display of large mosaics.
+'''
+
+
+# Stretch classes of astropy.visualization, looked up when a norm is made.
+stretches = {
+    'linear': 'LinearStretch',
+    'sqrt': 'SqrtStretch',
+    'log': 'LogStretch',
+    'asinh': 'AsinhStretch'
+}
+
+
+def downsample(array):
+    '''
+    Halves the resolution of a 2D array by averaging 2x2 blocks, ignoring NaNs.
+    Odd sizes are padded with NaN, or with the edge for integer arrays, which
+    keep their type.
+    '''
+
+    h, w = array.shape
+    if array.dtype.kind in 'iu':
+        if h % 2 or w % 2:
+            array = np.pad(array, ((0, h % 2), (0, w % 2)), mode='edge')
+
+        blocks = array.reshape(array.shape[0] // 2, 2, array.shape[1] // 2, 2)
+
+        return np.round(blocks.mean(axis=(1, 3), dtype=np.float32)).astype(array.dtype)
+
+    if h % 2 or w % 2:
+        array = np.pad(array, ((0, h % 2), (0, w % 2)), constant_values=np.nan)
+
+    blocks = array.reshape(array.shape[0] // 2, 2, array.shape[1] // 2, 2)
+    valid = np.isfinite(blocks)
+
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    count = valid.sum(axis=(1, 3))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (total / count).astype(np.float32)
+
+
+class ImagePyramid:
+
+    '''
+    Tiled image pyramid of a mosaic, built once per mosaic. Level k holds the
+    image downsampled by 2**k, and every level is split in square tiles.
+
+    -------------
+    Attributes
+    -------------
+
+    levels: list of 2D numpy arrays. levels[0] is the full resolution image.
+    tile: int. Side of the tiles in pixels of their level.
+    shape: tuple. Shape of the full resolution image.
+
+    -------------
+    Methods
+    -------------
+
+    norm: Normalization estimated from a subsample of the image.
+    level_for: Level that matches a zoom.
+    tiles: Tiles of a level that overlap a region.
+    tile_data: Data and extent of a tile.
+    '''
+
+    def __init__(self, array, tile=512):
+        self.tile = tile
+        self.shape = array.shape
+        self.levels = [array]
+
+        while max(self.levels[-1].shape) > tile:
+            self.levels.append(downsample(self.levels[-1]))
+
+    def norm(self, stretch='sqrt', percent=99., sample=200_000, seed=0):
+        '''
+        Returns an ImageNormalize with the same limits simple_norm would give
+        for the given percent, estimated from a random subsample of at most
+        sample pixels instead of the whole image.
+        '''
+
+        import astropy.visualization as visualization
+
+        ImageNormalize = visualization.ImageNormalize
+        stretch = getattr(visualization, stretches[stretch])
+
+        full = self.levels[0].ravel()
+        rng = np.random.default_rng(seed)
+
+        if full.size > sample:
+            full = full[rng.integers(0, full.size, sample)]
+
+        full = full[np.isfinite(full)]
+        if not full.size:
+            return ImageNormalize(vmin=0, vmax=1, stretch=stretch())
+
+        low, high = np.percentile(full, [(100 - percent) / 2, (100 + percent) / 2])
+
+        return ImageNormalize(vmin=low, vmax=high, stretch=stretch(), clip=True)
+
+    def level_for(self, scale: float) -> int:
+        '''
+        Returns the coarsest level whose pixels are not larger than the screen
+        pixels, given the number of full resolution pixels per screen pixel.
+        '''
+
+        if scale <= 1:
+            return 0
+
+        return int(min(np.floor(np.log2(scale)), len(self.levels) - 1))
+
+    def tiles(self, level: int, x0, x1, y0, y1) -> list:
+        '''
+        Returns the (level, row, column) keys of the tiles of a level that
+        overlap the region [x0, x1] x [y0, y1], in full resolution pixels.
+        '''
+
+        factor = 2 ** level * self.tile
+        rows, cols = self.levels[level].shape
+
+        c0 = max(int(np.floor((x0 + 0.5) / factor)), 0)
+        c1 = min(int(np.floor((x1 + 0.5) / factor)), (cols - 1) // self.tile)
+        r0 = max(int(np.floor((y0 + 0.5) / factor)), 0)
+        r1 = min(int(np.floor((y1 + 0.5) / factor)), (rows - 1) // self.tile)
+
+        return [(level, r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)]
+
+    def tile_data(self, key):
+        '''
+        Returns the data of a tile (a view of its level) and its extent in full
+        resolution pixel coordinates, as used by imshow.
+        '''
+
+        level, r, c = key
+        t, f = self.tile, 2 ** level
+
+        data = self.levels[level][r * t:(r + 1) * t, c * t:(c + 1) * t]
+        rows, cols = data.shape
+
+        extent = (c * t * f - 0.5, (c * t + cols) * f - 0.5,
+                  r * t * f - 0.5, (r * t + rows) * f - 0.5)
+
+        return data, extent
+
+
+class PyramidView:
+
+    '''
+    Shows an ImagePyramid on a matplotlib Axes. Every time the limits of the
+    axes change (zoom, pan), picks the level matching the zoom and shows only
+    the tiles in view. Tile images are created on demand and reused.
+
+    -------------
+    Attributes
+    -------------
+
+    ax: matplotlib Axes.
+    pyramid: ImagePyramid.
+    images: dict. AxesImage of every tile created so far.
+    kwargs: dict. Keyword arguments for imshow (cmap, norm...).
+    max_images: int. Number of hidden tile images kept around.
+    detail: AxesImage or None. Sharper image of a part of the pyramid, drawn
+    over its tiles (see set_detail).
+    '''
+
+    def __init__(self, ax, pyramid, max_images=64, **kwargs):
+        self.ax = ax
+        self.pyramid = pyramid
+        self.images = {}
+        self.kwargs = kwargs
+        self.max_images = max_images
+        self.detail = None
+
+        h, w = pyramid.shape
+        ax.set_xlim(-0.5, w - 0.5)
+        ax.set_ylim(-0.5, h - 0.5)
+        ax.set_autoscale_on(False)
+
+        ax.callbacks.connect('xlim_changed', self.refresh)
+        ax.callbacks.connect('ylim_changed', self.refresh)
+
+        self.refresh()
+
+    def set_pyramid(self, pyramid, **kwargs):
+        '''
+        Returns None.
+
+        Shows another pyramid of the same shape, e.g. another band, with the
+        given imshow keyword arguments updated, without changing the view.
+        '''
+
+        for image in self.images.values():
+            image.remove()
+
+        self.images = {}
+        self.pyramid = pyramid
+        self.kwargs.update(kwargs)
+        self.set_detail(None)
+        self.refresh()
+
+    def set_detail(self, data, extent=None):
+        '''
+        Returns None.
+
+        Draws a sharper image of a part of the pyramid over its tiles, in
+        place of the previous one, or removes it if data is None.
+
+        data: 2D numpy array or None.
+        extent: tuple. Extent of data in full resolution pixel coordinates.
+        '''
+
+        if self.detail is not None:
+            self.detail.remove()
+            self.detail = None
+
+        if data is not None:
+            # Above the tiles, which are drawn at the default zorder of images.
+            self.detail = self.ax.imshow(data, origin='lower', extent=extent, zorder=0.5,
+                                         **self.kwargs)
+
+    def refresh(self, ax=None):
+        '''
+        Returns None.
+
+        Shows the tiles in view at the level matching the current zoom, and
+        hides every other tile.
+        '''
+
+        x0, x1 = sorted(self.ax.get_xlim())
+        y0, y1 = sorted(self.ax.get_ylim())
+
+        scale = (x1 - x0) / max(self.ax.bbox.width, 1)
+        level = self.pyramid.level_for(scale)
+        visible = set(self.pyramid.tiles(level, x0, x1, y0, y1))
+
+        for key, image in self.images.items():
+            image.set_visible(key in visible)
+
+        for key in visible - self.images.keys():
+            data, extent = self.pyramid.tile_data(key)
+            self.images[key] = self.ax.imshow(data, origin='lower', extent=extent,
+                                              **self.kwargs)
+
+        hidden = [key for key in self.images if key not in visible]
+        for key in hidden[:max(len(hidden) - self.max_images, 0)]:
+            self.images.pop(key).remove()
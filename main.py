@@ -1,39 +1,104 @@
 import sys
+import logging
+from PyQt5.QtCore import Qt, QTimer, QThread
 from PyQt5.QtWidgets import QApplication
-from frontend.MainWindow2 import MainWindow
-from backend.backend import Backend
 
 
 # Authors: Michaël Marsset, Claudia Rodríguez. 2024
 
-if __name__ == '__main__':
 
-    print(f"{'-' * 10} ** PREVENTING STELLAR CONTAMINATION IN MOVING OBJECTS ** {'-' * 10}")
+def connect(front, back):
+    '''
+    Connects the signals of the frontend and the backend.
+    '''
 
-    # For printing errors in the terminal.
-    def hook(type_, value, traceback):
-        print(type_)
-        print(traceback)
-
-    sys.__excepthook__ = hook
-    app =  QApplication([])
-
-    # Creating an instance of the front and back end windows
-    back = Backend()
-    front = MainWindow()
-
-    # Signal connecting
     front.signal_valid_input.connect(back.validation)
     back.signal_error.connect(front.error)
     back.signal_plot.connect(front.plot)
     back.signal_splot.connect(front.single_plot)
     back.signal_progress.connect(front.update_progbar)
     back.signal_flags.connect(front.update_flags)
+    front.signal_export.connect(back.export_flags)
     back.signal_dates.connect(front.update_datebox)
     front.signal_date.connect(back.send_skyfov)
     back.signal_skyfov.connect(front.plot_fov)
+    front.signal_rotate.connect(back.set_rotation)
+    front.signal_sweep.connect(back.send_sweep)
+    back.signal_sweep.connect(front.show_sweep)
+    front.signal_timeline.connect(back.send_timeline)
+    back.signal_timeline.connect(front.show_timeline)
+    back.signal_timing.connect(front.update_timing)
+    front.signal_save.connect(back.save_session)
+    front.signal_open.connect(back.open_session)
+    back.signal_inst.connect(front.update_inst)
+    back.signal_best.connect(front.update_bestseen)
+    back.signal_targets.connect(front.update_targets)
+    front.signal_target.connect(back.select_target)
+    back.signal_bands.connect(front.update_bands)
+    back.signal_image.connect(front.show_band)
+    front.signal_band.connect(back.select_band)
+    front.signal_zoom.connect(back.zoom)
+    back.signal_detail.connect(front.show_detail)
+
+    # Run by the GUI thread right away, while the backend's thread is busy
+    # with the query.
+    front.signal_cancel.connect(back.cancel, Qt.DirectConnection)
+
+
+def start(argv=None):
+    '''
+    Shows the window, then connects the backend and starts loading the heavy
+    modules in the background (see backend.warmup). The backend runs on its
+    own thread, so that the window stays responsive and the queries can be
+    cancelled. Returns the application, the window and the backend.
+    '''
 
+    app = QApplication(argv if argv is not None else [])
 
-    # Showing the window.
+    from frontend.MainWindow2 import MainWindow
+    from backend.backend import Backend
+    from backend.warmup import warm_up
+    from backend.variables import warm_modules
+
+    # Creating an instance of the front and back end windows
+    front = MainWindow()
     front.show()
+
+    back = Backend()
+
+    worker = QThread(app)
+    back.moveToThread(worker)
+    worker.start()
+
+    # Abandons a running query, so that the thread can stop.
+    def stop():
+        back.cancel()
+        worker.quit()
+        worker.wait()
+
+    app.aboutToQuit.connect(stop)
+
+    connect(front, back)
+
+    # Once the event loop runs, so that the window is painted first.
+    QTimer.singleShot(0, lambda: warm_up(warm_modules))
+
+    return app, front, back
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s: %(message)s')
+
+    print(f"{'-' * 10} ** PREVENTING STELLAR CONTAMINATION IN MOVING OBJECTS ** {'-' * 10}")
+
+    # For printing errors in the terminal.
+    def hook(type_, value, traceback):
+        print(type_)
+        print(traceback)
+
+    sys.__excepthook__ = hook
+
+    app, front, back = start()
+
     sys.exit(app.exec())